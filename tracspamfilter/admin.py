@@ -23,9 +23,10 @@ from trac.core import *
 from trac.util import format_datetime, pretty_timedelta, shorten_line, sorted
 from trac.web import Request, HTTPNotFound
 from trac.web.chrome import add_link, add_stylesheet, ITemplateProvider
+from tracspamfilter.circuitbreaker import CircuitBreaker
 from tracspamfilter.filtersystem import FilterSystem
 from tracspamfilter.api import add_domain, _, N_, gettext
-from tracspamfilter.model import LogEntry
+from tracspamfilter.model import LogEntry, PatternStatistics
 from tracspamfilter.filters.akismet import AkismetFilterStrategy
 from tracspamfilter.filters.spamwipe import SpamWipeFilterStrategy
 from tracspamfilter.filters.stopforumspam import StopForumSpamFilterStrategy
@@ -34,6 +35,7 @@ from tracspamfilter.filters.botscout import BotScoutFilterStrategy
 from tracspamfilter.filters.fspamlist import FSpamListFilterStrategy
 from tracspamfilter.filters.blogspam import BlogSpamFilterStrategy
 from tracspamfilter.filters.typepad import TypePadFilterStrategy
+from tracspamfilter.filters.regex import RegexFilterStrategy
 from tracspamfilter.captcha import ICaptchaMethod
 from tracspamfilter.captcha.recaptcha import RecaptchaCaptcha
 from tracspamfilter.captcha.keycaptcha import KeycaptchaCaptcha
@@ -128,6 +130,10 @@ class SpamFilterAdminPageProvider(Component):
                     'karma_help': gettext(strategy.__class__.karma_points.__doc__)}
             strategies.append(info)
 
+        last_purge, purge_count = filtersys.get_purge_status()
+        if last_purge is not None:
+            last_purge = pretty_timedelta(last_purge)
+
         return {
             'strategies': sorted(strategies, key=lambda x: x['name']),
             'min_karma': filtersys.min_karma,
@@ -136,6 +142,8 @@ class SpamFilterAdminPageProvider(Component):
             'trust_authenticated': filtersys.trust_authenticated,
             'logging_enabled': filtersys.logging_enabled,
             'purge_age': filtersys.purge_age,
+            'last_purge': last_purge,
+            'purge_count': purge_count,
             'spam_monitor_entries_min' : self.MIN_PER_PAGE,
             'spam_monitor_entries_max' : self.MAX_PER_PAGE,
             'spam_monitor_entries' : self.DEF_PER_PAGE
@@ -411,6 +419,20 @@ class ExternalAdminPageProvider(Component):
             httpbl_api_key = self.config.get('spam-filter', 'httpbl_api_key')
             ip_blacklist_servers = self.config.get('spam-filter', 'ip_blacklist_servers')
 
+        filtersys = FilterSystem(self.env)
+        if filtersys.circuit_breaker:
+            breakers = []
+            for strategy in filtersys.strategies:
+                if strategy.is_external():
+                    name = strategy.__class__.__name__
+                    breaker = CircuitBreaker.get(self.env, name)
+                    breakers.append({'name': name[:-14],
+                                     'state': breaker.state,
+                                     'calls': len(breaker.calls),
+                                     'failures': breaker.failures,
+                                     'latency': breaker.latency})
+            data['breakers'] = sorted(breakers, key=lambda x: x['name'])
+
         if HttpBLFilterStrategy:
             data['blacklists'] = 1
         if DefensioFilterStrategy:
@@ -468,10 +490,20 @@ class BayesAdminPageProvider(Component):
                     self.log.warn('Bayes test failed: %s', e, exc_info=True)
                     data['error'] = unicode(e)
 
+            elif 'prune' in req.args:
+                try:
+                    data['prune_count'] = int(req.args['prune_count'])
+                    data['prune_age'] = int(req.args['prune_age'])
+                except ValueError:
+                    data['prune_error'] = _('Count and age must be numbers.')
+                else:
+                    data['pruned'] = hammie.bayes.prune(data['prune_count'],
+                                                        data['prune_age'])
+
             else:
                 if 'reset' in req.args:
                     self.log.info('Resetting SpamBayes training database')
-                    env.db_transaction("DELETE FROM spamfilter_bayes")
+                    bayes.reset()
 
                 try:
                     min_training = int(req.args['min_training'])
@@ -492,14 +524,68 @@ class BayesAdminPageProvider(Component):
                 ratio = _("(ratio 1 : %.1f)") % (float(nham)/float(nspam))
 
         data['_'] = _
+        data.setdefault('prune_count', 1)
+        data.setdefault('prune_age', 90)
         data.update({'min_training': bayes.min_training,
                      'nspam': nspam,
                      'nham': nham,
-                     'ratio': ratio})
+                     'ratio': ratio,
+                     'stats': hammie.bayes.statistics()})
 
         add_stylesheet(req, 'spamfilter/admin.css')
         return 'admin_bayes.html', data
 
+class PatternsAdminPageProvider(Component):
+    """Web administration panel showing the statistics of the BadContent
+    patterns."""
+
+    implements(IAdminPanelProvider)
+
+    # IAdminPanelProvider methods
+
+    def get_admin_panels(self, req):
+        if req.perm.has_permission('SPAM_CONFIG') and \
+                self.env.is_component_enabled(RegexFilterStrategy):
+            yield ('spamfilter', _("Spam Filtering"), 'patterns',
+                   _("BadContent"))
+
+    def render_admin_panel(self, req, cat, page, path_info):
+        req.perm.assert_permission('SPAM_CONFIG')
+
+        strategy = RegexFilterStrategy(self.env)
+        strategy.flush_stats()
+
+        if req.method == 'POST':
+            if 'reset' in req.args:
+                PatternStatistics.delete(self.env, strategy.stats_source)
+            req.redirect(req.href.admin(cat, page))
+
+        order = req.args.get('order', 'time')
+        if order not in ('pattern', 'hits', 'lasthit', 'time', 'average'):
+            order = 'time'
+        desc = req.args.get('desc', '1') == '1'
+
+        stats = PatternStatistics.select(self.env, strategy.stats_source)
+        patterns = []
+        for pattern in sorted(set([p.pattern for p in strategy.patterns])):
+            hits, lasthit, searches, time = stats.get(pattern,
+                                                      (0, None, 0, 0.0))
+            patterns.append({
+                'pattern': pattern, 'hits': hits, 'lasthit': lasthit,
+                'timedelta': lasthit and pretty_timedelta(lasthit),
+                'searches': searches, 'time': time,
+                'average': searches and time / searches or 0.0
+            })
+        patterns.sort(key=lambda row: row[order], reverse=desc)
+
+        data = {'_': _, 'patterns': patterns, 'order': order, 'desc': desc,
+                'profile': strategy.profile,
+                'rejected': [(p.pattern, duration) for p, duration
+                             in strategy.rejected],
+                'unused': len([row for row in patterns if not row['hits']])}
+        add_stylesheet(req, 'spamfilter/admin.css')
+        return 'admin_patterns.html', data
+
 class CaptchaAdminPageProvider(Component):
     """Web administration panel for configuring the Captcha handling."""
 
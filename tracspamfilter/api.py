@@ -24,11 +24,15 @@ _, tag_, N_, add_domain, gettext = domain_functions(
     'tracspamfilter', 
     ('_', 'tag_', 'N_', 'add_domain', 'gettext'))
 
-__all__ = ['RejectContent', 'IFilterStrategy']
+__all__ = ['RejectContent', 'ServiceError', 'IFilterStrategy']
 
 class RejectContent(TracError):
     """Exception raised when content is rejected by a filter."""
 
+class ServiceError(Exception):
+    """Exception raised by a filter strategy when the external service it
+    queries failed to answer. The strategy has logged the error already."""
+
 class IFilterStrategy(Interface):
 
     """ Is this an service sending data to external servers """
@@ -43,7 +47,17 @@ class IFilterStrategy(Interface):
         description of why the score is being affected.
         
         If the filter strategy does not want (or is not able) to effectively
-        test the submission, it should return `None`.
+        test the submission, it should return `None`. If the external service
+        it queries fails, it should raise a `ServiceError`.
+        """
+
+    def get_max_karma():
+        """Return the maximum number of karma points, positive or negative,
+        the strategy can assign to a single submission.
+
+        This method is optional. If it is not implemented, the absolute value
+        of the `karma_points` option of the strategy is used. Return `None`
+        if the points are not bounded.
         """
 
     def train(req, author, content, ip, spam=True):
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import os
+import sqlite3
+from threading import Lock, local
+
+__all__ = ['SQLiteStore']
+
+
+class SQLiteStore(object):
+    """Keep the Bayes training data in a dedicated SQLite database file.
+
+    The store offers the `db_query` and `db_transaction` context managers
+    of an environment, so that it can be used in place of the Trac database.
+    The tables are created when the file is opened the first time by a
+    process, so that files written by older versions get new tables, too.
+
+    A thread takes a connection from a pool when it enters the outermost
+    context manager and gives it back when it leaves it. At most
+    `pool_size` idle connections are kept open. There is one store per file
+    and process.
+    """
+
+    _stores = {}
+    _stores_lock = Lock()
+
+    schema = [
+        "CREATE TABLE IF NOT EXISTS system "
+        "(name text PRIMARY KEY, value text)",
+        "CREATE TABLE IF NOT EXISTS spamfilter_bayes "
+        "(word text PRIMARY KEY, nspam integer, nham integer, "
+        "lastseen integer)",
+        "CREATE TABLE IF NOT EXISTS spamfilter_bayes_summary "
+        "(name text PRIMARY KEY, value integer)",
+        "CREATE TABLE IF NOT EXISTS spamfilter_bayes_top "
+        "(word text PRIMARY KEY, nspam integer, nham integer)",
+    ]
+
+    pool_size = 5
+    timeout = 10.0
+
+    def __init__(self, path, log=None):
+        self.path = path
+        self.log = log
+        self._local = local()
+        self._pool = []
+        self._pool_lock = Lock()
+        self._create()
+
+    def get(cls, path, log=None):
+        """Return the store for the database file at `path`."""
+        path = os.path.normcase(os.path.abspath(path))
+        with cls._stores_lock:
+            if path not in cls._stores:
+                cls._stores[path] = cls(path, log)
+            store = cls._stores[path]
+            if log is not None:
+                store.log = log
+            return store
+
+    get = classmethod(get)
+
+    def db_query(self):
+        return _QueryContextManager(self)
+
+    db_query = property(db_query)
+
+    def db_transaction(self):
+        return _TransactionContextManager(self)
+
+    db_transaction = property(db_transaction)
+
+    def close(self):
+        """Close the idle connections of the pool."""
+        with self._pool_lock:
+            pool = self._pool
+            self._pool = []
+        for cnx in pool:
+            cnx.close()
+
+    # Internal methods
+
+    def _acquire(self):
+        """Return the connection of the current thread, taking one from the
+        pool when the thread enters the outermost context manager."""
+        local = self._local
+        local.depth = getattr(local, 'depth', 0) + 1
+        if local.depth == 1:
+            with self._pool_lock:
+                cnx = self._pool and self._pool.pop() or None
+            if cnx is None:
+                cnx = self._connect()
+            local.cnx = cnx
+        return local.cnx
+
+    def _release(self):
+        """Give the connection back to the pool when the current thread
+        leaves the outermost context manager."""
+        local = self._local
+        local.depth -= 1
+        if local.depth == 0:
+            cnx = local.cnx
+            local.cnx = None
+            with self._pool_lock:
+                if len(self._pool) < self.pool_size:
+                    self._pool.append(cnx)
+                    cnx = None
+            if cnx is not None:
+                cnx.close()
+
+    def _connect(self):
+        return _Connection(sqlite3.connect(self.path, timeout=self.timeout,
+                                           check_same_thread=False))
+
+    def _create(self):
+        exists = os.path.exists(self.path)
+        dirname = os.path.dirname(self.path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        cnx = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            cursor = cnx.cursor()
+            for stmt in self.schema:
+                cursor.execute(stmt)
+            cnx.commit()
+        finally:
+            cnx.close()
+        if self.log and not exists:
+            self.log.info('Created Bayes storage %s', self.path)
+
+
+class _Cursor(sqlite3.Cursor):
+    """Cursor taking parameters in the `%s` style of the Trac database."""
+
+    def execute(self, sql, args=None):
+        if args:
+            sql = sql % (('?',) * len(args))
+        return sqlite3.Cursor.execute(self, sql, args or [])
+
+    def executemany(self, sql, args):
+        if not args:
+            return
+        sql = sql % (('?',) * len(args[0]))
+        return sqlite3.Cursor.executemany(self, sql, args)
+
+
+class _Connection(object):
+    """Connection offering the shortcuts of the Trac database
+    connections."""
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+
+    def cursor(self):
+        return self.cnx.cursor(_Cursor)
+
+    def execute(self, query, params=None):
+        """Execute a query, and return all rows of a SELECT."""
+        cursor = self.cursor()
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+    __call__ = execute
+
+    def executemany(self, query, params=None):
+        cursor = self.cursor()
+        cursor.executemany(query, params)
+
+    def commit(self):
+        self.cnx.commit()
+
+    def rollback(self):
+        self.cnx.rollback()
+
+    def close(self):
+        self.cnx.close()
+
+
+class _ContextManager(object):
+
+    def __init__(self, store):
+        self.store = store
+
+    def execute(self, query, params=None):
+        """Shortcut for directly executing a query."""
+        with self as db:
+            return db.execute(query, params)
+
+    __call__ = execute
+
+    def executemany(self, query, params=None):
+        """Shortcut for directly calling "executemany" on a query."""
+        with self as db:
+            return db.executemany(query, params)
+
+
+class _QueryContextManager(_ContextManager):
+
+    def __enter__(self):
+        return self.store._acquire()
+
+    def __exit__(self, et, ev, tb):
+        self.store._release()
+
+
+class _TransactionContextManager(_ContextManager):
+    """The outermost transaction of a thread commits on normal exit and rolls
+    back after an exception."""
+
+    def __enter__(self):
+        local = self.store._local
+        local.transactions = getattr(local, 'transactions', 0) + 1
+        return self.store._acquire()
+
+    def __exit__(self, et, ev, tb):
+        local = self.store._local
+        local.transactions -= 1
+        try:
+            if local.transactions == 0:
+                if et is None:
+                    local.cnx.commit()
+                else:
+                    local.cnx.rollback()
+        finally:
+            self.store._release()
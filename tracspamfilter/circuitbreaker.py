@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from threading import Lock
+import time
+
+__all__ = ['CircuitBreaker']
+
+
+class CircuitBreaker(object):
+    """Keep track of the recent calls to an external service and stop calling
+    it while it is failing or too slow.
+
+    The breaker is `closed` as long as the service works. When the share of
+    failed calls among the last `window` calls reaches `error_rate` percent,
+    it is `opened` and the service is not called for `retry_time` seconds.
+    Afterwards it is `half-open`: a single trial call is allowed, which
+    closes the breaker again when it succeeds and reopens it otherwise. A
+    caller which was allowed to call the service but didn't must `release()`
+    the trial.
+
+    Breakers are shared by all threads of a process, one per environment and
+    strategy.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    _breakers = {}
+    _breakers_lock = Lock()
+
+    def __init__(self, name):
+        self.name = name
+        self.state = self.CLOSED
+        self.calls = []
+        self.changed = time.time()
+        self.trial = None
+        self._lock = Lock()
+
+    def get(cls, env, name):
+        """Return the breaker for the service `name` in the environment."""
+        key = (env.path, name)
+        with cls._breakers_lock:
+            if key not in cls._breakers:
+                cls._breakers[key] = cls(name)
+            return cls._breakers[key]
+
+    get = classmethod(get)
+
+    def allow(self, retry_time):
+        """Return whether the service may be called now."""
+        now = time.time()
+        with self._lock:
+            if self.state == self.OPEN and now - self.changed >= retry_time:
+                self._change(self.HALF_OPEN, now)
+            if self.state == self.HALF_OPEN:
+                # allow a single trial call at a time, but don't wait for a
+                # trial which never reported back forever
+                if self.trial is not None and now - self.trial < retry_time:
+                    return False
+                self.trial = now
+            return self.state != self.OPEN
+
+    def release(self):
+        """Give back the trial call reserved by `allow()` if the service
+        was not called after all."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.trial = None
+
+    def record(self, success, latency, window, error_rate, max_latency):
+        """Record the result of a call to the service.
+
+        A call counts as failed if it did not succeed or took longer than
+        `max_latency` seconds.
+        """
+        failed = not success or (max_latency > 0 and latency > max_latency)
+        now = time.time()
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.trial = None
+                self.calls = []
+                if failed:
+                    self._change(self.OPEN, now)
+                else:
+                    self._change(self.CLOSED, now)
+            self.calls.append((failed, latency))
+            del self.calls[:-max(window, 1)]
+            if self.state == self.CLOSED and len(self.calls) >= window and \
+                    error_rate > 0 and \
+                    self.failures * 100 >= error_rate * len(self.calls):
+                self._change(self.OPEN, now)
+
+    def failures(self):
+        return len([call for call in self.calls if call[0]])
+
+    failures = property(failures)
+
+    def latency(self):
+        """Average latency of the recent calls in seconds."""
+        if not self.calls:
+            return 0.0
+        return sum([call[1] for call in self.calls]) / len(self.calls)
+
+    latency = property(latency)
+
+    def _change(self, state, now):
+        self.state = state
+        self.changed = now
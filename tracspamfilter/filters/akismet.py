@@ -25,7 +25,7 @@ from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
 from trac.mimeview.api import is_binary
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 
 
 class AkismetFilterStrategy(Component):
@@ -76,6 +76,7 @@ class AkismetFilterStrategy(Component):
 
         except urllib2.URLError, e:
             self.log.warn('Akismet request failed (%s)', e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         if not self._check_preconditions(req, author, content):
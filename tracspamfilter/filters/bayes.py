@@ -15,26 +15,39 @@
 #
 # Author: Matthew Good <trac@matt-good.net>
 
+import gzip
 from math import ceil
+import os
 import re
+import struct
+import sys
+import time
+from threading import Lock, RLock, local
+import zlib
 from pkg_resources import parse_version
 
 from trac import __version__ as VERSION
-from trac.config import IntOption
+from trac.admin import AdminCommandError, IAdminCommandProvider
+from trac.config import BoolOption, IntOption, Option
 from trac.core import *
 from trac.db import DatabaseManager
+from trac.util.text import printout
 from trac.wiki.api import IWikiChangeListener
 from trac.wiki.model import WikiPage
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, N_, _
+from tracspamfilter.bayesstore import SQLiteStore
+from tracspamfilter.versionstamp import get_system_value, new_version_stamp
 
 from spambayes.hammie import Hammie
-from spambayes.storage import SQLClassifier
+from spambayes.Options import options
+from spambayes.storage import STATE_KEY, SQLClassifier
+from spambayes.tokenizer import tokenize
 
 
 class BayesianFilterStrategy(Component):
     """Bayesian filtering strategy based on SpamBayes."""
 
-    implements(IFilterStrategy)
+    implements(IFilterStrategy, IAdminCommandProvider)
 
     karma_points = IntOption('spam-filter', 'bayes_karma', '10',
         """By what factor Bayesian spam probability score affects the overall
@@ -45,6 +58,32 @@ class BayesianFilterStrategy(Component):
         for the filter to start impacting the karma of submissions.""",
         doc_domain = "tracspamfilter")
 
+    cache_size = IntOption('spam-filter', 'bayes_cache_size', '10000',
+        """The maximum number of token counts kept in memory by each process.
+        Set to 0 to look up every token in the database.""",
+        doc_domain = "tracspamfilter")
+
+    storage = Option('spam-filter', 'bayes_storage', '',
+        """Path of an SQLite database file for the training database,
+        relative to the environment directory. This keeps Bayes training and
+        scoring from competing with other changes for locks on the Trac
+        database. Leave empty to keep the training database in the Trac
+        database. Use `trac-admin spamfilter bayes migrate` to copy the
+        existing training database.
+
+        Several environments can share a training database by pointing to
+        the same file with an absolute path. A training in one of them then
+        benefits all others, and environments running in the same process
+        share the token counts kept in memory.""",
+        doc_domain = "tracspamfilter")
+
+    local_overlay = BoolOption('spam-filter', 'bayes_local_overlay', 'false',
+        """Whether to keep the trainings of this environment in the Trac
+        database when the training database is in `bayes_storage`. The
+        local counts are added to those of the shared training database when
+        scoring, but trainings no longer change the shared database.""",
+        doc_domain = "tracspamfilter")
+
     # IFilterStrategy implementation
 
     def is_external(self):
@@ -71,7 +110,9 @@ class BayesianFilterStrategy(Component):
                           'spam submissions in the training database is large, '
                           'results may be bad.')
 
-        score = hammie.score(testcontent.encode('utf-8'))
+        tokens = list(tokenize(testcontent.encode('utf-8')))
+        hammie.bayes.prefetch(tokens)
+        score = hammie.bayes.spamprob(tokens)
         self.log.debug('SpamBayes reported spam probability of %s', score)
         points = -int(round(self.karma_points * (score * 2 - 1)))
         if points != 0:
@@ -87,37 +128,860 @@ class BayesianFilterStrategy(Component):
                       spam and 'spam' or 'ham')
 
         hammie = self._get_hammie()
-        hammie.train(testcontent.encode('utf-8','ignore'), spam)
-        hammie.store()
+        tokens = list(tokenize(testcontent.encode('utf-8','ignore')))
+        with hammie.bayes.lock:
+            hammie.bayes.refresh()
+            try:
+                hammie.bayes.prefetch(tokens)
+                hammie.bayes.learn(tokens, spam)
+                hammie.store()
+            except:
+                hammie.bayes.invalidate()
+                raise
+
+    def reset(self):
+        """Delete the training database."""
+        with self._get_storages()[0].db_transaction as db:
+            db("DELETE FROM spamfilter_bayes")
+            TracDbClassifier._build_summary(db)
+            TracDbClassifier.set_version(db)
+
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('spamfilter bayes repair', '',
+               'Raise the spam and ham totals of the Bayes training database '
+               'to the highest counts of its tokens',
+               None, self._do_repair)
+        yield ('spamfilter bayes prune', '<count> <days>',
+               'Delete the tokens of the Bayes training database which were '
+               'seen in at most <count> submissions and were not trained '
+               'during the last <days> days',
+               None, self._do_prune)
+        yield ('spamfilter bayes migrate', '',
+               'Copy the Bayes training database from the Trac database to '
+               'the storage configured in [spam-filter] bayes_storage, '
+               'replacing its contents',
+               None, self._do_migrate)
+        yield ('spamfilter bayes export', '<file>',
+               'Export the Bayes training database to a compressed file, or '
+               'to the standard output if <file> is "-"',
+               None, self._do_export)
+        yield ('spamfilter bayes import', '<file>',
+               'Replace the Bayes training database by an export, read from '
+               'the standard input if <file> is "-"',
+               None, self._do_import)
 
     # Internal methods
 
+    def _do_repair(self):
+        old, new = self._get_hammie().bayes.repair()
+        if old == new:
+            printout(_("The training database is consistent."))
+        else:
+            printout(_("Raised the totals from %(oldspam)d spam and "
+                       "%(oldham)d ham to %(newspam)d spam and %(newham)d "
+                       "ham.", oldspam=old[0], oldham=old[1],
+                       newspam=new[0], newham=new[1]))
+
+    def _do_prune(self, count, days):
+        try:
+            count, days = int(count), int(days)
+        except ValueError:
+            raise AdminCommandError(_("Count and days must be numbers."))
+        before, after = self._get_hammie().bayes.prune(count, days)
+        printout(_("Pruned %(pruned)d of %(before)d tokens, %(after)d tokens "
+                   "left.", pruned=before - after, before=before,
+                   after=after))
+
+    def _do_migrate(self):
+        if not self.storage:
+            raise AdminCommandError(_("No separate storage is configured "
+                                      "in [spam-filter] bayes_storage."))
+        storage = self._get_storage()
+        count = TracDbClassifier.copy(self.env, storage)
+        printout(_("Copied %(count)d rows to %(path)s.", count=count,
+                   path=storage.path))
+
+    def _do_export(self, filename):
+        if filename == '-':
+            TracDbClassifier.export_to(self._get_storages()[0], sys.stdout)
+        else:
+            fileobj = open(filename, 'wb')
+            try:
+                count = TracDbClassifier.export_to(self._get_storages()[0],
+                                                   fileobj)
+            finally:
+                fileobj.close()
+            printout(_("Exported %(count)d rows to %(file)s.", count=count,
+                       file=filename))
+
+    def _do_import(self, filename):
+        if filename == '-':
+            fileobj = sys.stdin
+        else:
+            fileobj = open(filename, 'rb')
+        try:
+            count = TracDbClassifier.import_from(self._get_storages()[0],
+                                                 fileobj)
+        finally:
+            if fileobj is not sys.stdin:
+                fileobj.close()
+        printout(_("Imported %(count)d rows.", count=count))
+
+    def _get_storage(self):
+        if not self.storage:
+            return self.env
+        return SQLiteStore.get(os.path.join(self.env.path, self.storage),
+                               self.log)
+
+    def _get_storages(self):
+        return _get_storages(self.env)
+
     def _get_hammie(self):
+        cache = None
+        if self.cache_size > 0:
+            cache = TokenCache.get(self.env, self.cache_size)
+        classifier = TracDbClassifier.get(self.env, cache)
+        classifier.refresh()
         try: # 1.0
-            return Hammie(TracDbClassifier(self.env.get_db_cnx(), self.log))
+            return Hammie(classifier)
         except TypeError, e: # 1.1
-            return Hammie(TracDbClassifier(self.env.get_db_cnx(), self.log), 'c')
+            return Hammie(classifier, 'c')
 
     def _get_numbers(self):
         hammie = self._get_hammie()
         return hammie.nspam, hammie.nham
 
 
+def _get_storages(env):
+    """Return the storage of the training database of an environment,
+    which is the environment or the `SQLiteStore` configured in
+    `[spam-filter] bayes_storage`, and the shared storage whose counts are
+    added to it or `None`."""
+    path = env.config.get('spam-filter', 'bayes_storage')
+    if not path:
+        return env, None
+    storage = SQLiteStore.get(os.path.join(env.path, path), env.log)
+    if env.config.getbool('spam-filter', 'bayes_local_overlay'):
+        return env, storage
+    return storage, None
+
+def _get_key(storage, shared):
+    if shared is None:
+        return storage.path
+    return storage.path, shared.path
+
+# version of a classifier or cache which must be read again; unlike `None`,
+# it never equals the version stamp of a database
+_STALE = object()
+
+
+class TokenCache(object):
+    """Bounded cache of the token counts of a training database.
+
+    The cache is shared by all classifiers of a process and holds the counts
+    of the most recently used tokens, including the tokens which are not in
+    the database. It is valid for one version of the training database and
+    dropped when another process changes the version stamp in the `system`
+    table.
+    """
+
+    _caches = {}
+    _caches_lock = Lock()
+
+    def __init__(self, size):
+        self.size = size
+        self.version = None
+        self._entries = {}
+        self._tick = 0
+        self._lock = Lock()
+
+    def get(cls, env, size):
+        """Return the cache for the training database of the environment.
+        Environments sharing a training database share the cache."""
+        key = _get_key(*_get_storages(env))
+        with cls._caches_lock:
+            cache = cls._caches.get(key)
+            if cache is None:
+                cache = cls._caches[key] = cls(size)
+            cache.size = size
+            return cache
+
+    get = classmethod(get)
+
+    def validate(self, version):
+        """Drop the cached counts unless they belong to `version`."""
+        with self._lock:
+            if version != self.version:
+                self._entries = {}
+                self.version = version
+
+    def lookup(self, word):
+        """Return a `(found, counts)` tuple for the word.
+
+        `counts` is a `(nspam, nham)` tuple, or `None` if the word is known
+        to be missing from the database.
+        """
+        with self._lock:
+            entry = self._entries.get(word)
+            if entry is None:
+                return False, None
+            self._tick += 1
+            entry[1] = self._tick
+            return True, entry[0]
+
+    def update(self, counts, version=None):
+        """Cache the counts of several words, given as a dictionary.
+
+        If `version` is given, the cached counts are moved to that version
+        of the training database.
+        """
+        with self._lock:
+            if version is not None:
+                self.version = version
+            for word, value in counts.iteritems():
+                self._tick += 1
+                self._entries[word] = [value, self._tick]
+            if len(self._entries) > self.size:
+                # evict the least recently used quarter at once, so that the
+                # sort isn't needed for every new word
+                entries = sorted(self._entries.iteritems(),
+                                 key=lambda item: item[1][1])
+                keep = self.size * 3 / 4
+                for word, entry in entries[:len(entries) - keep]:
+                    del self._entries[word]
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class TracDbClassifier(SQLClassifier):
-    # FIXME: This thing is incredibly slow
+    """SpamBayes classifier keeping the training database in the
+    `spamfilter_bayes` table.
+
+    The table is in the Trac database, or in the `SQLiteStore` configured
+    in `[spam-filter] bayes_storage`. With `bayes_local_overlay`, the
+    training database in the Trac database is an overlay of the one in the
+    `shared` storage: the counts of both are added when reading, and
+    trainings only change the local one. There is one classifier per
+    storage and process, which is shared by all threads. `refresh()` must
+    be called before each use. The counts of the tokens used and changed by
+    an operation are kept per thread, and trainings must hold `lock`.
+    """
+
+    version_key = 'spamfilter_bayes_version'
 
-    def __init__(self, db, log):
-        self.db = db
-        self.log = log
+    export_magic = 'TSFBAYES'
+    export_version = 1
+    # length of the word, spam count, ham count, last seen
+    _export_record = struct.Struct('>Hiii')
+
+    # number of ranges of the spam share in the histogram of the summary
+    histogram_buckets = 5
+    # number of candidates for the strongest spam and ham words kept by the
+    # summary
+    summary_size = 50
+
+    _classifiers = {}
+    _classifiers_lock = Lock()
+
+    def __init__(self, env, cache=None):
+        self.env = env
+        self.log = env.log
+        self.storage, self.shared = _get_storages(env)
+        self.cache = cache
+        self.lock = RLock()
+        self.version = None
+        self._local = local()
+        self._state = (0, 0)
         SQLClassifier.__init__(self, 'Trac')
 
-    def load(self):
-        if self._has_key(self.statekey):
-            row = self._get_row(self.statekey)
-            self.nspam = row['nspam']
-            self.nham = row['nham']
-        else: # new database
-            self.nspam = self.nham = 0
+    def get(cls, env, cache=None):
+        """Return the classifier for the training database of the
+        environment. Environments sharing a training database share the
+        classifier."""
+        storage, shared = _get_storages(env)
+        key = _get_key(storage, shared)
+        with cls._classifiers_lock:
+            classifier = cls._classifiers.get(key)
+            if classifier is None:
+                classifier = cls._classifiers[key] = cls(env, cache)
+            # the environment is created again after configuration changes
+            classifier.env = env
+            classifier.log = env.log
+            classifier.storage = storage
+            classifier.shared = shared
+            classifier.cache = cache
+            return classifier
+
+    get = classmethod(get)
+
+    def set_version(cls, db):
+        """Change the version stamp of the training database.
+
+        Must be called in the transaction changing the database, so that the
+        other processes drop their cached token counts.
+        """
+        return new_version_stamp(db, cls.version_key)
+
+    set_version = classmethod(set_version)
+
+    def copy(cls, source, target, chunk_size=1000):
+        """Replace the training database in `target` by the one in `source`.
+
+        Both are environments or `SQLiteStore`s. The rows are read in chunks
+        of `chunk_size` and written in a single transaction. Returns the
+        number of rows copied.
+        """
+        with target.db_transaction as db:
+            db("DELETE FROM spamfilter_bayes")
+            count = cls._insert_rows(db, cls._iter_rows(source, chunk_size),
+                                     chunk_size)
+            cls._build_summary(db)
+            cls.set_version(db)
+        return count
+
+    copy = classmethod(copy)
+
+    def export_to(cls, storage, fileobj, chunk_size=1000):
+        """Write the training database in `storage` to a file.
+
+        The data is gzip compressed. After a header of `export_magic` and the
+        format version as a byte, each row is written as the byte length of
+        the UTF-8 encoded word, the spam and ham counts and the time it was
+        last seen, followed by the word itself. A record with length 0 and
+        the number of rows as spam count ends the data. Only `chunk_size`
+        rows are held in memory. Returns the number of rows written.
+        """
+        out = gzip.GzipFile(fileobj=fileobj, mode='wb')
+        out.write(cls.export_magic + chr(cls.export_version))
+        count = 0
+        for word, nspam, nham, lastseen in cls._iter_rows(storage,
+                                                          chunk_size):
+            word = word.encode('utf-8')
+            out.write(cls._export_record.pack(len(word), nspam, nham,
+                                              lastseen or 0) + word)
+            count += 1
+        out.write(cls._export_record.pack(0, count, 0, 0))
+        out.close()
+        return count
+
+    export_to = classmethod(export_to)
+
+    def import_from(cls, storage, fileobj, chunk_size=1000):
+        """Replace the training database in `storage` by the one in a file
+        written by `export_to()`.
+
+        The rows are inserted in chunks of `chunk_size` in a single
+        transaction, which is rolled back if the file is invalid. Returns
+        the number of rows read. The file is read sequentially, so it can be
+        a pipe.
+        """
+        inp = _GzipReader(fileobj)
+        header = inp.read(len(cls.export_magic) + 1)
+        if not header.startswith(cls.export_magic):
+            raise TracError(_("The file is not an export of a Bayes training "
+                              "database."))
+        version = ord(header[-1])
+        if version > cls.export_version:
+            raise TracError(_("Unsupported export format version %(version)d.",
+                              version=version))
+        def read_rows():
+            count = 0
+            size = cls._export_record.size
+            while True:
+                record = inp.read(size)
+                if len(record) < size:
+                    raise TracError(_("The export is truncated."))
+                length, nspam, nham, lastseen = \
+                    cls._export_record.unpack(record)
+                if not length:
+                    if nspam != count:
+                        raise TracError(_("The export is corrupt."))
+                    break
+                word = inp.read(length)
+                if len(word) < length:
+                    raise TracError(_("The export is truncated."))
+                yield word.decode('utf-8'), nspam, nham, lastseen or None
+                count += 1
+        with storage.db_transaction as db:
+            db("DELETE FROM spamfilter_bayes")
+            count = cls._insert_rows(db, read_rows(), chunk_size)
+            cls._build_summary(db)
+            cls.set_version(db)
+        return count
+
+    import_from = classmethod(import_from)
+
+    def _iter_rows(cls, storage, chunk_size=1000):
+        """Yield the rows of the training database in `storage`, ordered by
+        word, reading `chunk_size` rows at a time."""
+        last = ''
+        while True:
+            rows = storage.db_query("SELECT word,nspam,nham,lastseen "
+                                    "FROM spamfilter_bayes WHERE word>%s "
+                                    "ORDER BY word LIMIT %s",
+                                    (last, chunk_size))
+            for row in rows:
+                yield row
+            if len(rows) < chunk_size:
+                break
+            last = rows[-1][0]
+
+    _iter_rows = classmethod(_iter_rows)
+
+    def _insert_rows(cls, db, rows, chunk_size=1000):
+        """Insert rows into the training database, `chunk_size` at a time.
+        Returns the number of rows inserted."""
+        count = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                db.executemany("INSERT INTO spamfilter_bayes "
+                               "(word,nspam,nham,lastseen) "
+                               "VALUES (%s,%s,%s,%s)", chunk)
+                count += len(chunk)
+                chunk = []
+        if chunk:
+            db.executemany("INSERT INTO spamfilter_bayes "
+                           "(word,nspam,nham,lastseen) "
+                           "VALUES (%s,%s,%s,%s)", chunk)
+            count += len(chunk)
+        return count
+
+    _insert_rows = classmethod(_insert_rows)
+
+    def _bucket(cls, counts):
+        """Return the histogram bucket of the counts of a word, or `None` if
+        they aren't counted."""
+        nspam, nham = counts
+        if nspam + nham <= 0:
+            return None
+        buckets = cls.histogram_buckets
+        for idx in xrange(buckets - 1):
+            if nspam * buckets < (nspam + nham) * (idx + 1):
+                return idx
+        return buckets - 1
+
+    _bucket = classmethod(_bucket)
+
+    def _rank(cls, rows, limit, nspam, nham):
+        """Return the `limit` words of the `(word, nspam, nham)` rows which
+        indicate spam and ham most strongly, given the totals."""
+        # the difference of the shares of all spam and ham submissions,
+        # scaled by both totals
+        nspam, nham = max(nspam, 1), max(nham, 1)
+        def score(row):
+            return row[1] * nham - row[2] * nspam
+        spammy = sorted([row for row in rows if row[1] > 0],
+                        key=lambda row: (-score(row), row[0]))
+        hammy = sorted([row for row in rows if row[2] > 0],
+                       key=lambda row: (score(row), row[0]))
+        return spammy[:limit], hammy[:limit]
+
+    _rank = classmethod(_rank)
+
+    def _build_summary(cls, db):
+        """Compute the summary read by `statistics()` from all words. Must
+        be called in the transaction changing the database."""
+        buckets = cls.histogram_buckets
+        whens = ' '.join(["WHEN nspam*%d<(nspam+nham)*%d THEN %d"
+                          % (buckets, i + 1, i)
+                          for i in xrange(buckets - 1)])
+        summary = dict([('bucket%d' % idx, 0) for idx in xrange(buckets)])
+        summary['tokens'] = db("SELECT COUNT(*) FROM spamfilter_bayes "
+                               "WHERE word!=%s", (STATE_KEY,))[0][0]
+        for bucket, count in db("""
+                SELECT bucket,COUNT(*) FROM (
+                  SELECT CASE %s ELSE %d END AS bucket
+                  FROM spamfilter_bayes
+                  WHERE word!=%%s AND nspam+nham>0) AS buckets
+                GROUP BY bucket
+                """ % (whens, buckets - 1), (STATE_KEY,)):
+            summary['bucket%d' % bucket] = count
+        nspam = nham = 1
+        for row in db("SELECT nspam,nham FROM spamfilter_bayes "
+                      "WHERE word=%s", (STATE_KEY,)):
+            nspam, nham = max(row[0], 1), max(row[1], 1)
+        top = db("SELECT word,nspam,nham FROM spamfilter_bayes "
+                 "WHERE word!=%s AND nspam>0 "
+                 "ORDER BY nspam*%s-nham*%s DESC,word LIMIT %s",
+                 (STATE_KEY, nham, nspam, cls.summary_size))
+        top += db("SELECT word,nspam,nham FROM spamfilter_bayes "
+                  "WHERE word!=%s AND nham>0 "
+                  "ORDER BY nham*%s-nspam*%s DESC,word LIMIT %s",
+                  (STATE_KEY, nspam, nham, cls.summary_size))
+        db("DELETE FROM spamfilter_bayes_summary")
+        db.executemany("INSERT INTO spamfilter_bayes_summary (name,value) "
+                       "VALUES (%s,%s)", summary.items())
+        db("DELETE FROM spamfilter_bayes_top")
+        db.executemany("INSERT INTO spamfilter_bayes_top (word,nspam,nham) "
+                       "VALUES (%s,%s,%s)", dict([(row[0], row) for row in
+                                                   top]).values())
+
+    _build_summary = classmethod(_build_summary)
+
+    def _update_summary(self, db, changes):
+        """Apply the `(word, before, after)` changes of a training to the
+        summary, in the transaction of the training."""
+        cursor = db.cursor()
+        # the first update locks the summary until the transaction ends, so
+        # that concurrent trainings don't lose their changes
+        tokens = len([1 for word, before, after in changes
+                      if after is not None]) - \
+                 len([1 for word, before, after in changes
+                      if before is not None])
+        cursor.execute("UPDATE spamfilter_bayes_summary SET value=value+%s "
+                       "WHERE name='tokens'", (tokens,))
+        if cursor.rowcount < 1:
+            # built from all words when it is read the first time
+            return
+        buckets = {}
+        for word, before, after in changes:
+            for counts, delta in ((before, -1), (after, 1)):
+                bucket = counts and self._bucket(counts)
+                if bucket is not None:
+                    buckets[bucket] = buckets.get(bucket, 0) + delta
+        for bucket, delta in buckets.iteritems():
+            if delta:
+                cursor.execute("UPDATE spamfilter_bayes_summary "
+                               "SET value=value+%s WHERE name=%s",
+                               (delta, 'bucket%d' % bucket))
+        top = dict([(row[0], row) for row in
+                    db("SELECT word,nspam,nham FROM spamfilter_bayes_top")])
+        candidates = top.copy()
+        for word, before, after in changes:
+            candidates.pop(word, None)
+            if after is not None:
+                candidates[word] = (word,) + after
+        spammy, hammy = self._rank(candidates.values(), self.summary_size,
+                                   self.nspam, self.nham)
+        keep = dict([(row[0], row) for row in spammy + hammy])
+        removed = [(word,) for word, row in top.iteritems()
+                   if keep.get(word) != row]
+        added = [row for word, row in keep.iteritems() if top.get(word) != row]
+        if removed:
+            cursor.executemany("DELETE FROM spamfilter_bayes_top "
+                               "WHERE word=%s", removed)
+        if added:
+            cursor.executemany("INSERT INTO spamfilter_bayes_top "
+                               "(word,nspam,nham) VALUES (%s,%s,%s)", added)
+
+    def refresh(self):
+        """Prepare the classifier for a new operation of the current thread.
+
+        The state is only read again if the training database was changed
+        since the last refresh, which costs a single query otherwise.
+        """
+        self._local.__dict__.clear()
+        version = self._get_version()
+        if version != self.version:
+            with self.lock:
+                self.load(version)
+
+    def invalidate(self):
+        """Read the totals and the token counts again on the next refresh,
+        after a training which failed half-way."""
+        self.version = _STALE
+        if self.cache is not None:
+            self.cache.validate(_STALE)
+
+    def load(self, version=None):
+        if version is None:
+            version = self._get_version()
+        if self.cache is not None:
+            self.cache.validate(version)
+        self.nspam = self.nham = 0 # new database
+        for storage in (self.storage, self.shared):
+            if storage is None:
+                continue
+            for nspam, nham in storage.db_query("SELECT nspam,nham "
+                                                "FROM spamfilter_bayes "
+                                                "WHERE word=%s",
+                                                (self.statekey,)):
+                self.nspam += nspam
+                self.nham += nham
+        self._state = (self.nspam, self.nham)
+        self.probcache = {}
+        self.version = version
+
+    def store(self):
+        """Write the changes of the training in a single transaction.
+
+        The token counts are changed by the differences to the counts read
+        before the training, so concurrent trainings don't overwrite each
+        other.
+        """
+        dirty = self._dirty
+        base = self._base
+        self._local.dirty = {}
+        self._local.base = {}
+        self._rows.update(dirty)
+        for word, counts in dirty.iteritems():
+            # the totals can be lower than the counts of a word if an earlier
+            # training failed half-way
+            if counts and counts[0] > self.nspam:
+                self.log.warn('Reset SPAM count from %d to %d due to keyword '
+                              '\'%s\'.', self.nspam, counts[0], word)
+                self.nspam = counts[0]
+            if counts and counts[1] > self.nham:
+                self.log.warn('Reset HAM count from %d to %d due to keyword '
+                              '\'%s\'.', self.nham, counts[1], word)
+                self.nham = counts[1]
+        nspam = self.nspam - self._state[0]
+        nham = self.nham - self._state[1]
+        now = int(time.time())
+        try:
+            with self.storage.db_transaction as db:
+                version = self._get_version(db)
+                existing = self._get_rows(dirty.keys(), db)
+                updates = []
+                inserts = []
+                deletes = []
+                # (word, counts before, counts after) for the summary
+                changes = []
+                for word, counts in dirty.iteritems():
+                    old = base.get(word) or (0, 0)
+                    new = counts or (0, 0)
+                    dspam, dham = new[0] - old[0], new[1] - old[1]
+                    before = after = existing.get(word)
+                    if word not in existing:
+                        if self.shared is not None:
+                            # the overlay may hold negative counts for words
+                            # untrained from the shared database
+                            if dspam or dham:
+                                after = (dspam, dham)
+                        elif max(dspam, dham) > 0:
+                            after = (max(dspam, 0), max(dham, 0))
+                        if after is not None:
+                            inserts.append((word,) + after + (now,))
+                    elif dspam or dham:
+                        updates.append((dspam, dham, now, word))
+                        after = (before[0] + dspam, before[1] + dham)
+                    if new == (0, 0) or self.shared is not None:
+                        deletes.append((word,))
+                        if after is not None and \
+                                (after == (0, 0) or self.shared is None and
+                                 max(after) <= 0):
+                            after = None
+                    if after != before:
+                        changes.append((word, before, after))
+                cursor = db.cursor()
+                if updates:
+                    cursor.executemany("UPDATE spamfilter_bayes "
+                                       "SET nspam=nspam+%s,nham=nham+%s,"
+                                       "lastseen=%s WHERE word=%s", updates)
+                if inserts:
+                    cursor.executemany("INSERT INTO spamfilter_bayes "
+                                       "(word,nspam,nham,lastseen) "
+                                       "VALUES (%s,%s,%s,%s)", inserts)
+                if deletes and self.shared is not None:
+                    cursor.executemany("DELETE FROM spamfilter_bayes "
+                                       "WHERE word=%s AND nspam=0 "
+                                       "AND nham=0", deletes)
+                elif deletes:
+                    cursor.executemany("DELETE FROM spamfilter_bayes "
+                                       "WHERE word=%s AND nspam<=0 "
+                                       "AND nham<=0", deletes)
+                cursor.execute("UPDATE spamfilter_bayes "
+                               "SET nspam=nspam+%s,nham=nham+%s "
+                               "WHERE word=%s", (nspam, nham, self.statekey))
+                if cursor.rowcount < 1:
+                    cursor.execute("INSERT INTO spamfilter_bayes "
+                                   "(word,nspam,nham) VALUES (%s,%s,%s)",
+                                   (self.statekey, nspam, nham))
+                self._update_summary(db, changes)
+                new_version = self.set_version(db)
+                if self.shared is not None:
+                    new_version = (new_version, version[1])
+        except:
+            self.invalidate()
+            raise
+        self._state = (self.nspam, self.nham)
+        if version != self.version:
+            # somebody else trained in the meantime
+            self.version = None
+            if self.cache is not None:
+                self.cache.validate(new_version)
+        else:
+            self.version = new_version
+            if self.cache is not None:
+                self.cache.update(dirty, new_version)
+        self.log.debug('Stored %d changed SpamBayes tokens', len(dirty))
+
+    def prefetch(self, tokens):
+        """Load the counts of all tokens of a message with a few queries, so
+        that scoring or training it doesn't need a query per token."""
+        words = set(tokens)
+        if options["Classifier", "use_bigrams"]:
+            # must match the bigrams built by the classifier
+            for i in xrange(1, len(tokens)):
+                words.add("bi:%s %s" % (tokens[i - 1], tokens[i]))
+        missing = []
+        for word in set([self._sanitize(word) for word in words]):
+            if word in self._dirty or word in self._rows:
+                continue
+            if self.cache is not None:
+                found, counts = self.cache.lookup(word)
+                if found:
+                    self._rows[word] = counts
+                    continue
+            missing.append(word)
+        rows = self._get_counts(missing)
+        counts = dict([(word, rows.get(word)) for word in missing])
+        self._rows.update(counts)
+        if self.cache is not None:
+            self.cache.update(counts)
+        self.log.debug('Prefetched %d of %d SpamBayes tokens',
+                       len(missing), len(words))
+
+    def probability(self, record):
+        if record.spamcount > self.nspam or record.hamcount > self.nham or \
+                min(record.spamcount, record.hamcount) < 0:
+            # don't trip over the assertion in SpamBayes when the totals are
+            # too low, they are repaired by the next training or by
+            # `trac-admin spamfilter bayes repair`
+            clamped = self.WordInfoClass()
+            clamped.__setstate__((max(min(record.spamcount, self.nspam), 0),
+                                  max(min(record.hamcount, self.nham), 0)))
+            record = clamped
+        return SQLClassifier.probability(self, record)
+
+    def repair(self):
+        """Raise the totals of the training database to the highest counts
+        of its words.
+
+        Returns the old and the new totals as `(nspam, nham)` tuples.
+        """
+        with self.lock:
+            with self.storage.db_transaction as db:
+                old = new = (0, 0)
+                for row in db("SELECT nspam,nham FROM spamfilter_bayes "
+                              "WHERE word=%s", (self.statekey,)):
+                    old = new = row
+                for nspam, nham in db("SELECT MAX(nspam),MAX(nham) "
+                                      "FROM spamfilter_bayes WHERE word!=%s",
+                                      (self.statekey,)):
+                    new = (max(old[0], nspam or 0), max(old[1], nham or 0))
+                if new != old:
+                    db("DELETE FROM spamfilter_bayes WHERE word=%s",
+                       (self.statekey,))
+                    db("INSERT INTO spamfilter_bayes (word,nspam,nham) "
+                       "VALUES (%s,%s,%s)", (self.statekey,) + new)
+                    self.set_version(db)
+            self.version = None
+        return old, new
+
+    def statistics(self, limit=10):
+        """Return statistics of the training database without reading all
+        words.
+
+        The result is a dictionary with the number of `tokens`, a
+        `histogram` list with the number of words in each of
+        `histogram_buckets` ranges of the spam share of their counts, and
+        the `limit` words which indicate spam and ham most strongly, as
+        `spammy` and `hammy` lists of `(word, nspam, nham, probability)`
+        tuples. `overlay` is true if the figures only cover the local
+        training database of an overlay.
+
+        The figures are read from a summary, which `store()` keeps up to
+        date. The strongest words are chosen among `summary_size`
+        candidates for each list, which only change with the words of the
+        trainings in between, so a list can miss a word after untraining
+        until the summary is built again by pruning. The summary is built
+        from all words the first time it is read.
+        """
+        summary = dict(self.storage.db_query(
+            "SELECT name,value FROM spamfilter_bayes_summary"))
+        if 'tokens' not in summary:
+            try:
+                with self.storage.db_transaction as db:
+                    self._build_summary(db)
+            except Exception, e:
+                # another process may have built it at the same time
+                self.log.warning('Building the summary of the Bayes '
+                                 'training database failed: %s', e)
+            summary = dict(self.storage.db_query(
+                "SELECT name,value FROM spamfilter_bayes_summary"))
+        histogram = [summary.get('bucket%d' % idx, 0)
+                     for idx in xrange(self.histogram_buckets)]
+        rows = self.storage.db_query("SELECT word,nspam,nham "
+                                     "FROM spamfilter_bayes_top")
+        spammy, hammy = self._rank(rows, limit, self.nspam, self.nham)
+        def rank(rows):
+            result = []
+            for word, nspam, nham in rows:
+                record = self.WordInfoClass()
+                record.__setstate__((nspam, nham))
+                result.append((word, nspam, nham, self.probability(record)))
+            return result
+        return {'tokens': summary.get('tokens', 0), 'histogram': histogram,
+                'spammy': rank(spammy), 'hammy': rank(hammy),
+                'overlay': self.shared is not None}
+
+    def count(self):
+        """Return the number of words in the training database."""
+        return self.storage.db_query("SELECT COUNT(*) FROM spamfilter_bayes "
+                                     "WHERE word!=%s",
+                                     (self.statekey,))[0][0]
+
+    def prune(self, max_count, max_age, chunk_size=1000):
+        """Delete the words seen in at most `max_count` submissions, which
+        were not trained during the last `max_age` days.
+
+        The table is walked in chunks of `chunk_size` words, each in its own
+        transaction, so the database isn't locked for long. The summary read
+        by `statistics()` is built again afterwards, and the classifier
+        reads its state again on the next refresh. Returns the number of
+        words before and after pruning.
+        """
+        before = self.count()
+        threshold = int(time.time()) - max_age * 86400
+        last = ''
+        while True:
+            with self.storage.db_transaction as db:
+                rows = db("SELECT word,nspam,nham,lastseen "
+                          "FROM spamfilter_bayes WHERE word>%s "
+                          "ORDER BY word LIMIT %s", (last, chunk_size))
+                if not rows:
+                    break
+                last = rows[-1][0]
+                words = [(word,) for word, nspam, nham, lastseen in rows
+                         if word != self.statekey and
+                            nspam + nham <= max_count and
+                            (lastseen or 0) < threshold]
+                if words:
+                    db.executemany("DELETE FROM spamfilter_bayes "
+                                   "WHERE word=%s", words)
+                    self.set_version(db)
+        with self.lock:
+            with self.storage.db_transaction as db:
+                self._build_summary(db)
+                self.set_version(db)
+            self.version = None
+        after = self.count()
+        self.log.info('Pruned %d SpamBayes tokens', before - after)
+        return before, after
+
+    def _dirty(self):
+        """Changed counts of the current training."""
+        return self._local.__dict__.setdefault('dirty', {})
+
+    _dirty = property(_dirty)
+
+    def _base(self):
+        """Counts of the changed words before the current training."""
+        return self._local.__dict__.setdefault('base', {})
+
+    _base = property(_base)
+
+    def _rows(self):
+        """Counts of the words used by the current operation."""
+        return self._local.__dict__.setdefault('rows', {})
+
+    _rows = property(_rows)
 
     def _sanitize(self, text):
         if isinstance(text, unicode):
@@ -125,52 +989,76 @@ class TracDbClassifier(SQLClassifier):
         """Remove invalid byte sequences from utf-8 encoded text"""
         return text.decode('utf-8', 'ignore')
 
+    def _lookup(self, word):
+        """Return the current counts of the word, or `None` if it is not in
+        the training database."""
+        if word in self._dirty:
+            return self._dirty[word]
+        if word in self._rows:
+            return self._rows[word]
+        if self.cache is not None:
+            found, counts = self.cache.lookup(word)
+            if found:
+                return counts
+        counts = self._get_counts([word]).get(word)
+        if self.cache is not None:
+            self.cache.update({word: counts})
+        return counts
+
     def _get_row(self, word):
         word = self._sanitize(word)
-        cursor = self.db.cursor()
-        cursor.execute("SELECT nspam,nham FROM spamfilter_bayes WHERE word=%s",
-                       (word,))
-        row = cursor.fetchone()
-        if not row:
+        counts = self._lookup(word)
+        if not counts:
             return {}
-        # prevent assertion - happens when there are failures in training and
-        # the count is not updated due to an exception
-        if word != self.statekey:
-            if row[0] > self.nspam:
-                self.log.warn('Reset SPAM count from %d to %d due to keyword \'%s\'.',
-                              self.nspam, row[0], word)
-                self.nspam = row[0]
-                self.store()
-            if row[1] > self.nham:
-                self.log.warn('Reset HAM count from %d to %d due to keyword \'%s\'.',
-                              self.nham, row[1], word)
-                self.nham = row[1]
-                self.store()
-        return {'nspam': row[0], 'nham': row[1]}
+        return {'nspam': counts[0], 'nham': counts[1]}
+
+    def _get_counts(self, words):
+        """Return the counts of the words found in the database, including
+        those of the shared database."""
+        rows = self._get_rows(words)
+        if self.shared is not None:
+            with self.shared.db_query as db:
+                for word, (nspam, nham) in \
+                        self._get_rows(words, db).iteritems():
+                    local = rows.get(word, (0, 0))
+                    rows[word] = (local[0] + nspam, local[1] + nham)
+        return rows
+
+    def _get_rows(self, words, db=None, chunk_size=500):
+        """Return the counts of the words found in the local database."""
+        if db is None:
+            with self.storage.db_query as db:
+                return self._get_rows(words, db, chunk_size)
+        rows = {}
+        cursor = db.cursor()
+        for i in xrange(0, len(words), chunk_size):
+            chunk = words[i:i + chunk_size]
+            params = ','.join(['%s'] * len(chunk))
+            cursor.execute("SELECT word,nspam,nham FROM spamfilter_bayes "
+                           "WHERE word IN (%s)" % params, chunk)
+            for word, nspam, nham in cursor:
+                rows[word] = (nspam, nham)
+        return rows
 
     def _set_row(self, word, nspam, nham):
+        # written by store()
         word = self._sanitize(word)
-        cursor = self.db.cursor()
-        if self._has_key(word):
-            cursor.execute("UPDATE spamfilter_bayes SET nspam=%s,nham=%s "
-                           "WHERE word=%s", (nspam, nham, word))
-        else:
-            cursor.execute("INSERT INTO spamfilter_bayes (word,nspam,nham) "
-                           "VALUES (%s,%s,%s)", (word, nspam, nham))
-        self.db.commit()
+        if word not in self._base:
+            self._base[word] = self._lookup(word)
+        self._dirty[word] = (nspam, nham)
 
     def _delete_row(self, word):
+        # written by store()
         word = self._sanitize(word)
-        cursor = self.db.cursor()
-        cursor.execute("DELETE FROM spamfilter_bayes WHERE word=%s", (word,))
-        self.db.commit()
+        if word not in self._base:
+            self._base[word] = self._lookup(word)
+        self._dirty[word] = None
 
     def _has_key(self, key):
         key = self._sanitize(key)
-        cursor = self.db.cursor()
-        cursor.execute("SELECT COUNT(*) FROM spamfilter_bayes WHERE word=%s",
-                       (key,))
-        return bool(cursor.fetchone()[0])
+        return bool(self.storage.db_query("SELECT COUNT(*) "
+                                          "FROM spamfilter_bayes "
+                                          "WHERE word=%s", (key,))[0][0])
 
     def _wordinfoget(self, word):
         row = self._get_row(word)
@@ -182,6 +1070,50 @@ class TracDbClassifier(SQLClassifier):
             return None
 
     def _wordinfokeys(self):
-        cursor = self.db.cursor()
-        cursor.execute("SELECT word FROM spamfilter_bayes")
-        return [row[0] for row in cursor.fetchall()]
+        for row in self._iter_rows(self.storage):
+            yield row[0]
+
+    def _get_version(self, db=None):
+        if db is None:
+            db = self.storage.db_query
+        version = get_system_value(db, self.version_key)
+        if self.shared is not None:
+            # an overlay changes with both databases
+            return version, get_system_value(self.shared.db_query,
+                                             self.version_key)
+        return version
+
+
+class _GzipReader(object):
+    """Reads the data of a gzip compressed file.
+
+    Unlike `gzip.GzipFile`, the file is never seeked, so that data can be
+    imported from a pipe.
+    """
+
+    def __init__(self, fileobj, chunk_size=8192):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def read(self, size):
+        """Return the next `size` bytes, or less at the end of the data."""
+        while len(self._buffer) - self._pos < size and not self._eof:
+            data = self.fileobj.read(self.chunk_size)
+            try:
+                if data:
+                    data = self._decompressor.decompress(data)
+                else:
+                    data = self._decompressor.flush()
+                    self._eof = True
+            except zlib.error, e:
+                raise TracError(_("The file is not gzip compressed: "
+                                  "%(error)s", error=e))
+            self._buffer = self._buffer[self._pos:] + data
+            self._pos = 0
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
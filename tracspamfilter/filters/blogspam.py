@@ -20,7 +20,7 @@ from pkg_resources import get_distribution
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option, ListOption
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 from tracspamfilter.timeoutserverproxy import TimeoutServerProxy
 from trac.mimeview.api import is_binary
 
@@ -59,8 +59,7 @@ class BlogSpamFilterStrategy(Component):
                 return -abs(self.karma_points), N_('BlogSpam says content is spam (%s)'), res[5:]
         except Exception, v:
             self.log.warning('Checking with BlogSpam failed: %s', v)
-        except IOError, v:
-            self.log.warning("Checking with BlogSpam failed: %s", v)
+            raise ServiceError(v)
 
     def train(self, req, author, content, ip, spam=True):
         if not self._check_preconditions(req, author, content):
@@ -21,7 +21,7 @@ from pkg_resources import get_distribution
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 
 class BotScoutFilterStrategy(Component):
     """Spam filter using the BotScount (http://botscout.com/).
@@ -44,6 +44,10 @@ class BotScoutFilterStrategy(Component):
     def is_external(self):
         return True
 
+    def get_max_karma(self):
+        # username, IP and e-mail may each be listed
+        return abs(self.karma_points) * 3
+
     def test(self, req, author, content, ip):
         if not self._check_preconditions(False):
             return
@@ -61,6 +65,7 @@ class BotScoutFilterStrategy(Component):
                 return -abs(self.karma_points)*count, N_('BotScout says this is spam (%s)'), resp
         except urllib2.URLError, e:
             self.log.warn('BotScout request failed (%s)', e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         pass
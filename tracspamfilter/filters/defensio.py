@@ -31,7 +31,7 @@ from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
 from trac.mimeview.api import is_binary
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 from tracspamfilter.timeoutserverproxy import TimeoutHTTPConnection
 
 class DefensioFilterStrategy(Component):
@@ -92,6 +92,7 @@ class DefensioFilterStrategy(Component):
                     val, message
         except Exception, e:
             self.log.warn('Defensio testing request failed (%s)', e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         if not self._check_preconditions(req, author, content):
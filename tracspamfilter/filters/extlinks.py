@@ -45,6 +45,10 @@ class ExternalLinksFilterStrategy(Component):
     def is_external(self):
         return False
 
+    def get_max_karma(self):
+        # grows with the number of links
+        return None
+
     def test(self, req, author, content, ip):
         num_ext = 0
         allowed = copy.copy(self.allowed_domains)
@@ -22,7 +22,7 @@ import string
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 
 class FSpamListFilterStrategy(Component):
     """Spam filter using the FSpamList (http://www.fspamlist.com/).
@@ -45,6 +45,10 @@ class FSpamListFilterStrategy(Component):
     def is_external(self):
         return True
 
+    def get_max_karma(self):
+        # username, IP and e-mail may each be listed
+        return abs(self.karma_points) * 3
+
     def test(self, req, author, content, ip):
         if not self._check_preconditions(False):
             return
@@ -67,6 +71,7 @@ class FSpamListFilterStrategy(Component):
                     N_('FSpamList says this is spam (%s)'), ("; ".join(reason))
         except urllib2.URLError, e:
             self.log.warn('FSpamList request failed (%s)', e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         pass
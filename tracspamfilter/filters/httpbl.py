@@ -21,7 +21,7 @@ from dns.resolver import query, Timeout, NXDOMAIN, NoAnswer, NoNameservers
 from trac.config import Option, IntOption
 from trac.core import *
 from trac.util import reversed
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 
 class HttpBLFilterStrategy(Component):
     """Spam filter based on Project Honey Pot's Http:BL blacklist.
@@ -42,6 +42,10 @@ class HttpBLFilterStrategy(Component):
     def is_external(self):
         return True
 
+    def get_max_karma(self):
+        # listed as suspicious and as comment spammer
+        return abs(self.karma_points) + abs(self.karma_points) / 3
+
     def test(self, req, author, content, ip):
         if not self.api_key:
             self.log.warning('API key not configured.')
@@ -57,7 +61,7 @@ class HttpBLFilterStrategy(Component):
             if answer[0] != 127:
                 self.log.warning('Invalid Http:BL reply for IP "%s": %s' %
                                  (ip, dns_answer))
-                return
+                raise ServiceError(dns_answer)
 
             # TODO: answer[1] represents number of days since last activity
             #       and answer[2] is treat score assigned by Project Honey
@@ -81,6 +85,7 @@ class HttpBLFilterStrategy(Component):
         except (Timeout, NoAnswer, NoNameservers), e:
             self.log.warning('Error checking Http:BL for IP "%s": %s' %
                              (ip, e))
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         pass
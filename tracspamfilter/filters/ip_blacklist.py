@@ -20,7 +20,7 @@ from dns.resolver import query, Timeout, NXDOMAIN, NoAnswer, NoNameservers
 from trac.config import ListOption, IntOption
 from trac.core import *
 from trac.util import reversed
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 
 class IPBlacklistFilterStrategy(Component):
     """Spam filter based on IP blacklistings.
@@ -42,6 +42,9 @@ class IPBlacklistFilterStrategy(Component):
     def is_external(self):
         return True
 
+    def get_max_karma(self):
+        return abs(self.karma_points) * len(self.servers)
+
     def test(self, req, author, content, ip):
         if not self._check_preconditions(req, author, content, ip):
             return
@@ -54,6 +57,7 @@ class IPBlacklistFilterStrategy(Component):
 
         points = 0
         servers = []
+        errors = []
 
         prefix = '.'.join(reversed(ip.split('.'))) + '.'
         for server in self.servers:
@@ -75,7 +79,10 @@ class IPBlacklistFilterStrategy(Component):
             except (Timeout, NoAnswer, NoNameservers), e:
                 self.log.warning('Error checking IP blacklist server "%s" for '
                                  'IP "%s": %s' % (server, ip, e))
+                errors.append(e)
 
+        if len(errors) == len(self.servers):
+            raise ServiceError(errors[0])
         if points != 0:
             return points, N_('IP %s blacklisted by %s'), ip, ', '.join(servers)
 
@@ -18,16 +18,23 @@
 #         Matthew Good <trac@matt-good.net>
 
 import re
+from threading import Lock
+import time
 
 from trac.config import IntOption, Option, BoolOption
 from trac.core import *
 from trac.wiki.api import IWikiChangeListener
 from trac.wiki.model import WikiPage
 from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.filters.patternpage import PatternPageReloader
+from tracspamfilter.matcher import NetworkMatcher, PatternMatcher
 
-class IPRegexFilterStrategy(Component):
+class IPRegexFilterStrategy(Component, PatternPageReloader):
     """Spam filter for submitter's IP based on regular expressions
     defined in BadIP page.
+
+    Networks in CIDR notation, like `192.168.0.0/16` or `2001:db8::/32`,
+    are looked up without regular expressions.
     """
     implements(IFilterStrategy, IWikiChangeListener)
 
@@ -39,37 +46,41 @@ class IPRegexFilterStrategy(Component):
         addition to BadIP wiki page.""", doc_domain="tracspamfilter")
     show_blacklisted = BoolOption('spam-filter', 'show_blacklisted_ip', 'true',
         """Show the matched bad IP patterns in rejection message.""", doc_domain="tracspamfilter")
+    reload_interval = IntOption('spam-filter', 'ipregex_reload_interval', '60',
+        """How often, in seconds, each process checks whether the patterns on
+        the BadIP page or in the BadIP file were changed by another process.""",
+        doc_domain="tracspamfilter")
+
+    page_name = 'BadIP'
+    version_key = 'spamfilter_badip_version'
+
+    _network_re = re.compile(r'^[0-9A-Fa-f:.]+/\d+$')
 
     def __init__(self):
-        self.patterns = []
-        page = WikiPage(self.env, 'BadIP')
-        if page.exists:
-            self._load_patterns(page)
-        if self.badcontent_file != '':
-            file = open(self.badcontent_file,"r")
-            if file == None:
-                self.log.warning('BadIP file cannot be opened')
-            else:
-                lines = file.read().splitlines()
-                pat = [re.compile(p.strip()) for p in lines if p.strip()]
-                self.log.debug('Loaded %s patterns from BadIP file', len(pat))
-                self.patterns += pat
+        self._lock = Lock()
+        self._checked = time.time()
+        self._load()
 
     # IFilterStrategy implementation
 
     def is_external(self):
         return False
 
+    def get_max_karma(self):
+        return abs(self.karma_points) * \
+               (len(self.patterns) + len(self.networks))
+
     def test(self, req, author, content, ip):
+        self._check()
         gotcha = []
         points = 0
-        for pattern in self.patterns:
-            match = pattern.search(ip)
-            if match:
-                gotcha.append("'%s'" % pattern.pattern)
-                self.log.debug('Pattern %s found in submission',
-                               pattern.pattern)
-                points -= abs(self.karma_points)
+        matches = self.networks.search(ip) + \
+                  [pattern.pattern for pattern in self.matcher.search(ip)]
+        matches.sort(key=self._positions.get)
+        for pattern in matches:
+            gotcha.append("'%s'" % pattern)
+            self.log.debug('Pattern %s found in submission', pattern)
+            points -= abs(self.karma_points)
         if points != 0:
             if self.show_blacklisted:
                 matches = ", ".join(gotcha)
@@ -80,26 +91,58 @@ class IPRegexFilterStrategy(Component):
     def train(self, req, author, content, ip, spam=True):
         pass
 
-    # IWikiChangeListener implementation
-
-    def wiki_page_changed(self, page, *args):
-        if page.name == 'BadIP':
-            self._load_patterns(page)
-    wiki_page_added = wiki_page_changed
-    wiki_page_version_deleted = wiki_page_changed
-
-    def wiki_page_deleted(self, page):
-        if page.name == 'BadIP':
-            self.patterns = []
-
     # Internal methods
 
+    def _load(self, page=None, version=None):
+        if version is None:
+            version = self._get_version()
+        mtime = self._get_mtime()
+        lines = []
+        if page is None:
+            page = WikiPage(self.env, 'BadIP')
+        if page.exists:
+            lines += self._load_patterns(page)
+        if self.badcontent_file != '':
+            try:
+                file = open(self.badcontent_file, "r")
+                try:
+                    file_lines = file.read().splitlines()
+                finally:
+                    file.close()
+            except IOError, e:
+                self.log.warning('BadIP file cannot be opened: %s', e)
+            else:
+                pat = [p.strip() for p in file_lines if p.strip()]
+                self.log.debug('Loaded %s patterns from BadIP file', len(pat))
+                lines += pat
+        networks = NetworkMatcher()
+        patterns = []
+        # position of each entry on the page, for reporting the matches in
+        # that order
+        positions = {}
+        for idx, line in enumerate(lines):
+            positions.setdefault(line, idx)
+            if self._network_re.match(line):
+                try:
+                    networks.add(line)
+                except ValueError, e:
+                    self.log.warning('Invalid network on BadIP: %s', e)
+            else:
+                patterns.append(re.compile(line))
+        self.networks = networks
+        self.patterns = patterns
+        self.matcher = PatternMatcher(patterns)
+        self._positions = positions
+        self._version = version
+        self._mtime = mtime
+
     def _load_patterns(self, page):
         if '{{{' in page.text and '}}}' in page.text:
             lines = page.text.split('{{{', 1)[1].split('}}}', 1)[0].splitlines()
-            self.patterns = [re.compile(p.strip()) for p in lines if p.strip()]
+            patterns = [p.strip() for p in lines if p.strip()]
             self.log.debug('Loaded %s patterns from BadIP',
-                           len(self.patterns))
+                           len(patterns))
+            return patterns
         else:
             self.log.warning('BadIP page does not contain any patterns')
-            self.patterns = []
+            return []
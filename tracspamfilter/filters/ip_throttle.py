@@ -12,6 +12,7 @@
 # history and logs, available at http://projects.edgewall.com/trac/.
 
 from datetime import datetime, timedelta
+from time import mktime
 
 from trac.config import IntOption
 from trac.core import *
@@ -38,14 +39,14 @@ class IPThrottleFilterStrategy(Component):
     def is_external(self):
         return False
 
+    def get_max_karma(self):
+        # grows with the number of posts
+        return None
+
     def test(self, req, author, content, ip):
         threshold = datetime.now() - timedelta(hours=1)
-        num_posts = 0
-
-        for entry in LogEntry.select(self.env, ipnr=ip):
-            if datetime.fromtimestamp(entry.time) < threshold:
-                break
-            num_posts += 1
+        num_posts = LogEntry.count(self.env, ipnr=ip,
+                                   since=mktime(threshold.timetuple()))
 
         if num_posts > self.max_posts:
             return -abs(self.karma_points) * num_posts / self.max_posts, \
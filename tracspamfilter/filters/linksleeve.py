@@ -18,7 +18,7 @@ from pkg_resources import get_distribution
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 from tracspamfilter.timeoutserverproxy import TimeoutServerProxy
 
 class LinkSleeveFilterStrategy(Component):
@@ -47,6 +47,7 @@ class LinkSleeveFilterStrategy(Component):
                 return -abs(self.karma_points), N_('LinkSleeve says this is spam')
         except urllib2.URLError, e:
             self.log.warn('LinkSleeve request failed (%s)', e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         return
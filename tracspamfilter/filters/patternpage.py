@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import os
+import time
+
+from tracspamfilter.versionstamp import get_system_value, new_version_stamp
+
+__all__ = ['PatternPageReloader']
+
+
+class PatternPageReloader(object):
+    """Mixin for filter strategies reading patterns from the wiki page
+    `page_name` and the file `badcontent_file`.
+
+    When the page is changed, the patterns are loaded at once, and the
+    version stamp `version_key` is changed. The other processes check the
+    stamp and the modification time of the file at most every
+    `reload_interval` seconds, and load the patterns again if either
+    changed.
+
+    The class must provide `_load(page=None, version=None)`, which loads the
+    patterns and sets `_version` and `_mtime`, and must set `_lock` and
+    `_checked` before loading the patterns the first time.
+    """
+
+    page_name = None
+    version_key = None
+
+    # IWikiChangeListener implementation
+
+    def wiki_page_changed(self, page, *args):
+        if page.name == self.page_name:
+            self._changed(page)
+    wiki_page_added = wiki_page_changed
+    wiki_page_version_deleted = wiki_page_changed
+
+    def wiki_page_deleted(self, page):
+        if page.name == self.page_name:
+            self._changed(page)
+
+    # Internal methods
+
+    def _changed(self, page):
+        """Load the patterns after a change of the wiki page, and change the
+        version stamp so that the other processes load them, too."""
+        with self.env.db_transaction as db:
+            version = new_version_stamp(db, self.version_key)
+        with self._lock:
+            self._load(page, version)
+
+    def _check(self):
+        """Load the patterns again if the wiki page or the file were changed
+        by another process, checking at most every `reload_interval`
+        seconds."""
+        now = time.time()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+        if self._get_version() != self._version or \
+                self._get_mtime() != self._mtime:
+            with self._lock:
+                self.log.info('Reloading %s patterns', self.page_name)
+                self._load()
+
+    def _get_version(self):
+        return get_system_value(self.env.db_query, self.version_key)
+
+    def _get_mtime(self):
+        if self.badcontent_file != '':
+            try:
+                st = os.stat(self.badcontent_file)
+                return st.st_mtime, st.st_size
+            except OSError:
+                pass
@@ -16,14 +16,21 @@
 # Author: Matthew Good <trac@matt-good.net>
 
 import re
+from threading import Lock
+import time
 
 from trac.config import IntOption, Option, BoolOption
 from trac.core import *
 from trac.wiki.api import IWikiChangeListener
 from trac.wiki.model import WikiPage
 from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.filters.patternpage import PatternPageReloader
+from tracspamfilter.logwriter import LogWriter
+from tracspamfilter.matcher import PatternMatcher, has_nested_repeat, \
+                                   worst_search_time
+from tracspamfilter.model import PatternStatistics
 
-class RegexFilterStrategy(Component):
+class RegexFilterStrategy(Component, PatternPageReloader):
     """Spam filter based on regular expressions defined in BadContent page.
     """
     implements(IFilterStrategy, IWikiChangeListener)
@@ -36,41 +43,74 @@ class RegexFilterStrategy(Component):
         addition to BadContent wiki page.""", doc_domain="tracspamfilter")
     show_blacklisted = BoolOption('spam-filter', 'show_blacklisted', 'true',
         """Show the matched bad content patterns in rejection message.""", doc_domain="tracspamfilter")
+    reload_interval = IntOption('spam-filter', 'regex_reload_interval', '60',
+        """How often, in seconds, each process checks whether the patterns on
+        the BadContent page or in the BadContent file were changed by another process.""",
+        doc_domain="tracspamfilter")
+
+    profile = BoolOption('spam-filter', 'regex_profile', 'false',
+        """Measure the search time of each pattern on the BadContent page.
+        The patterns are searched one by one then, which is slower.""",
+        doc_domain="tracspamfilter")
+    stats_interval = IntOption('spam-filter', 'regex_stats_interval', '60',
+        """How often, in seconds, each process hands the number of matches
+        and the search times of the BadContent patterns to the background
+        thread writing them to the database.""", doc_domain="tracspamfilter")
+
+    time_budget = IntOption('spam-filter', 'regex_time_budget', '50',
+        """How long, in milliseconds, a BadContent pattern may take to search
+        texts crafted to make it backtrack, which is tested when the patterns
+        are loaded. Slower patterns are not used, as a submission could keep
+        a server process busy for minutes with them. Set to 0 to use all
+        patterns.""", doc_domain="tracspamfilter")
+    max_length = IntOption('spam-filter', 'regex_max_length', '262144',
+        """How many characters of a submission are searched for the
+        BadContent patterns at most. Set to 0 to search the whole
+        submission.""", doc_domain="tracspamfilter")
+
+    page_name = 'BadContent'
+    version_key = 'spamfilter_badcontent_version'
+    stats_source = 'BadContent'
 
     def __init__(self):
-        self.patterns = []
-        page = WikiPage(self.env, 'BadContent')
-        if page.exists:
-            self._load_patterns(page)
-        if self.badcontent_file != '':
-            file = open(self.badcontent_file,"r")
-            if file == None:
-                self.log.warning('BadContent file cannot be opened')
-            else:
-                lines = file.read().splitlines()
-                pat = [re.compile(p.strip()) for p in lines if p.strip()]
-                self.log.debug('Loaded %s patterns from BadContent file', len(pat))
-                self.patterns += pat
+        self._lock = Lock()
+        self._checked = time.time()
+        self._stats = {}
+        self._stats_lock = Lock()
+        self._flushed = time.time()
+        self._benchmarks = {}
+        self._load()
 
     # IFilterStrategy implementation
 
     def is_external(self):
         return False
 
+    def get_max_karma(self):
+        return abs(self.karma_points) * len(self.patterns)
+
     def test(self, req, author, content, ip):
+        self._check()
         gotcha = []
         points = 0
         if author != None and author != "anonymous":
             testcontent = author+"\n"+content
         else:
             testcontent = content
-        for pattern in self.patterns:
-            match = pattern.search(testcontent)
-            if match:
-                gotcha.append("'%s'" % pattern.pattern)
-                self.log.debug('Pattern %s found in submission',
-                               pattern.pattern)
-                points -= abs(self.karma_points)
+        if self.max_length > 0 and len(testcontent) > self.max_length:
+            self.log.debug('Searching the first %d of %d characters for '
+                           'BadContent patterns', self.max_length,
+                           len(testcontent))
+            testcontent = testcontent[:self.max_length]
+        if self.profile:
+            matches = self._profile(testcontent)
+        else:
+            matches = self.matcher.search(testcontent)
+        self._record(matches)
+        for pattern in matches:
+            gotcha.append("'%s'" % pattern.pattern)
+            self.log.debug('Pattern %s found in submission', pattern.pattern)
+            points -= abs(self.karma_points)
         if points != 0:
             if self.show_blacklisted:
                 matches = ", ".join(gotcha)
@@ -81,26 +121,136 @@ class RegexFilterStrategy(Component):
     def train(self, req, author, content, ip, spam=True):
         pass
 
-    # IWikiChangeListener implementation
+    def flush_stats(self):
+        """Write the pattern statistics collected by this process to the
+        database, and wait for the statistics queued before."""
+        stats = self._take_stats()
+        if stats:
+            self._get_writer().put(stats)
+        self._get_writer().flush()
 
-    def wiki_page_changed(self, page, *args):
-        if page.name == 'BadContent':
-            self._load_patterns(page)
-    wiki_page_added = wiki_page_changed
-    wiki_page_version_deleted = wiki_page_changed
+    # Internal methods
 
-    def wiki_page_deleted(self, page):
-        if page.name == 'BadContent':
-            self.patterns = []
+    def _profile(self, text):
+        """Search the patterns one by one, and record their search times."""
+        patterns = self.patterns
+        durations = []
+        matches = []
+        for pattern in patterns:
+            start = time.time()
+            match = pattern.search(text)
+            durations.append(time.time() - start)
+            if match:
+                matches.append(pattern)
+        with self._stats_lock:
+            for pattern, duration in zip(patterns, durations):
+                stats = self._stats.setdefault(pattern.pattern,
+                                               [0, None, 0, 0.0])
+                stats[2] += 1
+                stats[3] += duration
+        return matches
 
-    # Internal methods
+    def _record(self, matches):
+        now = time.time()
+        with self._stats_lock:
+            for pattern in matches:
+                stats = self._stats.setdefault(pattern.pattern,
+                                               [0, None, 0, 0.0])
+                stats[0] += 1
+                stats[1] = int(now)
+        if now - self._flushed >= self.stats_interval:
+            stats = self._take_stats()
+            if stats:
+                self._get_writer().put(stats)
+
+    def _take_stats(self):
+        """Return the statistics collected since the last call, or `None`
+        if there are none."""
+        with self._stats_lock:
+            stats = self._stats
+            self._stats = {}
+            self._flushed = time.time()
+        if stats:
+            return PatternStatistics(self.env, self.stats_source, stats)
+
+    def _get_writer(self):
+        return LogWriter.get(self.env,
+                             self.config.getint('spam-filter',
+                                                'log_queue_size'))
+
+    def _load(self, page=None, version=None):
+        if version is None:
+            version = self._get_version()
+        mtime = self._get_mtime()
+        patterns = []
+        if page is None:
+            page = WikiPage(self.env, 'BadContent')
+        if page.exists:
+            patterns += self._load_patterns(page)
+        if self.badcontent_file != '':
+            try:
+                file = open(self.badcontent_file, "r")
+                try:
+                    lines = file.read().splitlines()
+                finally:
+                    file.close()
+            except IOError, e:
+                self.log.warning('BadContent file cannot be opened: %s', e)
+            else:
+                pat = [re.compile(p.strip()) for p in lines if p.strip()]
+                self.log.debug('Loaded %s patterns from BadContent file', len(pat))
+                patterns += pat
+        self.patterns, self.rejected = self._benchmark(patterns)
+        self.matcher = PatternMatcher(self.patterns)
+        self._version = version
+        self._mtime = mtime
+
+    def _benchmark(self, patterns):
+        """Return the patterns which search texts crafted to make them
+        backtrack within the time budget, and a list of `(pattern, seconds)`
+        tuples with the other ones.
+
+        The results are kept, so that only new patterns are benchmarked when
+        the patterns are loaded again.
+        """
+        if self.time_budget <= 0:
+            return patterns, []
+        budget = self.time_budget / 1000.0
+        benchmarks = {}
+        accepted = []
+        rejected = []
+        for pattern in patterns:
+            key = (pattern.pattern, budget)
+            duration = self._benchmarks.get(key)
+            if duration is None:
+                duration = worst_search_time(pattern, budget)
+                if duration > budget:
+                    # make sure the server wasn't just busy with something else
+                    duration = min(duration,
+                                   worst_search_time(pattern, budget))
+                if duration > budget:
+                    self.log.error('BadContent pattern %s takes more than '
+                                   '%.3f s to search a crafted text and is '
+                                   'not used', pattern.pattern, duration)
+                elif has_nested_repeat(pattern):
+                    self.log.warning('BadContent pattern %s contains nested '
+                                     'repetitions, which can make searches '
+                                     'slow', pattern.pattern)
+            benchmarks[key] = duration
+            if duration > budget:
+                rejected.append((pattern, duration))
+            else:
+                accepted.append(pattern)
+        self._benchmarks = benchmarks
+        return accepted, rejected
 
     def _load_patterns(self, page):
         if '{{{' in page.text and '}}}' in page.text:
             lines = page.text.split('{{{', 1)[1].split('}}}', 1)[0].splitlines()
-            self.patterns = [re.compile(p.strip()) for p in lines if p.strip()]
+            patterns = [re.compile(p.strip()) for p in lines if p.strip()]
             self.log.debug('Loaded %s patterns from BadContent',
-                           len(self.patterns))
+                           len(patterns))
+            return patterns
         else:
             self.log.warning('BadContent page does not contain any patterns')
-            self.patterns = []
+            return []
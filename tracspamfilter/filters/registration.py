@@ -57,6 +57,10 @@ class RegistrationFilterStrategy(Component):
     def is_external(self):
         return False
 
+    def get_max_karma(self):
+        # each registration check may fail
+        return abs(self.karma_points) * len(self.listeners)
+
     def test(self, req, author, content, ip):
         if self.karma_points and req.path_info == "/register":
             karma = 0
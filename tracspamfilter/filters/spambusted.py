@@ -20,7 +20,7 @@ from pkg_resources import get_distribution
 from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 
 class SpamBustedFilterStrategy(Component):
     """Spam filter using the SpamBusted (http://www.spambusted.com/).
@@ -52,8 +52,10 @@ class SpamBustedFilterStrategy(Component):
                 return -abs(self.karma_points), N_('SpamBusted says this is spam')
         except urllib2.URLError, e:
             self.log.warn('SpamBusted request failed (%s)', e)
+            raise ServiceError(e)
         except IOError, e:
             self.log.warn("SpamBusted request failed: %s", e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         if not spam or not self._check_preconditions(True):
@@ -21,7 +21,7 @@ from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
 from trac.mimeview.api import is_binary
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 
 class SpamWipeFilterStrategy(Component):
     """Spam filter using the SpamWipet service (http://www.spamwipe.com/)."""
@@ -65,6 +65,7 @@ class SpamWipeFilterStrategy(Component):
 
         except urllib2.URLError, e:
             self.log.warn('SpamWipe request failed (%s)', e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         if not self._check_preconditions(req, author, content):
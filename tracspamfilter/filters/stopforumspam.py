@@ -12,22 +12,28 @@
 # history and logs, available at http://projects.edgewall.com/trac/.
 
 from email.Utils import parseaddr
+import gzip
+import os
 from urllib import urlencode
 import urllib2
 import re
 from pkg_resources import get_distribution
 from xml.etree import ElementTree
+from zipfile import ZipFile
 
 from trac import __version__ as TRAC_VERSION
+from trac.admin import AdminCommandError, IAdminCommandProvider
 from trac.config import IntOption, Option
 from trac.core import *
-from tracspamfilter.api import IFilterStrategy, _, N_
+from trac.util.text import printout
+from tracspamfilter.api import IFilterStrategy, ServiceError, _, N_
+from tracspamfilter.listmirror import ListMirror
 
 class StopForumSpamFilterStrategy(Component):
     """Spam filter using the StopForumSpam service (http://stopforumspam.com/).
     """
-    implements(IFilterStrategy)
-    
+    implements(IFilterStrategy, IAdminCommandProvider)
+
     karma_points = IntOption('spam-filter', 'stopforumspam_karma', '4',
         """By how many points a StopForumSpam reject impacts the overall karma of
         a submission.""", doc_domain="tracspamfilter")
@@ -35,18 +41,36 @@ class StopForumSpamFilterStrategy(Component):
     api_key = Option('spam-filter', 'stopforumspam_api_key', '',
         """API key used to report SPAM.""", doc_domain="tracspamfilter")
 
+    mirror = Option('spam-filter', 'stopforumspam_mirror', '',
+        """Path of a file with a copy of the lists published by
+        StopForumSpam, relative to the environment directory. Submissions
+        are looked up in that file instead of asking the StopForumSpam
+        service, and are not reported to it. Use `trac-admin spamfilter
+        stopforumspam refresh` to create and update the file from the
+        downloaded lists. Leave empty to ask the service for each
+        submission.""", doc_domain="tracspamfilter")
+
     user_agent = 'Trac/%s | SpamFilter/%s'  % (
         TRAC_VERSION, get_distribution('TracSpamFilter').version
     )
 
+    # kind of the entries of a list, from the names of the downloaded files
+    _kind_re = re.compile(r'(?:^|[\W_])(ip|email|username)(?:[\W_]|$)')
+
     # IFilterStrategy implementation
 
     def is_external(self):
-        return True
+        return not self.mirror
+
+    def get_max_karma(self):
+        # username, IP and e-mail may each be listed
+        return abs(self.karma_points) * 3
 
     def test(self, req, author, content, ip):
         if not self._check_preconditions(False):
             return
+        if self.mirror:
+            return self._test_mirror(author, ip)
         try:
             resp = self._send(req, author, content, ip, False)
             tree = ElementTree.fromstring(resp)
@@ -63,9 +87,10 @@ class StopForumSpamFilterStrategy(Component):
                 return -int(karma+0.5), N_('StopForumSpam says this is spam (%s)'), reason
         except IOError, e:
             self.log.warn('StopForumSpam request failed (%s)', e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
-        if not spam or not self._check_preconditions(True):
+        if not spam or not self._check_preconditions(True) or self.mirror:
             return
 
         try:
@@ -73,8 +98,96 @@ class StopForumSpamFilterStrategy(Component):
         except urllib2.URLError, e:
             self.log.warn('StopForumSpam request failed (%s)', e)
 
+    # IAdminCommandProvider methods
+
+    def get_admin_commands(self):
+        yield ('spamfilter stopforumspam refresh', '<file> [file ...]',
+               'Replace the copy of the StopForumSpam lists configured in '
+               '[spam-filter] stopforumspam_mirror by the listed IP '
+               'addresses, e-mail addresses and usernames in the downloaded '
+               'files. The kind of entries is taken from the file names, '
+               'like "listed_ip_30.zip"',
+               None, self._do_refresh)
+
     # Internal methods
 
+    def _do_refresh(self, *filenames):
+        if not self.mirror:
+            raise AdminCommandError(_("No mirror file is configured in "
+                                      "[spam-filter] stopforumspam_mirror."))
+        if not filenames:
+            raise AdminCommandError(_("No list files given."), show_usage=True)
+        kinds = []
+        for filename in filenames:
+            match = self._kind_re.search(os.path.basename(filename).lower())
+            if not match:
+                raise AdminCommandError(_("Cannot tell the kind of entries "
+                                          "in %(file)s.", file=filename))
+            kinds.append((filename, match.group(1)))
+        def read_entries():
+            # the entries are read while the mirror is written, so that the
+            # lists are never held in memory
+            for filename, kind in kinds:
+                try:
+                    for line in self._read_list(filename):
+                        # some lists have more fields, like the number of
+                        # reports
+                        value = line.split(',', 1)[0].strip().strip('"')
+                        if value and not value.startswith('#'):
+                            yield kind, value
+                except (IOError, OSError), e:
+                    raise AdminCommandError(_("Cannot read %(file)s: "
+                                              "%(error)s", file=filename,
+                                              error=e))
+        path = self._get_mirror_path()
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        count = ListMirror.write(path, read_entries())
+        printout(_("Stored %(count)d entries in %(path)s.", count=count,
+                   path=path))
+
+    def _read_list(self, filename):
+        """Yield the lines of a list file, which may be compressed, one by
+        one."""
+        if filename.endswith('.zip'):
+            archive = ZipFile(filename)
+            try:
+                for name in archive.namelist():
+                    member = archive.open(name)
+                    try:
+                        for line in member:
+                            yield line.rstrip('\r\n')
+                    finally:
+                        member.close()
+            finally:
+                archive.close()
+            return
+        if filename.endswith('.gz'):
+            fileobj = gzip.open(filename, 'rb')
+        else:
+            fileobj = open(filename, 'rb')
+        try:
+            for line in fileobj:
+                yield line.rstrip('\r\n')
+        finally:
+            fileobj.close()
+
+    def _get_mirror_path(self):
+        return os.path.join(self.env.path, self.mirror)
+
+    def _test_mirror(self, author, ip):
+        mirror = ListMirror.get(self._get_mirror_path(), self.log)
+        author_name, author_email = self._split_author(author)
+        reason = []
+        for entry, value in (('username', author_name), ('ip', ip),
+                             ('email', author_email)):
+            if value and mirror.contains(entry, value):
+                reason.append(entry)
+        if reason:
+            return -abs(self.karma_points) * len(reason), \
+                   N_('StopForumSpam says this is spam (%s)'), ",".join(reason)
+
     def _check_preconditions(self, train):
         if self.karma_points == 0:
             return False
@@ -84,7 +197,7 @@ class StopForumSpamFilterStrategy(Component):
 
         return True
 
-    def _send(self, req, author, content, ip, train):
+    def _split_author(self, author):
         # Split up author into name and email, if possible
         author = author.encode('utf-8')
         author_name, author_email = parseaddr(author)
@@ -95,6 +208,10 @@ class StopForumSpamFilterStrategy(Component):
             author_email = None
         if author_name == "anonymous":
             author_name = None
+        return author_name, author_email
+
+    def _send(self, req, author, content, ip, train):
+        author_name, author_email = self._split_author(author)
 
         params = {'ip': ip}
         if author_name:
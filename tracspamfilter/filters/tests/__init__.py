@@ -13,16 +13,19 @@
 
 import unittest
 
-from tracspamfilter.filters.tests import akismet, bayes, extlinks, regex, \
-                                         session
+from tracspamfilter.filters.tests import akismet, bayes, extlinks, \
+                                         ip_regex, regex, session, \
+                                         stopforumspam
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(akismet.suite())
     suite.addTest(bayes.suite())
     suite.addTest(extlinks.suite())
+    suite.addTest(ip_regex.suite())
     suite.addTest(regex.suite())
     suite.addTest(session.suite())
+    suite.addTest(stopforumspam.suite())
     return suite
 
 if __name__ == '__main__':
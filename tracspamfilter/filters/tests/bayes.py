@@ -11,14 +11,37 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
+import gzip
+import os
+import shutil
 from StringIO import StringIO
+import tempfile
+from threading import Thread
+import time
 import unittest
 
 from trac.db.sqlite_backend import _to_sql
+from trac.core import TracError
 from trac.test import EnvironmentStub, Mock
 from tracspamfilter.model import schema
 
 
+class Pipe(object):
+    """File which can only be read sequentially, like standard input."""
+
+    def __init__(self, data):
+        self._file = StringIO(data)
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def seek(self, offset, whence=0):
+        raise IOError(29, 'Illegal seek')
+
+    def tell(self):
+        raise IOError(29, 'Illegal seek')
+
+
 class BayesianFilterStrategyTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -27,35 +50,50 @@ class BayesianFilterStrategyTestCase(unittest.TestCase):
         db = self.env.get_db_cnx()
         cursor = db.cursor()
         for table in schema:
+            cursor.execute("DROP TABLE IF EXISTS %s" % table.name)
             for stmt in _to_sql(table):
                 cursor.execute(stmt)
+        TokenCache._caches.clear()
+        TracDbClassifier._classifiers.clear()
+        SQLiteStore._stores.clear()
+        self.hammie = bayes.Hammie
+        self.tempdir = tempfile.mkdtemp()
 
         self.strategy = BayesianFilterStrategy(self.env)
 
+    def tearDown(self):
+        bayes.Hammie = self.hammie
+        for store in SQLiteStore._stores.values():
+            store.close()
+        shutil.rmtree(self.tempdir)
+
     def test_karma_calculation_unsure(self):
-        bayes.Hammie = lambda x: Mock(score=lambda x: .5,
-                                      bayes=Mock(nham=1000, nspam=1000))
+        bayes.Hammie = lambda x: Mock(bayes=Mock(nham=1000, nspam=1000,
+                                                prefetch=lambda x: None,
+                                                spamprob=lambda x: .5))
 
         req = Mock(authname='anonymous', base_url='http://example.org/',
                    remote_addr='127.0.0.1')
         self.assertEquals(None, self.strategy.test(req, 'John Doe', 'Spam', '127.0.0.1'))
 
     def test_karma_calculation_negative(self):
-        bayes.Hammie = lambda x: Mock(score=lambda x: .75,
-                                      bayes=Mock(nham=1000, nspam=1000))
+        bayes.Hammie = lambda x: Mock(bayes=Mock(nham=1000, nspam=1000,
+                                                prefetch=lambda x: None,
+                                                spamprob=lambda x: .75))
 
         req = Mock(authname='anonymous', base_url='http://example.org/',
                    remote_addr='127.0.0.1')
-        points, reasons = self.strategy.test(req, 'John Doe', 'Spam', '127.0.0.1')
+        points = self.strategy.test(req, 'John Doe', 'Spam', '127.0.0.1')[0]
         self.assertEquals(-5, points)
 
     def test_karma_calculation_positive(self):
-        bayes.Hammie = lambda x: Mock(score=lambda x: .25,
-                                      bayes=Mock(nham=1000, nspam=1000))
+        bayes.Hammie = lambda x: Mock(bayes=Mock(nham=1000, nspam=1000,
+                                                prefetch=lambda x: None,
+                                                spamprob=lambda x: .25))
 
         req = Mock(authname='anonymous', base_url='http://example.org/',
                    remote_addr='127.0.0.1')
-        points, reasons = self.strategy.test(req, 'John Doe', 'Spam', '127.0.0.1')
+        points = self.strategy.test(req, 'John Doe', 'Spam', '127.0.0.1')[0]
         self.assertEquals(5, points)
 
     def test_classifier_untrained(self):
@@ -70,22 +108,456 @@ class BayesianFilterStrategyTestCase(unittest.TestCase):
         self.strategy.train(req, 'John Doe', 'Spam spam spammie', '127.0.0.1', True)
         self.strategy.train(req, 'John Doe', 'Ham ham hammie', '127.0.0.1', False)
 
-        points, reasons = self.strategy.test(req, 'John Doe', 'Hammie', '127.0.0.1')
+        points = self.strategy.test(req, 'John Doe', 'Hammie', '127.0.0.1')[0]
         assert points > 0, 'Expected positive karma'
-        points, reasons = self.strategy.test(req, 'John Doe', 'Spam', '127.0.0.1')
+        points = self.strategy.test(req, 'John Doe', 'Spam', '127.0.0.1')[0]
         assert points < 0, 'Expected negative karma'
 
+    def _train(self):
+        req = Mock(authname='anonymous', base_url='http://example.org/',
+                   remote_addr='127.0.0.1')
+        self.env.config.set('spam-filter', 'bayes_min_training', '1')
+        self.strategy.train(req, 'John Doe', 'Spam spam spammie', '127.0.0.1', True)
+        self.strategy.train(req, 'John Doe', 'Ham ham hammie', '127.0.0.1', False)
+        return req
+
+    def test_cache_write_back(self):
+        self._train()
+        rows = dict((row[0], row[1:]) for row in self.env.db_query(
+                    "SELECT word,nspam,nham FROM spamfilter_bayes"))
+        self.assertEqual((1, 0), rows['spammie'])
+        self.assertEqual((0, 1), rows['hammie'])
+        self.assertEqual((1, 1), rows['saved state'])
+        cache = TokenCache.get(self.env, 100)
+        self.assertEqual((True, (1, 0)), cache.lookup(u'spammie'))
+        self.assertNotEqual(None, cache.version)
+
+    def test_cache_used_for_scoring(self):
+        req = self._train()
+        cache = TokenCache.get(self.env, 100)
+        cache.update({u'hammie': (5, 0)})
+        points = self.strategy.test(req, 'John Doe', 'Hammie', '127.0.0.1')[0]
+        assert points < 0, 'Expected cached counts to be used'
+
+    def test_cache_invalidated_by_version(self):
+        req = self._train()
+        cache = TokenCache.get(self.env, 100)
+        cache.update({u'hammie': (5, 0)})
+        # another process trains the classifier
+        with self.env.db_transaction as db:
+            TracDbClassifier.set_version(db)
+        points = self.strategy.test(req, 'John Doe', 'Hammie', '127.0.0.1')[0]
+        assert points > 0, 'Expected cache to be dropped'
+
+    def test_store_failure(self):
+        classifier = self.strategy._get_hammie().bayes
+        self.assertEqual(None, classifier._get_version())
+        classifier.learn(['eggs'], True)
+        def fail(db, changes):
+            raise TracError('Failed')
+        classifier._update_summary = fail
+        self.assertRaises(TracError, classifier.store)
+        del classifier._update_summary
+        classifier.refresh()
+        self.assertEqual((0, 0), (classifier.nspam, classifier.nham))
+        self.assertEqual([], self.env.db_query(
+            "SELECT * FROM spamfilter_bayes"))
+
+    def test_cache_disabled(self):
+        self.env.config.set('spam-filter', 'bayes_cache_size', '0')
+        self._train()
+        self.assertEqual(0, len(TokenCache._caches))
+        self.assertEqual([(1, 0)], self.env.db_query(
+            "SELECT nspam,nham FROM spamfilter_bayes WHERE word='spammie'"))
+
+    def test_prefetch(self):
+        self.env.config.set('spam-filter', 'bayes_cache_size', '0')
+        self._train()
+        classifier = self.strategy._get_hammie().bayes
+        classifier.prefetch(['spammie', 'unknown'])
+        self.env.db_transaction("DELETE FROM spamfilter_bayes")
+        self.assertEqual({'nspam': 1, 'nham': 0},
+                         classifier._get_row('spammie'))
+        self.assertEqual({}, classifier._get_row('unknown'))
+
+    def test_get_rows_chunked(self):
+        self._train()
+        classifier = self.strategy._get_hammie().bayes
+        rows = classifier._get_rows([u'spammie', u'hammie', u'unknown'],
+                                    chunk_size=2)
+        self.assertEqual({u'spammie': (1, 0), u'hammie': (0, 1)}, rows)
+
+    def test_concurrent_training(self):
+        self.env.config.set('spam-filter', 'bayes_cache_size', '0')
+        self._train()
+        first = self.strategy._get_hammie().bayes
+        # the classifier of another process
+        second = TracDbClassifier(self.env)
+        first.learn(['spammie', 'eggs'], True)
+        second.learn(['spammie'], True)
+        first.store()
+        second.store()
+        rows = dict((row[0], row[1:]) for row in self.env.db_query(
+                    "SELECT word,nspam,nham FROM spamfilter_bayes"))
+        self.assertEqual((3, 0), rows['spammie'])
+        self.assertEqual((1, 0), rows['eggs'])
+        self.assertEqual((3, 1), rows['saved state'])
+
+    def test_untrain_deletes_tokens(self):
+        self._train()
+        hammie = self.strategy._get_hammie()
+        tokens = list(tokenize('John Doe\nSpam spam spammie'))
+        hammie.bayes.unlearn(tokens, True)
+        hammie.store()
+        self.assertEqual([], self.env.db_query(
+            "SELECT * FROM spamfilter_bayes WHERE word='spammie'"))
+        self.assertEqual([(0, 1)], self.env.db_query(
+            "SELECT nspam,nham FROM spamfilter_bayes WHERE word='saved state'"))
+
+    def test_classifier_shared(self):
+        first = self.strategy._get_hammie().bayes
+        second = BayesianFilterStrategy(self.env)._get_hammie().bayes
+        self.assertTrue(first is second)
+
+    def test_classifier_new_environment(self):
+        classifier = self.strategy._get_hammie().bayes
+        # Trac creates the environment again after the configuration changed
+        env = EnvironmentStub(enable=[BayesianFilterStrategy])
+        self.assertEqual(self.env.path, env.path)
+        self.assertTrue(classifier is
+                        BayesianFilterStrategy(env)._get_hammie().bayes)
+        self.assertTrue(classifier.env is env)
+        self.assertTrue(classifier.storage is env)
+        self.assertTrue(classifier.log is env.log)
+
+    def test_classifier_storage_option(self):
+        path = os.path.join(self.tempdir, 'bayes.db')
+        self.env.config.set('spam-filter', 'bayes_storage', path)
+        classifier = TracDbClassifier(self.env)
+        self.assertTrue(classifier.storage is SQLiteStore.get(path))
+        self.assertEqual(None, classifier.shared)
+        self.env.config.set('spam-filter', 'bayes_local_overlay', 'true')
+        classifier = TracDbClassifier(self.env)
+        self.assertTrue(classifier.storage is self.env)
+        self.assertTrue(classifier.shared is SQLiteStore.get(path))
+
+    def test_refresh_after_foreign_training(self):
+        self._train()
+        classifier = self.strategy._get_hammie().bayes
+        other = TracDbClassifier(self.env)
+        other.learn(['spammie'], True)
+        other.store()
+        self.assertEqual(1, classifier.nspam)
+        classifier.refresh()
+        self.assertEqual(2, classifier.nspam)
+
+    def test_threads(self):
+        # threads can't share the in-memory database of the test environment
+        self.env.config.set('spam-filter', 'bayes_storage',
+                            os.path.join(self.tempdir, 'bayes.db'))
+        req = self._train()
+        results = []
+        def score():
+            results.append(self.strategy.test(req, 'John Doe', 'Spam',
+                                              '127.0.0.1'))
+        threads = [Thread(target=score) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(5, len(results))
+        self.assertEqual(1, len(set(results)))
+
+    def test_storage(self):
+        path = os.path.join(self.tempdir, 'db', 'bayes.db')
+        self.env.config.set('spam-filter', 'bayes_storage', path)
+        req = self._train()
+        self.assertEqual([], self.env.db_query(
+            "SELECT * FROM spamfilter_bayes"))
+        storage = SQLiteStore.get(path)
+        self.assertEqual([(1, 0)], storage.db_query(
+            "SELECT nspam,nham FROM spamfilter_bayes WHERE word='spammie'"))
+        points = self.strategy.test(req, 'John Doe', 'Hammie', '127.0.0.1')[0]
+        assert points > 0, 'Expected positive karma'
+
+    def test_local_overlay(self):
+        path = os.path.join(self.tempdir, 'shared.db')
+        self.env.config.set('spam-filter', 'bayes_storage', path)
+        req = self._train()
+        storage = SQLiteStore.get(path)
+        shared = sorted(storage.db_query("SELECT * FROM spamfilter_bayes"))
+
+        self.env.config.set('spam-filter', 'bayes_local_overlay', 'true')
+        self.strategy.train(req, 'John Doe', 'Ham eggs', '127.0.0.1', False)
+        self.strategy.train(req, 'John Doe', 'Spam spam spammie', '127.0.0.1',
+                            True)
+        self.strategy.train(req, 'John Doe', 'Spam spam spammie', '127.0.0.1',
+                            False)
+        self.assertEqual(shared, sorted(storage.db_query(
+            "SELECT * FROM spamfilter_bayes")))
+        rows = dict((row[0], row[1:]) for row in self.env.db_query(
+                    "SELECT word,nspam,nham FROM spamfilter_bayes"))
+        self.assertEqual((0, 1), rows['eggs'])
+        self.assertEqual((1, 1), rows['spammie'])
+        self.assertFalse('hammie' in rows)
+
+        bayes = self.strategy._get_hammie().bayes
+        self.assertEqual((2, 3), (bayes.nspam, bayes.nham))
+        self.assertEqual({'nspam': 2, 'nham': 1}, bayes._get_row('spammie'))
+        self.assertEqual({'nspam': 0, 'nham': 1}, bayes._get_row('hammie'))
+        points = self.strategy.test(req, 'John Doe', 'Hammie', '127.0.0.1')[0]
+        assert points > 0, 'Expected positive karma'
+
+        # a training of the shared database reaches the overlay
+        self.env.config.set('spam-filter', 'bayes_local_overlay', 'false')
+        self.strategy.train(req, 'John Doe', 'Ham eggs', '127.0.0.1', True)
+        self.env.config.set('spam-filter', 'bayes_local_overlay', 'true')
+        bayes = self.strategy._get_hammie().bayes
+        self.assertEqual((3, 3), (bayes.nspam, bayes.nham))
+        self.assertEqual({'nspam': 1, 'nham': 1}, bayes._get_row('eggs'))
+
+    def test_migrate(self):
+        req = self._train()
+        path = os.path.join(self.tempdir, 'bayes.db')
+        self.env.config.set('spam-filter', 'bayes_storage', path)
+        storage = SQLiteStore.get(path)
+        storage.db_transaction("INSERT INTO spamfilter_bayes "
+                               "(word,nspam,nham) VALUES ('eggs',1,1)")
+        total = self.env.db_query("SELECT COUNT(*) FROM spamfilter_bayes")
+        self.assertEqual(total[0][0],
+                         TracDbClassifier.copy(self.env, storage, 4))
+        self.assertEqual(sorted(self.env.db_query(
+                            "SELECT * FROM spamfilter_bayes")),
+                         sorted(storage.db_query(
+                            "SELECT * FROM spamfilter_bayes")))
+        points = self.strategy.test(req, 'John Doe', 'Hammie', '127.0.0.1')[0]
+        assert points > 0, 'Expected positive karma'
+
+    def test_export_import(self):
+        self._train()
+        rows = sorted(self.env.db_query("SELECT * FROM spamfilter_bayes"))
+        fileobj = StringIO()
+        self.assertEqual(len(rows),
+                         TracDbClassifier.export_to(self.env, fileobj, 4))
+        self.env.db_transaction("DELETE FROM spamfilter_bayes")
+        self.env.db_transaction("INSERT INTO spamfilter_bayes "
+                                "(word,nspam,nham) VALUES ('eggs',1,1)")
+        fileobj.seek(0)
+        self.assertEqual(len(rows),
+                         TracDbClassifier.import_from(self.env, fileobj, 4))
+        self.assertEqual(rows, sorted(self.env.db_query(
+                                      "SELECT * FROM spamfilter_bayes")))
+
+    def test_import_pipe(self):
+        self._train()
+        rows = sorted(self.env.db_query("SELECT * FROM spamfilter_bayes"))
+        fileobj = StringIO()
+        TracDbClassifier.export_to(self.env, fileobj)
+        self.env.db_transaction("DELETE FROM spamfilter_bayes")
+        pipe = Pipe(fileobj.getvalue())
+        self.assertEqual(len(rows),
+                         TracDbClassifier.import_from(self.env, pipe, 4))
+        self.assertEqual(rows, sorted(self.env.db_query(
+                                      "SELECT * FROM spamfilter_bayes")))
+
+    def test_import_invalid(self):
+        self._train()
+        fileobj = StringIO()
+        TracDbClassifier.export_to(self.env, fileobj)
+        fileobj.seek(0)
+        data = gzip.GzipFile(fileobj=fileobj, mode='rb').read()
+        for data in ('not gzip', self._compress('Not an export'),
+                     self._compress(data[:-20])):
+            self.assertRaises((TracError, IOError),
+                              TracDbClassifier.import_from, self.env,
+                              StringIO(data))
+            self.assertEqual([(1, 0)], self.env.db_query(
+                "SELECT nspam,nham FROM spamfilter_bayes "
+                "WHERE word='spammie'"))
+
+    def _compress(self, data):
+        fileobj = StringIO()
+        out = gzip.GzipFile(fileobj=fileobj, mode='wb')
+        out.write(data)
+        out.close()
+        return fileobj.getvalue()
+
+    def test_wordinfokeys(self):
+        self._train()
+        classifier = self.strategy._get_hammie().bayes
+        words = sorted(row[0] for row in self.env.db_query(
+                       "SELECT word FROM spamfilter_bayes"))
+        self.assertEqual(words, list(classifier._wordinfokeys()))
+
+    def _break_totals(self):
+        req = self._train()
+        self.env.db_transaction("UPDATE spamfilter_bayes SET nspam=5 "
+                                "WHERE word='spammie'")
+        self.env.db_transaction("UPDATE system SET value='broken' "
+                                "WHERE name='spamfilter_bayes_version'")
+        return req
+
+    def _get_state(self):
+        return self.env.db_query("SELECT nspam,nham FROM spamfilter_bayes "
+                                 "WHERE word='saved state'")[0]
+
+    def test_scoring_does_not_write(self):
+        req = self._break_totals()
+        self.strategy.test(req, 'John Doe', 'Spam spammie', '127.0.0.1')
+        self.assertEqual((1, 1), self._get_state())
+        self.assertEqual([('broken',)], self.env.db_query(
+            "SELECT value FROM system WHERE name='spamfilter_bayes_version'"))
+
+    def test_training_repairs_totals(self):
+        req = self._break_totals()
+        self.strategy.train(req, 'John Doe', 'Spam spammie', '127.0.0.1', True)
+        self.assertEqual((6, 1), self._get_state())
+
+    def test_repair(self):
+        self._break_totals()
+        classifier = self.strategy._get_hammie().bayes
+        self.assertEqual(((1, 1), (5, 1)), classifier.repair())
+        self.assertEqual((5, 1), self._get_state())
+        self.assertEqual(((5, 1), (5, 1)), classifier.repair())
+        self.assertEqual(5, self.strategy._get_hammie().bayes.nspam)
+
+    def test_lastseen(self):
+        self._train()
+        rows = self.env.db_query("SELECT lastseen FROM spamfilter_bayes "
+                                 "WHERE word='spammie'")
+        self.assertTrue(time.time() - rows[0][0] < 10)
+
+    def test_prune(self):
+        self._train()
+        classifier = self.strategy._get_hammie().bayes
+        classifier.learn(['eggs'], True)
+        classifier.learn(['eggs'], False)
+        classifier.store()
+        self.env.db_transaction("UPDATE spamfilter_bayes SET lastseen=0")
+        self.env.db_transaction("UPDATE spamfilter_bayes "
+                                "SET lastseen=%s WHERE word='hammie'",
+                                (int(time.time()),))
+        total = classifier.count()
+        self.assertEqual((total, total - 3),
+                         classifier.prune(1, 30, chunk_size=2))
+        words = [row[0] for row in self.env.db_query(
+                 "SELECT word FROM spamfilter_bayes")]
+        for word in ('spam', 'spammie', 'ham'):
+            self.assertFalse(word in words)
+        for word in ('eggs', 'hammie', 'john', 'saved state'):
+            self.assertTrue(word in words)
+
+    def test_prune_drops_cache(self):
+        self._train()
+        classifier = self.strategy._get_hammie().bayes
+        cache = TokenCache.get(self.env, 100)
+        self.assertEqual((True, (1, 0)), cache.lookup(u'spammie'))
+        version = classifier._get_version()
+        self.env.db_transaction("UPDATE spamfilter_bayes SET lastseen=0")
+        classifier.prune(1, 30)
+        self.assertEqual(None, classifier.version)
+        self.assertNotEqual(version, classifier._get_version())
+        classifier.refresh()
+        self.assertEqual((False, None), cache.lookup(u'spammie'))
+
+    def test_statistics(self):
+        self._train()
+        classifier = self.strategy._get_hammie().bayes
+        for i in xrange(3):
+            classifier.learn(['eggs'], True)
+        classifier.store()
+        rows = self.env.db_query("SELECT nspam,nham FROM spamfilter_bayes "
+                                 "WHERE word!='saved state'")
+        stats = classifier.statistics(limit=2)
+        self.assertEqual(len(rows), stats['tokens'])
+        self.assertEqual([len([1 for nspam, nham in rows if nspam == 0]), 0,
+                          len([1 for nspam, nham in rows if nspam == nham]),
+                          0, len([1 for nspam, nham in rows if nham == 0])],
+                         stats['histogram'])
+        self.assertEqual(2, len(stats['spammy']))
+        self.assertEqual((u'eggs', 3, 0), stats['spammy'][0][:3])
+        assert stats['spammy'][0][3] > .5, 'Expected spam probability'
+        self.assertEqual(2, len(stats['hammy']))
+        for word, nspam, nham, prob in stats['hammy']:
+            self.assertEqual((0, 1), (nspam, nham))
+            assert prob < .5, 'Expected ham probability'
+
+    def test_statistics_summary(self):
+        self._train()
+        classifier = self.strategy._get_hammie().bayes
+        stats = classifier.statistics()
+        self.assertFalse(stats['overlay'])
+        for spam in (True, True, False):
+            classifier.learn(['bacon', 'hammie'], spam)
+            classifier.store()
+        classifier.unlearn(['spammie'], True)
+        classifier.store()
+        stats = classifier.statistics()
+        # the statistics are read from the summary, not from the tokens
+        self.env.db_transaction("INSERT INTO spamfilter_bayes "
+                                "(word,nspam,nham) VALUES ('eggs',9,0)")
+        self.assertEqual(stats, classifier.statistics())
+        self.env.db_transaction("DELETE FROM spamfilter_bayes "
+                                "WHERE word='eggs'")
+        with self.env.db_transaction as db:
+            TracDbClassifier._build_summary(db)
+        self.assertEqual(stats, classifier.statistics())
+
+    def test_reset(self):
+        self._train()
+        version = TokenCache.get(self.env, 100).version
+        self.strategy.reset()
+        self.assertEqual([], self.env.db_query(
+            "SELECT * FROM spamfilter_bayes"))
+        self.assertNotEqual([(version,)], self.env.db_query(
+            "SELECT value FROM system WHERE name='spamfilter_bayes_version'"))
+
+
+class TokenCacheTestCase(unittest.TestCase):
+
+    def test_lookup(self):
+        cache = TokenCache(10)
+        cache.update({'spam': (1, 0), 'ham': None})
+        self.assertEqual((True, (1, 0)), cache.lookup('spam'))
+        self.assertEqual((True, None), cache.lookup('ham'))
+        self.assertEqual((False, None), cache.lookup('eggs'))
+
+    def test_evict_least_recently_used(self):
+        cache = TokenCache(4)
+        for word in 'abcd':
+            cache.update({word: (1, 1)})
+        cache.lookup('a')
+        cache.update({'e': (1, 1)})
+        self.assertEqual(3, len(cache))
+        self.assertEqual(True, cache.lookup('a')[0])
+        self.assertEqual(True, cache.lookup('e')[0])
+        self.assertEqual(False, cache.lookup('b')[0])
+
+    def test_validate(self):
+        cache = TokenCache(10)
+        cache.validate('1')
+        cache.update({'spam': (1, 0)})
+        cache.validate('1')
+        self.assertEqual(True, cache.lookup('spam')[0])
+        cache.validate('2')
+        self.assertEqual(False, cache.lookup('spam')[0])
+
 
 try:
     from tracspamfilter.filters import bayes
-    from tracspamfilter.filters.bayes import BayesianFilterStrategy
+    from tracspamfilter.filters.bayes import BayesianFilterStrategy, \
+                                              TokenCache, TracDbClassifier
+    from spambayes.tokenizer import tokenize
+    from tracspamfilter.bayesstore import SQLiteStore
 except ImportError:
     # Skip tests if SpamBayes isn't installed
     class BayesianFilterStrategyTestCase(object): pass
+    class TokenCacheTestCase(object): pass
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(BayesianFilterStrategyTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(TokenCacheTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import unittest
+
+from trac.test import EnvironmentStub, Mock
+from tracspamfilter.filters import ip_regex
+from tracspamfilter.filters.ip_regex import IPRegexFilterStrategy
+from tracspamfilter.filters.tests.regex import DummyWikiPage
+
+
+class IPRegexFilterStrategyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[IPRegexFilterStrategy])
+        self.env.db_transaction("DELETE FROM system WHERE name=%s",
+                                (IPRegexFilterStrategy.version_key,))
+        self.page = ip_regex.WikiPage = DummyWikiPage()
+        self.strategy = IPRegexFilterStrategy(self.env)
+
+    def test_no_patterns(self):
+        retval = self.strategy.test(Mock(), 'anonymous', 'foobar', '127.0.0.1')
+        self.assertEqual(None, retval)
+
+    def test_networks(self):
+        self.page.text = """{{{
+^127\\.0\\.
+10.0.0.0/8
+127.0.0.0/8
+2001:db8::/32
+10.0.0.0/40
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        self.assertEqual([r'^127\.0\.'],
+                         [p.pattern for p in self.strategy.patterns])
+        self.assertEqual(['10.0.0.0/8', '127.0.0.0/8', '2001:db8::/32'],
+                         self.strategy.networks.networks)
+        retval = self.strategy.test(Mock(), 'anonymous', 'foobar', '127.0.0.1')
+        self.assertEqual((-40, 'IP catched by these blacklisted patterns: %s',
+                          "'^127\\.0\\.', '127.0.0.0/8'"), retval)
+        retval = self.strategy.test(Mock(), 'anonymous', 'foobar',
+                                    '2001:db8::1')
+        self.assertEqual(-20, retval[0])
+        retval = self.strategy.test(Mock(), 'anonymous', 'foobar',
+                                    '192.168.0.1')
+        self.assertEqual(None, retval)
+
+    def test_page_order(self):
+        self.page.text = """{{{
+10.0.0.0/8
+^10\\.1\\.
+10.1.0.0/16
+^10\\.
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        retval = self.strategy.test(Mock(), 'anonymous', 'foobar', '10.1.2.3')
+        self.assertEqual("'10.0.0.0/8', '^10\\.1\\.', '10.1.0.0/16', "
+                         "'^10\\.'", retval[2])
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(IPRegexFilterStrategyTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
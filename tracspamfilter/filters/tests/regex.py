@@ -11,12 +11,17 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
+import os
 from StringIO import StringIO
+import tempfile
 import unittest
 
+from trac.db.sqlite_backend import _to_sql
 from trac.test import EnvironmentStub, Mock
 from tracspamfilter.filters import regex
 from tracspamfilter.filters.regex import RegexFilterStrategy
+from tracspamfilter.logwriter import LogWriter
+from tracspamfilter.model import PatternStatistics
 
 
 class DummyWikiPage(object):
@@ -35,9 +40,16 @@ class RegexFilterStrategyTestCase(unittest.TestCase):
 
     def setUp(self):
         self.env = EnvironmentStub(enable=[RegexFilterStrategy])
+        self.env.db_transaction("DELETE FROM system WHERE name=%s",
+                                (RegexFilterStrategy.version_key,))
         self.page = regex.WikiPage = DummyWikiPage()
         self.strategy = RegexFilterStrategy(self.env)
 
+    def tearDown(self):
+        writer = LogWriter._writers.pop(self.env.path, None)
+        if writer is not None:
+            writer.stop()
+
     def test_no_patterns(self):
         retval = self.strategy.test(Mock(), 'anonymous', 'foobar', '127.0.0.1')
         self.assertEqual(None, retval)
@@ -61,6 +73,134 @@ bar$
         self.assertEqual((-15, 'Content contained these blacklisted patterns: \'foobar\', \'bar$\''),
                          retval)
 
+    def test_reload_after_change_in_other_process(self):
+        self.env.config.set('spam-filter', 'regex_reload_interval', '0')
+        self.page.text = """{{{
+foobar
+}}}"""
+        self.strategy.test(Mock(), 'anonymous', 'foobar', '127.0.0.1')
+        self.assertEqual([], self.strategy.patterns)
+        # another process saves the page
+        self.env.db_transaction("INSERT INTO system (name,value) "
+                                "VALUES (%s,'1')",
+                                (RegexFilterStrategy.version_key,))
+        retval = self.strategy.test(Mock(), 'anonymous', 'foobar',
+                                    '127.0.0.1')
+        self.assertEqual(-5, retval[0])
+
+    def test_no_reload_before_interval(self):
+        self.strategy.wiki_page_changed(self.page)
+        matcher = self.strategy.matcher
+        self.env.db_transaction("UPDATE system SET value='1' WHERE name=%s",
+                                (RegexFilterStrategy.version_key,))
+        self.strategy.test(Mock(), 'anonymous', 'foobar', '127.0.0.1')
+        self.assertTrue(matcher is self.strategy.matcher)
+        self.env.config.set('spam-filter', 'regex_reload_interval', '0')
+        self.strategy.test(Mock(), 'anonymous', 'foobar', '127.0.0.1')
+        self.assertFalse(matcher is self.strategy.matcher)
+        matcher = self.strategy.matcher
+        self.strategy.test(Mock(), 'anonymous', 'foobar', '127.0.0.1')
+        self.assertTrue(matcher is self.strategy.matcher)
+
+    def test_reload_changed_file(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, 'spam\n')
+            os.close(fd)
+            self.env.config.set('spam-filter', 'badcontent_file', path)
+            self.env.config.set('spam-filter', 'regex_reload_interval', '0')
+            strategy = self.strategy
+            strategy.test(Mock(), 'anonymous', 'foobar', '127.0.0.1')
+            self.assertEqual(['spam'],
+                             [p.pattern for p in strategy.patterns])
+            self.page.text = """{{{
+foobar
+}}}"""
+            strategy.wiki_page_changed(self.page)
+            self.assertEqual(['foobar', 'spam'],
+                             [p.pattern for p in strategy.patterns])
+            with open(path, 'w') as f:
+                f.write('spam\neggs\n')
+            retval = strategy.test(Mock(), 'anonymous', 'eggs', '127.0.0.1')
+            self.assertEqual(-5, retval[0])
+            self.assertEqual(['foobar', 'spam', 'eggs'],
+                             [p.pattern for p in strategy.patterns])
+        finally:
+            os.remove(path)
+
+    def test_statistics(self):
+        with self.env.db_transaction as db:
+            db("DROP TABLE IF EXISTS spamfilter_patterns")
+            for stmt in _to_sql(PatternStatistics.table):
+                db(stmt)
+        self.page.text = """{{{
+foo
+bar
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        self.strategy.test(Mock(), 'anonymous', 'foo', '127.0.0.1')
+        self.env.config.set('spam-filter', 'regex_profile', 'true')
+        self.env.config.set('spam-filter', 'regex_stats_interval', '0')
+        self.strategy.test(Mock(), 'anonymous', 'foo', '127.0.0.1')
+        LogWriter.get(self.env).flush()
+        stats = PatternStatistics.select(self.env, 'BadContent')
+        self.assertEqual((2, 1), (stats['foo'][0], stats['foo'][2]))
+        self.assertEqual((0, None, 1), stats['bar'][:3])
+        self.assertTrue(stats['foo'][1] > 0)
+
+    def test_statistics_interval(self):
+        with self.env.db_transaction as db:
+            db("DROP TABLE IF EXISTS spamfilter_patterns")
+            for stmt in _to_sql(PatternStatistics.table):
+                db(stmt)
+        self.page.text = """{{{
+foo
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        self.env.config.set('spam-filter', 'regex_stats_interval', '3600')
+        self.strategy.test(Mock(), 'anonymous', 'foo', '127.0.0.1')
+        LogWriter.get(self.env).flush()
+        self.assertEqual({}, PatternStatistics.select(self.env, 'BadContent'))
+        self.strategy.flush_stats()
+        stats = PatternStatistics.select(self.env, 'BadContent')
+        self.assertEqual(1, stats['foo'][0])
+
+    def test_reject_backtracking_pattern(self):
+        self.page.text = r"""{{{
+foo
+(a+)+$
+(\w+\s?)+!
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        self.assertEqual(['foo'],
+                         [p.pattern for p in self.strategy.patterns])
+        self.assertEqual(['(a+)+$', r'(\w+\s?)+!'],
+                         [p.pattern for p, duration in self.strategy.rejected])
+        retval = self.strategy.test(Mock(), 'anonymous', 'a' * 40 + '\n',
+                                    '127.0.0.1')
+        self.assertEqual(None, retval)
+
+    def test_no_time_budget(self):
+        self.env.config.set('spam-filter', 'regex_time_budget', '0')
+        self.page.text = """{{{
+(a+)+$
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        self.assertEqual(['(a+)+$'],
+                         [p.pattern for p in self.strategy.patterns])
+        self.assertEqual([], self.strategy.rejected)
+
+    def test_max_length(self):
+        self.env.config.set('spam-filter', 'regex_max_length', '10')
+        self.page.text = """{{{
+foo
+bar
+}}}"""
+        self.strategy.wiki_page_changed(self.page)
+        retval = self.strategy.test(Mock(), 'anonymous', 'foo' + ' ' * 10 +
+                                    'bar', '127.0.0.1')
+        self.assertEqual("'foo'", retval[2])
+
 
 def suite():
     suite = unittest.TestSuite()
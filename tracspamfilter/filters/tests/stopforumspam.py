@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import gzip
+import os
+import shutil
+from StringIO import StringIO
+import sys
+import tempfile
+import unittest
+from zipfile import ZipFile
+
+from trac.admin import AdminCommandError
+from trac.test import EnvironmentStub, Mock
+from tracspamfilter.filters.stopforumspam import StopForumSpamFilterStrategy
+
+
+class StopForumSpamFilterStrategyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[StopForumSpamFilterStrategy])
+        self.tempdir = tempfile.mkdtemp()
+        self.strategy = StopForumSpamFilterStrategy(self.env)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _refresh(self, *filenames):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.strategy._do_refresh(*filenames)
+        finally:
+            sys.stdout = stdout
+
+    def test_mirror(self):
+        self.assertTrue(self.strategy.is_external())
+        self.env.config.set('spam-filter', 'stopforumspam_mirror',
+                            os.path.join(self.tempdir, 'sfs', 'lists.db'))
+        self.assertFalse(self.strategy.is_external())
+
+        ip = os.path.join(self.tempdir, 'listed_ip_7.zip')
+        archive = ZipFile(ip, 'w')
+        archive.writestr('listed_ip_7.txt', '10.0.0.1\n10.0.0.2\n')
+        archive.close()
+        email = os.path.join(self.tempdir, 'listed_email_7.gz')
+        fileobj = gzip.open(email, 'wb')
+        fileobj.write('"spammer@example.com","3","2012-01-01 12:00:00"\n')
+        fileobj.close()
+        username = os.path.join(self.tempdir, 'listed_username_7.txt')
+        with open(username, 'w') as f:
+            f.write('spammer\n\n')
+        self._refresh(ip, email, username)
+
+        req = Mock()
+        self.assertEqual(None, self.strategy.test(req, 'anonymous', 'foo',
+                                                  '10.0.0.3'))
+        self.assertEqual((-4, 'StopForumSpam says this is spam (%s)', 'ip'),
+                         self.strategy.test(req, 'anonymous', 'foo',
+                                            '10.0.0.1'))
+        self.assertEqual((-12, 'StopForumSpam says this is spam (%s)',
+                          'username,ip,email'),
+                         self.strategy.test(req,
+                                            'Spammer <spammer@example.com>',
+                                            'foo', u'10.0.0.2'))
+
+    def test_refresh_errors(self):
+        self.assertRaises(AdminCommandError, self._refresh, 'listed_ip_7.zip')
+        self.env.config.set('spam-filter', 'stopforumspam_mirror',
+                            os.path.join(self.tempdir, 'lists.db'))
+        self.assertRaises(AdminCommandError, self._refresh)
+        self.assertRaises(AdminCommandError, self._refresh,
+                          os.path.join(self.tempdir, 'listed_ip_7.zip'))
+        self.assertRaises(AdminCommandError, self._refresh,
+                          os.path.join(self.tempdir, 'spammers.zip'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(StopForumSpamFilterStrategyTestCase,
+                                     'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
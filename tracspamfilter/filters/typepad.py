@@ -29,7 +29,7 @@ from trac import __version__ as TRAC_VERSION
 from trac.config import IntOption, Option
 from trac.core import *
 from trac.mimeview.api import is_binary
-from tracspamfilter.api import IFilterStrategy, N_
+from tracspamfilter.api import IFilterStrategy, ServiceError, N_
 
 class TypePadFilterStrategy(Component):
     """Spam filter using the TypePad service (http://antispam.typepad.com/).
@@ -78,6 +78,7 @@ class TypePadFilterStrategy(Component):
 
         except urllib2.URLError, e:
             self.log.warn('TypePad request failed (%s)', e)
+            raise ServiceError(e)
 
     def train(self, req, author, content, ip, spam=True):
         if not self._check_preconditions(req, author, content):
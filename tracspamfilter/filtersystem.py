@@ -18,8 +18,10 @@
 
 from difflib import SequenceMatcher
 import inspect
+from Queue import Empty, Queue
 from StringIO import StringIO
 import textwrap
+from threading import Lock, Thread
 import time
 
 from pkg_resources import resource_filename
@@ -33,10 +35,14 @@ from trac.util.html import escape, html
 from trac.util.text import shorten_line, to_unicode
 from trac.web import Request
 from tracspamfilter.api import (
-    IFilterStrategy, IRejectHandler, RejectContent, 
+    IFilterStrategy, IRejectHandler, RejectContent, ServiceError,
     add_domain, _, N_, gettext, tag_
 )
+from tracspamfilter.circuitbreaker import CircuitBreaker
+from tracspamfilter.logwriter import LogWriter
 from tracspamfilter.model import LogEntry, schema, schema_version
+from tracspamfilter.versionstamp import get_system_value, set_system_value
+from tracspamfilter.workerpool import WorkerPool
 from tracspamfilter.filters.trapfield import TrapFieldFilterStrategy
 from genshi.builder import tag
 
@@ -68,6 +74,33 @@ class FilterSystem(Component):
         """The number of days after which log entries should be purged.""",
         doc_domain='tracspamfilter')
 
+    purge_interval = IntOption('spam-filter', 'purge_interval', '3600',
+        """The number of seconds between two purges of old log entries.""",
+        doc_domain='tracspamfilter')
+
+    purge_chunk_size = IntOption('spam-filter', 'purge_chunk_size', '1000',
+        """The maximum number of old log entries deleted in a single
+        transaction. 0 means no limit.""", doc_domain='tracspamfilter')
+
+    log_async = BoolOption('spam-filter', 'log_async', 'false',
+        """Whether log entries should be written to the database by a
+        background thread, so that submissions don't wait for it.""",
+        doc_domain='tracspamfilter')
+
+    log_batch_size = IntOption('spam-filter', 'log_batch_size', '50',
+        """The maximum number of log entries written by the background
+        thread in a single transaction.""", doc_domain='tracspamfilter')
+
+    log_flush_interval = IntOption('spam-filter', 'log_flush_interval', '1',
+        """The maximum number of seconds the background thread waits for
+        further log entries before writing them.""",
+        doc_domain='tracspamfilter')
+
+    log_queue_size = IntOption('spam-filter', 'log_queue_size', '1000',
+        """The maximum number of log entries waiting to be written by the
+        background thread. Further entries are dropped.""",
+        doc_domain='tracspamfilter')
+
     use_external = BoolOption('spam-filter', 'use_external', 'true',
         """Allow usage of external services.""", doc_domain='tracspamfilter')
 
@@ -91,11 +124,62 @@ class FilterSystem(Component):
         """Interpret X-Forwarded-For header for IP checks.""",
         doc_domain='tracspamfilter')
 
+    parallel_external = BoolOption('spam-filter', 'parallel_external', 'false',
+        """Whether external services should be queried concurrently instead
+        of one after another.""", doc_domain='tracspamfilter')
+
+    max_workers = IntOption('spam-filter', 'max_workers', '4',
+        """The maximum number of worker threads of each process used to
+        query external services concurrently, or to abandon them after
+        `max_test_time`.""", doc_domain='tracspamfilter')
+
+    worker_queue_size = IntOption('spam-filter', 'worker_queue_size', '20',
+        """The maximum number of queries of external services waiting for a
+        worker thread in each process. Further queries are skipped, so that
+        a hanging service doesn't make them pile up.""",
+        doc_domain='tracspamfilter')
+
+    max_test_time = IntOption('spam-filter', 'max_test_time', '0',
+        """The maximum number of seconds to wait for the filter strategies
+        to test a submission. Strategies which have not answered by then are
+        ignored and logged as timed out. 0 means no limit.""",
+        doc_domain='tracspamfilter')
+
+    skip_decided = BoolOption('spam-filter', 'skip_decided', 'false',
+        """Whether external services should be skipped when the karma given
+        by the local strategies already decides whether a submission is
+        accepted, so that no further karma could change the verdict.""",
+        doc_domain='tracspamfilter')
+
+    circuit_breaker = BoolOption('spam-filter', 'circuit_breaker', 'false',
+        """Whether external services which are failing or too slow should
+        temporarily not be queried anymore.""", doc_domain='tracspamfilter')
+
+    breaker_window = IntOption('spam-filter', 'breaker_window', '10',
+        """The number of recent queries of an external service which are
+        used to compute its error rate.""", doc_domain='tracspamfilter')
+
+    breaker_error_rate = IntOption('spam-filter', 'breaker_error_rate', '50',
+        """The percentage of failed recent queries at which an external
+        service is not queried anymore.""", doc_domain='tracspamfilter')
+
+    breaker_max_latency = IntOption('spam-filter', 'breaker_max_latency', '5',
+        """The number of seconds after which a query of an external service
+        counts as failed, even if it succeeded. 0 means no limit.""",
+        doc_domain='tracspamfilter')
+
+    breaker_retry_time = IntOption('spam-filter', 'breaker_retry_time', '300',
+        """The number of seconds to wait before a failing external service is
+        queried again.""", doc_domain='tracspamfilter')
+
 
     def __init__(self):
         """Set up translation domain"""
         locale_dir = resource_filename(__name__, 'locale')
         add_domain(self.env.path, locale_dir)
+        self._next_purge = 0
+        self._purge_lock = Lock()
+        self._purge_thread = None
 
     # IRejectHandler methods
 
@@ -157,35 +241,31 @@ class FilterSystem(Component):
         abbrev = shorten_line(content)
         self.log.debug('Testing content %r submitted by "%s"', abbrev, author)
 
-        for strategy in self.strategies:
-            try:
-                if self.use_external or not strategy.is_external():
-                    tim = time.time()
-                    retval = strategy.test(req, author, content, ip)
-                    tim = time.time()-tim
-                    if tim > 3:
-                        self.log.warn('Test %s took %d seconds to complete.' % (strategy, tim))
-                    if retval:
-                        points = retval[0]
-                        if len(retval) > 2:
-                            reason = retval[1] % retval[2:]
-                        else:
-                            reason = retval[1]
-                        if points < 0:
-                            if len(retval) > 2:
-                                outreasons.append(gettext(retval[1]) % retval[2:])
-                            else:
-                                outreasons.append(gettext(retval[1]))
-                                                                                                                
-                        self.log.debug('Filter strategy %r gave submission %d '
-                                       'karma points (reason: %r)', strategy,
-                                       points, reason)
-                        score += points
-                        if reason:
-                            reasons.append((strategy.__class__.__name__[:-14], points,
-                                            reason))
-            except Exception, e:
-                self.log.exception('Filter strategy raised exception: %s', e)
+        answered, skipped = self._test_strategies(req, author, content, ip,
+                                                  score)
+        for strategy, reason in skipped:
+            reasons.append((strategy.__class__.__name__[:-14], 0, reason))
+
+        for strategy, retval in answered:
+            if retval:
+                points = retval[0]
+                if len(retval) > 2:
+                    reason = retval[1] % retval[2:]
+                else:
+                    reason = retval[1]
+                if points < 0:
+                    if len(retval) > 2:
+                        outreasons.append(gettext(retval[1]) % retval[2:])
+                    else:
+                        outreasons.append(gettext(retval[1]))
+
+                self.log.debug('Filter strategy %r gave submission %d '
+                               'karma points (reason: %r)', strategy,
+                               points, reason)
+                score += points
+                if reason:
+                    reasons.append((strategy.__class__.__name__[:-14], points,
+                                    reason))
 
         reasons = sorted(reasons, key=lambda r: r[0])
 
@@ -193,11 +273,16 @@ class FilterSystem(Component):
             headers = '\n'.join(['%s: %s' % (k[5:].replace('_', '-').title(), v)
                                  for k, v in req.environ.items()
                                  if k.startswith('HTTP_')])
-            LogEntry(self.env, time.time(), req.path_info, author,
-                     req.authname and req.authname != 'anonymous',
-                     ip, headers, content, score < self.min_karma,
-                     score, ['%s (%d): %s' % r for r in reasons]).insert()
-            LogEntry.purge(self.env, self.purge_age)
+            entry = LogEntry(self.env, time.time(), req.path_info, author,
+                             req.authname and req.authname != 'anonymous',
+                             ip, headers, content, score < self.min_karma,
+                             score, ['%s (%d): %s' % r for r in reasons])
+            if self.log_async:
+                LogWriter.get(self.env, self.log_queue_size).put(entry,
+                    self.log_batch_size, self.log_flush_interval)
+            else:
+                entry.insert()
+            self._schedule_purge()
 
         if score < self.min_karma:
             self.log.debug('Rejecting submission %r by "%s" (%r) because it '
@@ -217,6 +302,14 @@ class FilterSystem(Component):
                          message=msg),
                     class_='message'))
 
+    def get_purge_status(self):
+        """Return the time of the last purge of old log entries and the number
+        of entries it removed. Both are `None` if they are not known yet."""
+        last = get_system_value(self.env.db_query, 'spamfilter_lastpurge')
+        count = get_system_value(self.env.db_query,
+                                 'spamfilter_purgecount')
+        return last and int(last), count and int(count)
+
     def train(self, req, log_id, spam=True):
         environ = {}
         for name, value in req.environ.items():
@@ -303,6 +396,252 @@ class FilterSystem(Component):
 
     # Internal methods
 
+    def _schedule_purge(self):
+        """Start purging old log entries in a background thread, if the last
+        purge of any process is more than `purge_interval` seconds ago."""
+        tim = int(time.time())
+        with self._purge_lock:
+            if tim < self._next_purge:
+                return
+            self._next_purge = tim + self.purge_interval
+
+        last = get_system_value(self.env.db_query, 'spamfilter_lastpurge')
+        if last is not None and int(last) + self.purge_interval > tim:
+            self._next_purge = int(last) + self.purge_interval
+            return
+        try:
+            with self.env.db_transaction as db:
+                cursor = db.cursor()
+                if last is None:
+                    cursor.execute("INSERT INTO system VALUES "
+                                   "('spamfilter_lastpurge',%s)", (tim,))
+                else:
+                    # another process may have started to purge meanwhile
+                    cursor.execute("UPDATE system SET value=%s WHERE "
+                                   "name='spamfilter_lastpurge' AND value=%s",
+                                   (tim, last))
+                    if cursor.rowcount != 1:
+                        return
+        except Exception, e:
+            self.log.debug('Not purging old log entries: %s', e)
+            return
+
+        self._purge_thread = Thread(target=self._purge_log,
+                                    name='SpamFilterPurge')
+        self._purge_thread.setDaemon(True)
+        self._purge_thread.start()
+
+    def _purge_log(self):
+        """Delete the log entries older than `purge_age` days in chunks of
+        `purge_chunk_size` entries and record their number."""
+        count = 0
+        try:
+            while True:
+                with self.env.db_transaction as db:
+                    deleted = LogEntry.purge(self.env, self.purge_age, db,
+                                             self.purge_chunk_size)
+                count += deleted
+                if not self.purge_chunk_size or \
+                        deleted < self.purge_chunk_size:
+                    break
+        except Exception, e:
+            self.log.error('Purging old log entries failed: %s', e,
+                           exc_info=True)
+        self.log.info('Purged %d old log entries', count)
+        with self.env.db_transaction as db:
+            set_system_value(db, 'spamfilter_purgecount', count)
+
+    def _test_strategies(self, req, author, content, ip, score):
+        """Test the submission with all active strategies.
+
+        Return a list of `(strategy, retval)` tuples in the order of the
+        strategies, and a list of `(strategy, reason)` tuples for the
+        strategies which did not give an answer.
+
+        External strategies are run by the worker threads of the process,
+        each in a separate task if `parallel_external` is enabled, or all in
+        a single task if a deadline is configured, so that they can be
+        abandoned when they don't answer within `max_test_time`. If the
+        workers are busy and `worker_queue_size` tasks are pending already,
+        the strategies are skipped. The tasks get a copy of the request data
+        used by the external services instead of the request, which they may
+        outlive. The local strategies are tested inline.
+
+        If `skip_decided` is enabled, the cheap local strategies are tested
+        first. The external ones are only queried when the karma they can
+        assign could still change whether the submission with the given
+        initial `score` is accepted.
+
+        If `circuit_breaker` is enabled, external services which failed
+        recently are not queried. The trial call of a half-open breaker is
+        released when the strategy is skipped after all.
+        """
+        strategies = [strategy for strategy in self.strategies
+                      if self.use_external or not strategy.is_external()]
+        results = [None] * len(strategies)
+        done = [False] * len(strategies)
+        lock = Lock()
+
+        deadline = None
+        if self.max_test_time > 0:
+            deadline = time.time() + self.max_test_time
+
+        def expired():
+            return deadline and time.time() >= deadline
+
+        # breakers which allowed a call to a strategy
+        breakers = {}
+
+        def release(i):
+            if i in breakers:
+                breakers[i].release()
+
+        def test_inline(indices):
+            for i in indices:
+                if not expired():
+                    results[i] = self._test_strategy(strategies[i], req,
+                                                     author, content, ip)
+                    done[i] = True
+                else:
+                    release(i)
+
+        local = [i for i, strategy in enumerate(strategies)
+                 if not strategy.is_external()]
+        external = [i for i, strategy in enumerate(strategies)
+                    if strategy.is_external()]
+
+        skipped = {}
+        if self.skip_decided and external:
+            test_inline(local)
+            local = []
+            for retval in results:
+                if retval:
+                    score += retval[0]
+            max_karma = self._get_max_karma([strategies[i]
+                                             for i in external])
+            if max_karma is not None and \
+                    (score - max_karma >= self.min_karma or
+                     score + max_karma < self.min_karma):
+                for i in external:
+                    skipped[i] = N_('Skipped, verdict already decided')
+                external = []
+
+        if self.circuit_breaker:
+            for i in external[:]:
+                breaker = CircuitBreaker.get(self.env,
+                                             strategies[i].__class__.__name__)
+                if not breaker.allow(self.breaker_retry_time):
+                    self.log.debug('Circuit breaker for %r is open, skipping',
+                                   strategies[i])
+                    skipped[i] = N_('Skipped, service is failing')
+                    external.remove(i)
+                else:
+                    breakers[i] = breaker
+
+        if not self.parallel_external and not deadline:
+            local = sorted(local + external)
+            external = []
+        finished = Queue()
+
+        task_req = None
+        if external:
+            task_req = _RequestData(req)
+
+        def task(indices):
+            def run():
+                for i in indices:
+                    if not expired():
+                        retval = self._test_strategy(strategies[i], task_req,
+                                                     author, content, ip)
+                        with lock:
+                            results[i] = retval
+                            done[i] = True
+                    else:
+                        release(i)
+                finished.put(None)
+            return run
+
+        tasks = [[i] for i in external]
+        if external and not self.parallel_external:
+            tasks = [external]
+        submitted = 0
+        if tasks:
+            pool = WorkerPool.get(self.max_workers, self.worker_queue_size)
+            for indices in tasks:
+                if pool.submit(task(indices)):
+                    submitted += 1
+                else:
+                    for i in indices:
+                        skipped[i] = N_('Skipped, too many pending queries')
+                        release(i)
+
+        test_inline(local)
+        for n in range(submitted):
+            try:
+                if deadline:
+                    finished.get(True, max(deadline - time.time(), 0))
+                else:
+                    finished.get()
+            except Empty:
+                break
+
+        with lock:
+            answered = [(strategies[i], results[i])
+                        for i in range(len(strategies)) if done[i]]
+            for i in range(len(strategies)):
+                if not done[i] and i not in skipped:
+                    self.log.warn('Filter strategy %r did not answer within '
+                                  '%d seconds', strategies[i],
+                                  self.max_test_time)
+                    skipped[i] = N_('Timed out after %d seconds') \
+                                 % self.max_test_time
+        return answered, [(strategies[i], skipped[i])
+                          for i in sorted(skipped)]
+
+    def _get_max_karma(self, strategies):
+        """Return the maximum number of karma points the given strategies can
+        assign to a submission in total, or `None` if that is not known."""
+        total = 0
+        for strategy in strategies:
+            if hasattr(strategy, 'get_max_karma'):
+                points = strategy.get_max_karma()
+            elif hasattr(strategy, 'karma_points'):
+                points = strategy.karma_points
+            else:
+                points = None
+            if points is None:
+                return None
+            total += abs(points)
+        return total
+
+    def _test_strategy(self, strategy, req, author, content, ip):
+        success = False
+        tim = time.time()
+        try:
+            retval = strategy.test(req, author, content, ip)
+            success = True
+            return retval
+        except ServiceError, e:
+            # logged by the strategy, only recorded as failed call
+            pass
+        except Exception, e:
+            self.log.exception('Filter strategy raised exception: %s', e)
+        finally:
+            tim = time.time()-tim
+            if tim > 3:
+                self.log.warn('Test %s took %d seconds to complete.' % (strategy, tim))
+            if self.circuit_breaker and strategy.is_external():
+                self._record_call(strategy, success, tim)
+
+    def _record_call(self, strategy, success, latency):
+        breaker = CircuitBreaker.get(self.env, strategy.__class__.__name__)
+        state = breaker.state
+        breaker.record(success, latency, self.breaker_window,
+                       self.breaker_error_rate, self.breaker_max_latency)
+        if breaker.state != state:
+            self.log.warn('Circuit breaker for %r changed from %s to %s',
+                          strategy, state, breaker.state)
+
     def _combine_changes(self, changes, sep='\n\n'):
         fields = []
         for old_content, new_content in changes:
@@ -325,6 +664,35 @@ class FilterSystem(Component):
 
         return '\n'.join(buf)
 
+class _RequestData(object):
+    """The data of a request which the external strategies use, copied for
+    the worker threads."""
+
+    def __init__(self, req):
+        self.environ = dict([(name, value)
+                             for name, value in req.environ.items()
+                             if isinstance(value, basestring)])
+        self.base_url = req.base_url
+        self.path_info = req.path_info
+        self.authname = req.authname
+        self.remote_addr = req.remote_addr
+        self._inheaders = [(name[5:].replace('_', '-').lower(), value)
+                           for name, value in self.environ.items()
+                           if name.startswith('HTTP_')]
+        for name in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            if name in self.environ:
+                self._inheaders.append((name.replace('_', '-').lower(),
+                                        self.environ[name]))
+
+    def get_header(self, name):
+        """Return the value of the specified HTTP header, or `None` if
+        there's no such header in the request."""
+        name = name.lower()
+        for key, value in self._inheaders:
+            if key == name:
+                return value
+        return None
+
 # fixup Option doc_domain (TODO: add a helper function in trac.util.translation)
 for val in FilterSystem.__dict__.itervalues():
     if isinstance(val, Option):
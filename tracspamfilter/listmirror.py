@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from bisect import bisect_left
+from hashlib import md5
+import mmap
+import os
+import struct
+from threading import Lock
+
+from trac.util import AtomicFile
+
+__all__ = ['ListMirror']
+
+
+class ListMirror(object):
+    """Local copy of lists of listed IP addresses, e-mail addresses and
+    usernames, for lookups without network access.
+
+    The file holds the sorted, distinct keys of the entries, which are the
+    first 8 bytes of the MD5 digest of the kind and the value of each entry.
+    It is memory-mapped, so that all processes share the pages read by the
+    operating system, and a lookup is a binary search touching a few pages.
+
+    Files are replaced atomically by `write()`. Before each lookup, the
+    file is mapped again if it was replaced since, possibly by another
+    process.
+    """
+
+    magic = 'TSFLIST1'
+    # magic, number of keys
+    _header = struct.Struct('>8sQ')
+    key_size = 8
+
+    _mirrors = {}
+    _mirrors_lock = Lock()
+
+    def __init__(self, path, log=None):
+        self.path = path
+        self.log = log
+        self._lock = Lock()
+        self._stat = None
+        self._keys = _Keys(None, 0)
+
+    def get(cls, path, log=None):
+        """Return the mirror for the file at `path`."""
+        path = os.path.normcase(os.path.abspath(path))
+        with cls._mirrors_lock:
+            if path not in cls._mirrors:
+                cls._mirrors[path] = cls(path, log)
+            mirror = cls._mirrors[path]
+            if log is not None:
+                mirror.log = log
+            return mirror
+
+    get = classmethod(get)
+
+    def key(cls, kind, value):
+        """Return the key of an entry, ignoring case and surrounding
+        whitespace of the value."""
+        if not isinstance(value, unicode):
+            value = value.decode('utf-8', 'replace')
+        value = value.strip().lower().encode('utf-8')
+        return md5('%s:%s' % (kind, value)).digest()[:cls.key_size]
+
+    key = classmethod(key)
+
+    def write(cls, path, entries):
+        """Replace the file at `path` by the `(kind, value)` entries, and
+        return the number of distinct entries.
+
+        `entries` may be an iterator. Only the keys of the entries are held
+        in memory, and duplicates are dropped after sorting them.
+        """
+        keys = [cls.key(kind, value) for kind, value in entries]
+        keys.sort()
+        count = 0
+        for key in keys:
+            if not count or key != keys[count - 1]:
+                keys[count] = key
+                count += 1
+        del keys[count:]
+        exists = os.path.exists(path)
+        fileobj = AtomicFile(path, 'wb')
+        try:
+            fileobj.write(cls._header.pack(cls.magic, len(keys)))
+            for idx in xrange(0, len(keys), 4096):
+                fileobj.write(''.join(keys[idx:idx + 4096]))
+        except:
+            fileobj.rollback()
+            raise
+        fileobj.commit()
+        if not exists:
+            # the temporary file is only readable by its owner
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(path, 0666 & ~umask)
+        return len(keys)
+
+    write = classmethod(write)
+
+    def contains(self, kind, value):
+        """Return whether the mirror lists the entry."""
+        keys = self._get_keys()
+        key = self.key(kind, value)
+        idx = bisect_left(keys, key)
+        return idx < len(keys) and keys[idx] == key
+
+    def __len__(self):
+        return len(self._get_keys())
+
+    # Internal methods
+
+    def _get_keys(self):
+        try:
+            st = os.stat(self.path)
+            stat = st.st_ino, st.st_mtime, st.st_size
+        except OSError:
+            stat = None
+        with self._lock:
+            if stat != self._stat:
+                self._keys = self._map(stat)
+                self._stat = stat
+            return self._keys
+
+    def _map(self, stat):
+        if stat is None:
+            if self.log:
+                self.log.warning('List mirror %s does not exist', self.path)
+            return _Keys(None, 0)
+        if stat[2] < self._header.size:
+            if self.log:
+                self.log.error('List mirror %s is damaged', self.path)
+            return _Keys(None, 0)
+        fileobj = open(self.path, 'rb')
+        try:
+            data = mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fileobj.close()
+        magic, count = self._header.unpack_from(data)
+        if magic != self.magic or \
+                len(data) != self._header.size + count * self.key_size:
+            data.close()
+            if self.log:
+                self.log.error('List mirror %s is damaged', self.path)
+            return _Keys(None, 0)
+        if self.log:
+            self.log.info('Mapped list mirror %s with %d entries', self.path,
+                          count)
+        return _Keys(data, count)
+
+
+class _Keys(object):
+    """Sequence of the keys in a mapped mirror file, for `bisect`. The
+    mapping is closed when it is no longer referenced."""
+
+    def __init__(self, data, count):
+        self.data = data
+        self.count = count
+
+    def __getitem__(self, idx):
+        start = ListMirror._header.size + idx * ListMirror.key_size
+        return self.data[start:start + ListMirror.key_size]
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import atexit
+from Queue import Empty, Full, Queue
+from threading import Lock, Thread
+import time
+
+__all__ = ['LogWriter']
+
+
+class LogWriter(object):
+    """Insert log entries into the database from a background thread.
+
+    An entry is any object with an `insert(db)` method, like a `LogEntry` or
+    the `PatternStatistics` collected by a process. The entries are handed
+    over through a bounded queue. The writer thread
+    collects up to `batch_size` entries, or as many as arrive within
+    `interval` seconds, and inserts them in a single transaction. Pending
+    entries are written when the process exits.
+
+    There is one writer per environment and process.
+    """
+
+    _writers = {}
+    _writers_lock = Lock()
+
+    def __init__(self, env, queue_size):
+        self.env = env
+        self.log = env.log
+        self.queue = Queue(max(queue_size, 1))
+        self.batch_size = 1
+        self.interval = 0
+        self.thread = None
+        self._lock = Lock()
+
+    def get(cls, env, queue_size=1000):
+        """Return the writer for the environment."""
+        with cls._writers_lock:
+            if env.path not in cls._writers:
+                writer = cls(env, queue_size)
+                atexit.register(writer.stop)
+                cls._writers[env.path] = writer
+            writer = cls._writers[env.path]
+            # the environment is created again after configuration changes
+            writer.env = env
+            writer.log = env.log
+            return writer
+
+    get = classmethod(get)
+
+    def put(self, entry, batch_size=None, interval=None):
+        """Queue a log entry for insertion without waiting for it.
+
+        `batch_size` and `interval` change the settings of the writer, which
+        are kept if they are `None`. If the queue is full, the entry is
+        dropped.
+        """
+        if batch_size is not None:
+            self.batch_size = max(batch_size, 1)
+        if interval is not None:
+            self.interval = interval
+        with self._lock:
+            if self.thread is None:
+                self.thread = Thread(target=self._run,
+                                     name='SpamFilterLogWriter')
+                self.thread.setDaemon(True)
+                self.thread.start()
+        try:
+            self.queue.put_nowait(entry)
+        except Full:
+            self.log.warn('Spam filter log queue is full, dropping %r', entry)
+
+    def flush(self):
+        """Wait until all queued entries have been written."""
+        if self.thread is not None:
+            self.queue.join()
+
+    def stop(self, timeout=10):
+        """Write the queued entries and stop the writer thread."""
+        with self._lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None and thread.isAlive():
+            self.queue.put(None)
+            thread.join(timeout)
+
+    # Internal methods
+
+    def _run(self):
+        stop = False
+        while not stop:
+            entries = []
+            entry = self.queue.get()
+            deadline = time.time() + self.interval
+            while entry is not None:
+                entries.append(entry)
+                if len(entries) >= self.batch_size:
+                    break
+                try:
+                    entry = self.queue.get(True,
+                                           max(deadline - time.time(), 0))
+                except Empty:
+                    break
+            else:
+                stop = True
+            try:
+                self._write(entries)
+            finally:
+                for i in range(len(entries) + int(stop)):
+                    self.queue.task_done()
+
+    def _write(self, entries):
+        if not entries:
+            return
+        try:
+            with self.env.db_transaction as db:
+                for entry in entries:
+                    entry.insert(db)
+            self.log.debug('Wrote %d spam filter log entries', len(entries))
+        except Exception, e:
+            self.log.error('Failed to write %d spam filter log entries: %s',
+                           len(entries), e, exc_info=True)
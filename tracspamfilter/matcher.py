@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from binascii import hexlify
+import re
+import socket
+import sre_parse
+from sre_constants import ANY, ASSERT, ASSERT_NOT, AT, AT_BEGINNING, \
+                          AT_BEGINNING_STRING, AT_END, AT_END_STRING, BRANCH, \
+                          CATEGORY, CATEGORY_DIGIT, CATEGORY_NOT_DIGIT, \
+                          CATEGORY_NOT_SPACE, CATEGORY_NOT_WORD, \
+                          CATEGORY_SPACE, CATEGORY_WORD, GROUPREF_EXISTS, IN, \
+                          LITERAL, MAX_REPEAT, MIN_REPEAT, NOT_LITERAL, RANGE, \
+                          SUBPATTERN
+import struct
+import time
+
+__all__ = ['NetworkMatcher', 'PatternMatcher', 'has_nested_repeat',
+           'worst_search_time']
+
+
+class PatternMatcher(object):
+    """Find all patterns of a list which match a text with a few searches.
+
+    Patterns which are plain strings, like most spam domains and words, are
+    kept in a trie. It is compiled into a single regular expression of
+    nested alternations, which finds the positions where any of the strings
+    starts in one pass. The strings starting there are then found by
+    walking the trie. Strings anchored to the start or end of the text are
+    compared directly.
+
+    Of the other patterns, those starting with a literal character,
+    possibly after anchors like `^` or `\\b`, are grouped by that character
+    and joined into plain alternations. The regular expression compiler
+    merges the common prefix of an alternation, so it is scanned for like
+    the prefix of a single pattern, and skips the alternatives quickly which
+    can't match. Each alternation holds at most `chunk_size` patterns with
+    together at most `max_groups` groups, as Python doesn't support more in
+    one regular expression. A text which matches no pattern is scanned once
+    per alternation.
+
+    Where an alternation matches, the patterns matching at that position
+    are found by matching them there, and the search goes on after that
+    position. When patterns found before keep matching, the alternation is
+    compiled again without them.
+
+    The remaining patterns are searched one by one, as an alternation would
+    be slower for them. So are patterns using backreferences, named groups,
+    conditionals or flags, which can't be joined.
+    """
+
+    chunk_size = 500
+    max_groups = 99
+    max_stale = 10
+
+    _separate_re = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|\(\?[iLmsux]+\)')
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.single = []
+        self.chunks = []
+        self.anchored = []
+        self.trie = {}
+        self.literal_re = None
+        groups = {}
+        for idx, pattern in enumerate(self.patterns):
+            literal = self._literal(pattern)
+            if literal is not None:
+                start, string, end = literal
+                if start or end:
+                    self.anchored.append((idx, start, string, end))
+                else:
+                    node = self.trie
+                    for char in string:
+                        node = node.setdefault(char, {})
+                    node.setdefault(None, []).append(idx)
+                continue
+            key = self._leading_literal(pattern)
+            if key is None:
+                self.single.append(idx)
+            else:
+                groups.setdefault(key, []).append(idx)
+        for indexes in sorted(groups.values()):
+            chunk = []
+            count = 0
+            for idx in indexes:
+                pattern = self.patterns[idx]
+                if len(chunk) >= self.chunk_size or \
+                        count + pattern.groups > self.max_groups:
+                    self._add_chunk(chunk)
+                    chunk = []
+                    count = 0
+                chunk.append(idx)
+                count += pattern.groups
+            self._add_chunk(chunk)
+        if self.trie:
+            try:
+                self.literal_re = re.compile(self._trie_source(self.trie))
+            except (re.error, OverflowError, RuntimeError):
+                # fall back to searching the strings separately
+                self.single.extend(self._trie_indexes(self.trie))
+                self.single.sort()
+                self.trie = {}
+
+    def search(self, text):
+        """Return the patterns matching the text, in their original order."""
+        found = set()
+        if self.literal_re is not None:
+            self._search_literals(text, found)
+        for idx, start, string, end in self.anchored:
+            if start and end:
+                matched = text == string or \
+                          end == AT_END and text == string + '\n'
+            elif start:
+                matched = text.startswith(string)
+            else:
+                matched = text.endswith(string) or \
+                          end == AT_END and text.endswith(string + '\n')
+            if matched:
+                found.add(idx)
+        for idx in self.single:
+            if self.patterns[idx].search(text):
+                found.add(idx)
+        for indexes, regex in self.chunks:
+            pos = 0
+            stale = 0
+            remaining = len(indexes)
+            while remaining:
+                match = regex.search(text, pos)
+                if match is None:
+                    break
+                pos = match.start()
+                matched = [idx for idx in indexes
+                           if idx not in found and
+                              self.patterns[idx].match(text, pos)]
+                if matched:
+                    found.update(matched)
+                    remaining -= len(matched)
+                else:
+                    stale += 1
+                    if stale >= self.max_stale:
+                        # compiling is expensive, so patterns found already
+                        # are only dropped when they match again and again
+                        indexes = [idx for idx in indexes if idx not in found]
+                        regex = self._compile(indexes)
+                        stale = 0
+                pos += 1
+        return [self.patterns[idx] for idx in sorted(found)]
+
+    def __len__(self):
+        return len(self.patterns)
+
+    # Internal methods
+
+    def _search_literals(self, text, found):
+        regex = self.literal_re
+        pos = 0
+        stale = 0
+        while regex is not None:
+            match = regex.search(text, pos)
+            if match is None:
+                break
+            pos = match.start()
+            matched = False
+            node = self.trie
+            for i in xrange(pos, len(text)):
+                node = node.get(text[i])
+                if node is None:
+                    break
+                for idx in node.get(None, ()):
+                    if idx not in found:
+                        found.add(idx)
+                        matched = True
+            if not matched:
+                stale += 1
+                if stale >= self.max_stale:
+                    # drop the strings found already, like for alternations
+                    source = self._trie_source(self.trie, found)
+                    regex = source and re.compile(source) or None
+                    stale = 0
+            pos += 1
+
+    def _trie_source(self, node, found=()):
+        """Return a regular expression matching where any of the strings in
+        the trie starts, except for those in `found`."""
+        alternatives = []
+        for char in sorted([char for char in node if char is not None]):
+            child = node[char]
+            if [idx for idx in child.get(None, ()) if idx not in found]:
+                # a longer string doesn't need to be matched
+                alternatives.append(re.escape(char))
+                continue
+            source = self._trie_source(child, found)
+            if source:
+                alternatives.append(re.escape(char) + source)
+        if len(alternatives) > 1:
+            return '(?:%s)' % '|'.join(alternatives)
+        return ''.join(alternatives)
+
+    def _trie_indexes(self, node):
+        indexes = list(node.get(None, ()))
+        for char, child in node.iteritems():
+            if char is not None:
+                indexes.extend(self._trie_indexes(child))
+        return indexes
+
+    def _literal(self, pattern):
+        """Return a `(start, string, end)` tuple with the anchors if the
+        pattern matches a plain string, or `None`."""
+        if pattern.flags:
+            return None
+        data = list(sre_parse.parse(pattern.pattern).data)
+        start = end = None
+        if data and data[0] in ((AT, AT_BEGINNING),
+                                (AT, AT_BEGINNING_STRING)):
+            start = data.pop(0)[1]
+        if data and data[-1] in ((AT, AT_END), (AT, AT_END_STRING)):
+            end = data.pop()[1]
+        chars = []
+        for op, av in data:
+            if op is not LITERAL:
+                return None
+            chars.append(unichr(av))
+        if not chars:
+            return None
+        return start, u''.join(chars), end
+
+    def _leading_literal(self, pattern):
+        """Return the anchors and the literal character the pattern starts
+        with, or `None` if it should be searched on its own."""
+        if pattern.flags or self._separate_re.search(pattern.pattern) or \
+                pattern.groups > self.max_groups:
+            return None
+        anchors = []
+        for op, av in sre_parse.parse(pattern.pattern).data:
+            if op is AT:
+                anchors.append(av)
+            elif op is LITERAL:
+                return tuple(anchors), av
+            else:
+                break
+        return None
+
+    def _add_chunk(self, indexes):
+        if not indexes:
+            return
+        try:
+            self.chunks.append((indexes, self._compile(indexes)))
+        except (re.error, OverflowError, RuntimeError):
+            # search the patterns separately if they don't work together
+            self.single.extend(indexes)
+            self.single.sort()
+
+    def _compile(self, indexes):
+        if not indexes:
+            return None
+        return re.compile('|'.join([self.patterns[idx].pattern
+                                    for idx in indexes]))
+
+
+class NetworkMatcher(object):
+    """Find all networks of a list which contain an IP address.
+
+    The networks are given in CIDR notation, like `192.168.0.0/16` or
+    `2001:db8::/32`, or as single addresses. For each prefix length in use,
+    the prefixes of the networks are kept in a dictionary, so that a lookup
+    takes at most one step per bit of the address, however many networks
+    there are. IPv4 addresses mapped to IPv6, like `::ffff:192.168.0.1`,
+    are treated as IPv4 addresses.
+    """
+
+    def __init__(self, networks=()):
+        self.networks = []
+        self._prefixes = {}
+        for network in networks:
+            self.add(network)
+
+    def add(self, network):
+        """Add a network, or raise a `ValueError` if it is invalid."""
+        if '/' in network:
+            address, length = network.split('/', 1)
+            if not length.isdigit():
+                raise ValueError('Invalid prefix length: %s' % network)
+            length = int(length)
+        else:
+            address, length = network, None
+        bits, value = _parse_address(address)
+        if length is None:
+            length = bits
+        elif length > bits:
+            raise ValueError('Invalid prefix length: %s' % network)
+        if bits == 128 and value >> 32 == 0xffff and length >= 96:
+            bits, value, length = 32, value & 0xffffffff, length - 96
+        prefixes = self._prefixes.setdefault((bits, length), {})
+        prefixes.setdefault(value >> (bits - length), []) \
+                .append(len(self.networks))
+        self.networks.append(network)
+
+    def search(self, address):
+        """Return the networks containing the address, in the order they
+        were added."""
+        try:
+            bits, value = _parse_address(address)
+        except ValueError:
+            return []
+        if bits == 128 and value >> 32 == 0xffff:
+            bits, value = 32, value & 0xffffffff
+        found = []
+        for (family, length), prefixes in self._prefixes.iteritems():
+            if family == bits:
+                found.extend(prefixes.get(value >> (bits - length), ()))
+        return [self.networks[idx] for idx in sorted(found)]
+
+    def __len__(self):
+        return len(self.networks)
+
+
+def _parse_address(address):
+    """Return the number of bits and the value of an IPv4 or IPv6 address,
+    or raise a `ValueError` if it is invalid."""
+    # Python 2 lacks inet_pton on Windows
+    inet_pton = getattr(socket, 'inet_pton', _inet_pton)
+    for family, bits in ((socket.AF_INET, 32), (socket.AF_INET6, 128)):
+        try:
+            packed = inet_pton(family, address.strip())
+        except (socket.error, ValueError):
+            continue
+        return bits, int(hexlify(packed), 16)
+    raise ValueError('Invalid IP address: %s' % address)
+
+
+_IPV4_RE = re.compile(r'\A(?:[0-9]{1,3}\.){3}[0-9]{1,3}\Z')
+_IPV6_WORD_RE = re.compile(r'\A[0-9A-Fa-f]{1,4}\Z')
+
+def _inet_pton(family, address):
+    """Replacement of `socket.inet_pton` for IPv4 and IPv6 addresses."""
+    if family == socket.AF_INET:
+        # inet_aton also accepts abbreviated addresses like 10.1
+        if not _IPV4_RE.match(address):
+            raise ValueError('Invalid IPv4 address: %s' % address)
+        return socket.inet_aton(address)
+    halves = [part and part.split(':') or [] for part in address.split('::')]
+    if len(halves) > 2:
+        raise ValueError('Invalid IPv6 address: %s' % address)
+    last = halves[-1]
+    if last and '.' in last[-1]:
+        # IPv4 address in the last 32 bits
+        packed = _inet_pton(socket.AF_INET, last[-1])
+        last[-1:] = [hexlify(packed[:2]), hexlify(packed[2:])]
+    words = sum(halves, [])
+    if len(halves) == 2:
+        # `::` stands for at least one word of zeros
+        if len(words) > 7:
+            raise ValueError('Invalid IPv6 address: %s' % address)
+        words = halves[0] + ['0'] * (8 - len(words)) + halves[1]
+    if len(words) != 8 or not all([_IPV6_WORD_RE.match(word)
+                                   for word in words]):
+        raise ValueError('Invalid IPv6 address: %s' % address)
+    return ''.join([struct.pack('>H', int(word, 16)) for word in words])
+
+
+_REPEATS = (MAX_REPEAT, MIN_REPEAT)
+
+_CATEGORY_CHARS = {CATEGORY_DIGIT: u'0', CATEGORY_NOT_DIGIT: u'a',
+                   CATEGORY_SPACE: u' ', CATEGORY_NOT_SPACE: u'a',
+                   CATEGORY_WORD: u'a', CATEGORY_NOT_WORD: u'!'}
+
+def _subpatterns(op, av):
+    """Return the parsed subpatterns of an item of a parsed pattern."""
+    if op in _REPEATS:
+        return [av[2]]
+    elif op in (SUBPATTERN, ASSERT, ASSERT_NOT):
+        return [av[1]]
+    elif op is BRANCH:
+        return av[1]
+    elif op is GROUPREF_EXISTS:
+        return [p for p in av[1:] if p]
+    return []
+
+def _has_repeat(items):
+    for op, av in items:
+        if op in _REPEATS and av[1] > 1:
+            return True
+        for sub in _subpatterns(op, av):
+            if _has_repeat(sub):
+                return True
+    return False
+
+def _has_nested_repeat(items):
+    for op, av in items:
+        if op in _REPEATS and av[1] > 1 and _has_repeat(av[2]):
+            return True
+        for sub in _subpatterns(op, av):
+            if _has_nested_repeat(sub):
+                return True
+    return False
+
+def has_nested_repeat(pattern):
+    """Return whether the compiled pattern repeats a part which contains a
+    repetition itself, like `(a+)+`, which can make a search backtrack
+    catastrophically."""
+    return _has_nested_repeat(sre_parse.parse(pattern.pattern).data)
+
+def _chars(items, chars):
+    """Collect characters matched by the parts of a parsed pattern."""
+    for op, av in items:
+        if op is LITERAL:
+            chars.add(unichr(av))
+        elif op is NOT_LITERAL:
+            chars.add(av == ord('a') and u'b' or u'a')
+        elif op is ANY:
+            chars.add(u'a')
+        elif op is IN:
+            for kind, value in av:
+                if kind is LITERAL:
+                    chars.add(unichr(value))
+                elif kind is RANGE:
+                    chars.add(unichr(value[0]))
+                elif kind is CATEGORY and value in _CATEGORY_CHARS:
+                    chars.add(_CATEGORY_CHARS[value])
+        for sub in _subpatterns(op, av):
+            _chars(sub, chars)
+    return chars
+
+def worst_search_time(pattern, budget, lengths=range(8, 34, 2)):
+    """Search the compiled pattern in texts crafted to make it backtrack,
+    and return the longest time a search took, in seconds.
+
+    The texts repeat the characters the pattern matches `lengths` times,
+    and end with characters it most likely doesn't match. As backtracking
+    grows exponentially with the length of such texts, the lengths are
+    increased in small steps, and the benchmark stops when a search takes
+    longer than `budget` seconds. Patterns without repetitions aren't
+    searched, as they can't backtrack much.
+    """
+    items = sre_parse.parse(pattern.pattern).data
+    if not _has_repeat(items):
+        return 0.0
+    chars = sorted(_chars(items, set()))
+    units = chars + [u''.join(chars)]
+    worst = 0.0
+    for length in lengths:
+        for unit in units:
+            text = unit * length + u'\n\x00'
+            start = time.time()
+            pattern.search(text)
+            duration = time.time() - start
+            worst = max(worst, duration)
+            if worst > budget:
+                return worst
+    return worst
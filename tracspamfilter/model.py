@@ -19,7 +19,7 @@ from time import mktime
 from trac.db import Column, Index, Table
 from trac.util.text import to_unicode
 
-__all__ = ['LogEntry']
+__all__ = ['LogEntry', 'PatternStatistics']
 
 
 class LogEntry(object):
@@ -35,7 +35,9 @@ class LogEntry(object):
         Column('content'),
         Column('rejected', type='int'),
         Column('karma', type='int'),
-        Column('reasons')
+        Column('reasons'),
+        Index(['time']),
+        Index(['ipnr', 'time'])
     ]
 
     def __init__(self, env, time, path, author, authenticated, ipnr, headers,
@@ -198,19 +200,40 @@ class LogEntry(object):
 
     fetch = classmethod(fetch)
 
-    def count(cls, env, db=None):
-        """Return the number of log entries in the database."""
+    def count(cls, env, db=None, ipnr=None, since=None):
+        """Return the number of log entries in the database, optionally only
+        those submitted from the IP address `ipnr` and those not older than
+        the timestamp `since`."""
         if not db:
             db = env.get_db_cnx()
 
+        where_clauses = []
+        params = []
+        if ipnr:
+            where_clauses.append("ipnr=%s")
+            params.append(ipnr)
+        if since:
+            where_clauses.append("time>=%s")
+            params.append(int(since))
+
+        if where_clauses:
+            where = "WHERE %s" % " AND ".join(where_clauses)
+        else:
+            where = ""
+
         cursor = db.cursor()
-        cursor.execute("SELECT COUNT(*) FROM spamfilter_log ")
+        cursor.execute("SELECT COUNT(*) FROM spamfilter_log %s" % where,
+                       params)
         return cursor.fetchone()[0]
 
     count = classmethod(count)
 
-    def purge(cls, env, days, db=None):
-        """Delete log entries older than the specified number of days."""
+    def purge(cls, env, days, db=None, limit=None):
+        """Delete log entries older than the specified number of days.
+
+        If `limit` is given, at most that many of the oldest entries are
+        deleted. Return the number of deleted entries.
+        """
         if not db:
             db = env.get_db_cnx()
             handle_ta = True
@@ -219,10 +242,22 @@ class LogEntry(object):
 
         threshold = datetime.now() - timedelta(days=days)
         cursor = db.cursor()
-        cursor.execute("DELETE FROM spamfilter_log WHERE time < %s",
-                       (mktime(threshold.timetuple()),))
+        if limit:
+            cursor.execute("SELECT id FROM spamfilter_log WHERE time < %s "
+                           "ORDER BY id LIMIT %s",
+                           (mktime(threshold.timetuple()), limit))
+            ids = [row[0] for row in cursor.fetchall()]
+            if ids:
+                cursor.execute("DELETE FROM spamfilter_log WHERE id IN (%s)"
+                               % ','.join(['%s'] * len(ids)), ids)
+            count = len(ids)
+        else:
+            cursor.execute("DELETE FROM spamfilter_log WHERE time < %s",
+                           (mktime(threshold.timetuple()),))
+            count = cursor.rowcount
         if handle_ta:
             db.commit()
+        return count
 
     purge = classmethod(purge)
 
@@ -282,9 +317,120 @@ class Bayes(object):
         Column('word'),
         Column('nspam', type='int'),
         Column('nham', type='int'),
+        Column('lastseen', type='int'),
         Index(['word'])
     ]
 
+    # number of tokens and histogram of the spam share of their counts
+    summary_table = Table('spamfilter_bayes_summary', key='name')[
+        Column('name'),
+        Column('value', type='int')
+    ]
+
+    # candidates for the tokens indicating spam and ham most strongly
+    top_table = Table('spamfilter_bayes_top', key='word')[
+        Column('word'),
+        Column('nspam', type='int'),
+        Column('nham', type='int')
+    ]
+
+
+class PatternStatistics(object):
+    """Number of matches and search time of the patterns of a filter
+    strategy, like the BadContent patterns.
+
+    An instance holds counts to be added by `insert()`, so that they can be
+    written by the `LogWriter` like log entries.
+    """
+
+    table = Table('spamfilter_patterns', key=('source', 'pattern'))[
+        Column('source'),
+        Column('pattern'),
+        Column('hits', type='int'),
+        Column('lasthit', type='int'),
+        Column('searches', type='int'),
+        Column('time', type='int64') # microseconds
+    ]
+
+    def __init__(self, env, source, counts):
+        self.env = env
+        self.source = source
+        self.counts = counts
+
+    def __repr__(self):
+        return '<%s %s: %d patterns>' % (self.__class__.__name__,
+                                         self.source, len(self.counts))
+
+    def insert(self, db=None):
+        """Add the counts to the statistics in the database."""
+        self.update(self.env, self.source, self.counts, db)
+
+    def update(cls, env, source, counts, db=None):
+        """Add counts to the statistics of the patterns of `source`.
+
+        `counts` maps the patterns to lists of the number of matches, the
+        time of the last match, the number of timed searches and their
+        duration in seconds.
+        """
+        if not db:
+            db = env.get_db_cnx()
+            handle_ta = True
+        else:
+            handle_ta = False
+
+        cursor = db.cursor()
+        for pattern, (hits, lasthit, searches, duration) in counts.items():
+            duration = int(duration * 1000000)
+            cursor.execute("UPDATE spamfilter_patterns "
+                           "SET hits=hits+%s,lasthit=COALESCE(%s,lasthit),"
+                           "searches=searches+%s,time=time+%s "
+                           "WHERE source=%s AND pattern=%s",
+                           (hits, lasthit, searches, duration, source,
+                            pattern))
+            if cursor.rowcount < 1:
+                cursor.execute("INSERT INTO spamfilter_patterns "
+                               "(source,pattern,hits,lasthit,searches,time) "
+                               "VALUES (%s,%s,%s,%s,%s,%s)",
+                               (source, pattern, hits, lasthit, searches,
+                                duration))
+        if handle_ta:
+            db.commit()
+
+    update = classmethod(update)
+
+    def select(cls, env, source, db=None):
+        """Return the statistics of the patterns of `source` as a dictionary
+        of `(hits, lasthit, searches, time)` tuples, with the time in
+        seconds."""
+        if not db:
+            db = env.get_db_cnx()
+
+        cursor = db.cursor()
+        cursor.execute("SELECT pattern,hits,lasthit,searches,time "
+                       "FROM spamfilter_patterns WHERE source=%s", (source,))
+        return dict([(pattern, (hits, lasthit, searches, duration / 1e6))
+                     for pattern, hits, lasthit, searches, duration
+                     in cursor])
+
+    select = classmethod(select)
+
+    def delete(cls, env, source, db=None):
+        """Delete the statistics of the patterns of `source`."""
+        if not db:
+            db = env.get_db_cnx()
+            handle_ta = True
+        else:
+            handle_ta = False
+
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM spamfilter_patterns WHERE source=%s",
+                       (source,))
+        if handle_ta:
+            db.commit()
+
+    delete = classmethod(delete)
+
 
-schema = [Bayes.table, LogEntry.table]
-schema_version = 3
+schema = [Bayes.table, Bayes.summary_table, Bayes.top_table, LogEntry.table,
+          PatternStatistics.table]
+schema_version = 7
@@ -13,13 +13,22 @@
 
 import unittest
 
-from tracspamfilter.tests import api, model
+from tracspamfilter.tests import api, bayesstore, circuitbreaker, \
+                                 listmirror, logwriter, matcher, model, \
+                                 versionstamp, workerpool
 from tracspamfilter.filters import tests as filters
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(api.suite())
+    suite.addTest(bayesstore.suite())
+    suite.addTest(circuitbreaker.suite())
+    suite.addTest(listmirror.suite())
+    suite.addTest(logwriter.suite())
+    suite.addTest(matcher.suite())
     suite.addTest(model.suite())
+    suite.addTest(versionstamp.suite())
+    suite.addTest(workerpool.suite())
     suite.addTest(filters.suite())
     return suite
 
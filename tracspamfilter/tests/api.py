@@ -11,15 +11,24 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
+from StringIO import StringIO
+import threading
 import time
 import unittest
+import urllib2
 
 from trac.core import *
 from trac.db.sqlite_backend import _to_sql
 from trac.test import EnvironmentStub, Mock
 from tracspamfilter.api import IFilterStrategy, RejectContent
+from tracspamfilter.circuitbreaker import CircuitBreaker
+from tracspamfilter.filters import stopforumspam
+from tracspamfilter.filters.httpbl import HttpBLFilterStrategy
+from tracspamfilter.filters.stopforumspam import StopForumSpamFilterStrategy
 from tracspamfilter.filtersystem import FilterSystem
+from tracspamfilter.logwriter import LogWriter
 from tracspamfilter.model import LogEntry, schema
+from tracspamfilter.workerpool import WorkerPool
 
 
 class DummyStrategy(Component):
@@ -53,10 +62,63 @@ class DummyStrategy(Component):
         self.spam = spam
 
 
+class ExternalDummyFilterStrategy(Component):
+    implements(IFilterStrategy)
+
+    karma_points = 5
+
+    def __init__(self):
+        self.test_called = False
+        self.delay = 0
+        self.karma = 0
+        self.message = None
+        self.thread = None
+        self.req = None
+
+    def configure(self, karma, message=None, delay=0):
+        self.karma = karma
+        self.message = message
+        self.delay = delay
+
+    def is_external(self):
+        return True
+
+    def test(self, req, author, content, ip):
+        self.test_called = True
+        self.thread = threading.currentThread()
+        self.req = req
+        time.sleep(self.delay)
+        return self.karma, self.message
+
+    def train(self, req, author, content, ip, spam=True):
+        pass
+
+
+class OtherExternalDummyFilterStrategy(ExternalDummyFilterStrategy):
+    pass
+
+
+class FailingDummyFilterStrategy(ExternalDummyFilterStrategy):
+
+    def test(self, req, author, content, ip):
+        self.test_called = True
+        raise IOError('Service unavailable')
+
+
+class LocalDummyFilterStrategy(ExternalDummyFilterStrategy):
+
+    def is_external(self):
+        return False
+
+
 class FilterSystemTestCase(unittest.TestCase):
 
     def setUp(self):
         self.env = EnvironmentStub(enable=[FilterSystem, DummyStrategy])
+        # don't purge the log in the background
+        self.env.db_transaction("INSERT INTO system VALUES "
+                                "('spamfilter_lastpurge',%s)",
+                                (int(time.time()),))
 
         db = self.env.get_db_cnx()
         cursor = db.cursor()
@@ -205,9 +267,304 @@ class FilterSystemTestCase(unittest.TestCase):
         self.assertEqual(False, entry.rejected)
 
 
+class ExternalFilterSystemTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[FilterSystem,
+                                           ExternalDummyFilterStrategy,
+                                           OtherExternalDummyFilterStrategy,
+                                           LocalDummyFilterStrategy])
+        self.env.config.set('spam-filter', 'parallel_external', 'true')
+        self.env.config.set('spam-filter', 'logging_enabled', 'false')
+
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    db(stmt)
+            # don't purge the log in the background
+            db("DELETE FROM system WHERE name LIKE 'spamfilter_%%'")
+            db("INSERT INTO system VALUES ('spamfilter_lastpurge',%s)",
+               (int(time.time()),))
+
+        self.req = Mock(environ={}, path_info='/foo', authname='anonymous',
+                        remote_addr='127.0.0.1', args={},
+                        base_url='http://example.org/',
+                        get_header=lambda name: None)
+
+    def tearDown(self):
+        CircuitBreaker._breakers.clear()
+        WorkerPool._pool = None
+
+    def test_external_run_concurrently(self):
+        ExternalDummyFilterStrategy(self.env).configure(5, 'One', delay=0.5)
+        OtherExternalDummyFilterStrategy(self.env).configure(5, 'Two', delay=0.5)
+        start = time.time()
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertNotEqual(threading.currentThread(),
+                            ExternalDummyFilterStrategy(self.env).thread)
+
+    def test_task_request_data(self):
+        self.req.environ = {'HTTP_USER_AGENT': 'Mozilla',
+                            'CONTENT_TYPE': 'text/plain',
+                            'wsgi.input': StringIO()}
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        req = ExternalDummyFilterStrategy(self.env).req
+        self.assertFalse(req is self.req)
+        self.assertEqual('http://example.org/', req.base_url)
+        self.assertEqual('Mozilla', req.get_header('User-Agent'))
+        self.assertEqual('text/plain', req.get_header('Content-Type'))
+        self.assertEqual(None, req.get_header('Referer'))
+        self.assertFalse('wsgi.input' in req.environ)
+
+    def test_results_merged(self):
+        ExternalDummyFilterStrategy(self.env).configure(-3, 'One', delay=0.2)
+        OtherExternalDummyFilterStrategy(self.env).configure(-4, 'Two')
+        try:
+            FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+            self.fail('Expected RejectContent exception')
+        except RejectContent, e:
+            self.assertTrue('One' in unicode(e))
+            self.assertTrue('Two' in unicode(e))
+
+    def test_sequential_without_option(self):
+        self.env.config.set('spam-filter', 'parallel_external', 'false')
+        ExternalDummyFilterStrategy(self.env).configure(5)
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertEqual(threading.currentThread(),
+                         ExternalDummyFilterStrategy(self.env).thread)
+
+    def test_deadline_abandons_slow_strategy(self):
+        self.env.config.set('spam-filter', 'logging_enabled', 'true')
+        self.env.config.set('spam-filter', 'max_test_time', '1')
+        ExternalDummyFilterStrategy(self.env).configure(-5, 'Slow', delay=3)
+        OtherExternalDummyFilterStrategy(self.env).configure(5)
+        start = time.time()
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertTrue(time.time() - start < 2)
+
+        entry = list(LogEntry.select(self.env))[0]
+        self.assertEqual(False, entry.rejected)
+        self.assertEqual(5, entry.karma)
+        self.assertEqual(['ExternalDummy (0): Timed out after 1 seconds'],
+                         entry.reasons)
+
+    def test_worker_pool_bounded(self):
+        self.env.config.set('spam-filter', 'logging_enabled', 'true')
+        self.env.config.set('spam-filter', 'max_test_time', '1')
+        self.env.config.set('spam-filter', 'max_workers', '1')
+        self.env.config.set('spam-filter', 'worker_queue_size', '2')
+        ExternalDummyFilterStrategy(self.env).configure(-5, 'Slow', delay=3)
+        OtherExternalDummyFilterStrategy(self.env).configure(5)
+        filtersys = FilterSystem(self.env)
+        for i in range(2):
+            filtersys.test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertEqual(1, len(WorkerPool._pool.threads))
+
+        reasons = [entry.reasons for entry in LogEntry.select(self.env)]
+        self.assertTrue(['ExternalDummy (0): Timed out after 1 seconds',
+                         'OtherExternalDummy (0): Skipped, too many pending '
+                         'queries'] in reasons)
+
+    def test_skip_decided_reject(self):
+        self.env.config.set('spam-filter', 'logging_enabled', 'true')
+        self.env.config.set('spam-filter', 'skip_decided', 'true')
+        LocalDummyFilterStrategy(self.env).configure(-11, 'Bad')
+        try:
+            FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+            self.fail('Expected RejectContent exception')
+        except RejectContent, e:
+            pass
+        self.assertEqual(False, ExternalDummyFilterStrategy(self.env).test_called)
+        self.assertEqual(False,
+                         OtherExternalDummyFilterStrategy(self.env).test_called)
+
+        entry = list(LogEntry.select(self.env))[0]
+        self.assertEqual(-11, entry.karma)
+        self.assertEqual(['ExternalDummy (0): Skipped, verdict already decided',
+                          'LocalDummy (-11): Bad',
+                          'OtherExternalDummy (0): Skipped, verdict already '
+                          'decided'], entry.reasons)
+
+    def test_skip_decided_accept(self):
+        self.env.config.set('spam-filter', 'skip_decided', 'true')
+        LocalDummyFilterStrategy(self.env).configure(10)
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertEqual(False, ExternalDummyFilterStrategy(self.env).test_called)
+
+    def test_skip_decided_undecided(self):
+        self.env.config.set('spam-filter', 'skip_decided', 'true')
+        LocalDummyFilterStrategy(self.env).configure(9)
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertEqual(True, ExternalDummyFilterStrategy(self.env).test_called)
+        self.assertEqual(True,
+                         OtherExternalDummyFilterStrategy(self.env).test_called)
+
+    def test_skip_decided_multiple_karma_points(self):
+        # Http:BL can give its karma points and a third of them
+        self.env = EnvironmentStub(enable=[FilterSystem,
+                                           LocalDummyFilterStrategy,
+                                           HttpBLFilterStrategy])
+        self.env.db_transaction("INSERT INTO system VALUES "
+                                "('spamfilter_lastpurge',%s)",
+                                (int(time.time()),))
+        self.env.config.set('spam-filter', 'logging_enabled', 'true')
+        self.env.config.set('spam-filter', 'skip_decided', 'true')
+        self.env.config.set('spam-filter', 'httpbl_spammer_karma', '3')
+        self.assertEqual(4, HttpBLFilterStrategy(self.env).get_max_karma())
+        filtersys = FilterSystem(self.env)
+        skipped = 'HttpBL (0): Skipped, verdict already decided'
+
+        LocalDummyFilterStrategy(self.env).configure(3)
+        filtersys.test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertFalse(skipped in list(LogEntry.select(self.env))[0].reasons)
+
+        self.env.db_transaction("DELETE FROM spamfilter_log")
+        LocalDummyFilterStrategy(self.env).configure(4)
+        filtersys.test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertTrue(skipped in list(LogEntry.select(self.env))[0].reasons)
+
+    def test_log_async(self):
+        self.env.config.set('spam-filter', 'logging_enabled', 'true')
+        self.env.config.set('spam-filter', 'log_async', 'true')
+        ExternalDummyFilterStrategy(self.env).configure(5)
+        FilterSystem(self.env).test(self.req, 'John Doe', [(None, 'Test')])
+        LogWriter.get(self.env).stop()
+
+        entry = list(LogEntry.select(self.env))[0]
+        self.assertEqual('John Doe', entry.author)
+        self.assertEqual(5, entry.karma)
+
+    def test_circuit_breaker(self):
+        self.env = EnvironmentStub(enable=[FilterSystem,
+                                           ExternalDummyFilterStrategy,
+                                           FailingDummyFilterStrategy])
+        self.env.db_transaction("INSERT INTO system VALUES "
+                                "('spamfilter_lastpurge',%s)",
+                                (int(time.time()),))
+        self.env.config.set('spam-filter', 'logging_enabled', 'true')
+        self.env.config.set('spam-filter', 'circuit_breaker', 'true')
+        self.env.config.set('spam-filter', 'breaker_window', '2')
+        filtersys = FilterSystem(self.env)
+        strategy = FailingDummyFilterStrategy(self.env)
+        for i in range(2):
+            filtersys.test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertEqual(CircuitBreaker.OPEN,
+                         CircuitBreaker.get(self.env,
+                                            'FailingDummyFilterStrategy').state)
+
+        strategy.test_called = False
+        self.env.db_transaction("DELETE FROM spamfilter_log")
+        filtersys.test(self.req, 'John Doe', [(None, 'Test')])
+        self.assertEqual(False, strategy.test_called)
+        self.assertEqual(True, ExternalDummyFilterStrategy(self.env).test_called)
+        entry = list(LogEntry.select(self.env))[0]
+        self.assertEqual(['FailingDummy (0): Skipped, service is failing'],
+                         entry.reasons)
+
+    def test_circuit_breaker_trial_released(self):
+        self.env.config.set('spam-filter', 'circuit_breaker', 'true')
+        self.env.config.set('spam-filter', 'worker_queue_size', '1')
+        breaker = CircuitBreaker.get(self.env, 'ExternalDummyFilterStrategy')
+        breaker.state = CircuitBreaker.OPEN
+        breaker.changed = time.time() - 301
+        # keep the single worker busy and the queue full
+        pool = WorkerPool._pool = WorkerPool(1, 1)
+        event = threading.Event()
+        pool.submit(event.wait)
+        while not pool.queue.empty():
+            time.sleep(0.01)
+        pool.submit(event.wait)
+        try:
+            FilterSystem(self.env).test(self.req, 'John Doe',
+                                        [(None, 'Test')])
+        finally:
+            event.set()
+        self.assertEqual(False,
+                         ExternalDummyFilterStrategy(self.env).test_called)
+        self.assertEqual(CircuitBreaker.HALF_OPEN, breaker.state)
+        self.assertEqual(None, breaker.trial)
+
+    def test_circuit_breaker_service_error(self):
+        # StopForumSpam catches and logs the failed requests itself
+        self.env = EnvironmentStub(enable=[FilterSystem,
+                                           StopForumSpamFilterStrategy])
+        self.env.db_transaction("INSERT INTO system VALUES "
+                                "('spamfilter_lastpurge',%s)",
+                                (int(time.time()),))
+        self.env.config.set('spam-filter', 'circuit_breaker', 'true')
+        self.env.config.set('spam-filter', 'breaker_window', '2')
+        def urlopen(*args, **kwargs):
+            raise urllib2.URLError('Connection refused')
+        orig_urlopen = stopforumspam.urllib2.urlopen
+        stopforumspam.urllib2.urlopen = urlopen
+        try:
+            filtersys = FilterSystem(self.env)
+            for i in range(2):
+                filtersys.test(self.req, 'John Doe', [(None, 'Test')])
+        finally:
+            stopforumspam.urllib2.urlopen = orig_urlopen
+        self.assertEqual(CircuitBreaker.OPEN,
+                         CircuitBreaker.get(self.env,
+                                            'StopForumSpamFilterStrategy')
+                         .state)
+
+
+class LogPurgeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(enable=[FilterSystem])
+        self.env.config.set('spam-filter', 'purge_age', '4')
+        self.env.config.set('spam-filter', 'purge_chunk_size', '2')
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    db(stmt)
+            db("DELETE FROM system WHERE name LIKE 'spamfilter_%%'")
+
+        oneweekago = time.time() - 7 * 24 * 3600
+        for i in range(5):
+            LogEntry(self.env, oneweekago, '/foo', 'john', False,
+                     '127.0.0.1', '', 'Test', False, 5, []).insert()
+        LogEntry(self.env, time.time(), '/foo', 'jane', False,
+                 '127.0.0.1', '', 'Test', False, 5, []).insert()
+
+    def test_purge_log(self):
+        filtersys = FilterSystem(self.env)
+        self.assertEqual((None, None), filtersys.get_purge_status())
+        filtersys._purge_log()
+
+        log = list(LogEntry.select(self.env))
+        self.assertEqual(['jane'], [entry.author for entry in log])
+        self.assertEqual(None, filtersys.get_purge_status()[0])
+        self.assertEqual(5, filtersys.get_purge_status()[1])
+
+    def test_schedule_purge(self):
+        filtersys = FilterSystem(self.env)
+        filtersys._schedule_purge()
+        filtersys._purge_thread.join()
+        self.assertEqual(1, LogEntry.count(self.env))
+        last, count = filtersys.get_purge_status()
+        self.assertTrue(time.time() - last < 60)
+        self.assertEqual(5, count)
+
+        # not purging again before the interval has passed
+        LogEntry(self.env, time.time() - 7 * 24 * 3600, '/foo', 'john', False,
+                 '127.0.0.1', '', 'Test', False, 5, []).insert()
+        filtersys._next_purge = 0
+        filtersys._purge_thread = None
+        filtersys._schedule_purge()
+        self.assertEqual(None, filtersys._purge_thread)
+        self.assertEqual(2, LogEntry.count(self.env))
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(FilterSystemTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(ExternalFilterSystemTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(LogPurgeTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
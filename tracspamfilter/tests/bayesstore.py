@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import os
+import shutil
+import tempfile
+from threading import Thread
+import unittest
+
+from tracspamfilter.bayesstore import SQLiteStore
+
+
+class SQLiteStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.store = SQLiteStore(os.path.join(self.tempdir, 'db', 'bayes.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_create(self):
+        self.assertTrue(os.path.exists(self.store.path))
+        self.assertEqual([], self.store.db_query("SELECT * FROM system"))
+        self.assertEqual([], self.store.db_query(
+            "SELECT * FROM spamfilter_bayes"))
+
+    def test_transaction(self):
+        with self.store.db_transaction as db:
+            db("INSERT INTO spamfilter_bayes (word,nspam,nham) "
+               "VALUES (%s,%s,%s)", ('spam', 1, 0))
+            with self.store.db_query as inner:
+                self.assertTrue(inner is db)
+        try:
+            with self.store.db_transaction as db:
+                db("DELETE FROM spamfilter_bayes")
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual([(u'spam', 1, 0)], self.store.db_query(
+            "SELECT word,nspam,nham FROM spamfilter_bayes"))
+
+    def test_pool(self):
+        with self.store.db_query as db:
+            pass
+        self.assertEqual([db], self.store._pool)
+        with self.store.db_query as other:
+            self.assertTrue(other is db)
+        def query():
+            self.store.db_query("SELECT * FROM spamfilter_bayes")
+        threads = [Thread(target=query) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(len(self.store._pool) <= self.store.pool_size)
+        self.store.close()
+        self.assertEqual([], self.store._pool)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(SQLiteStoreTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
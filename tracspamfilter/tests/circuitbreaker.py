@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import time
+import unittest
+
+from trac.test import EnvironmentStub
+from tracspamfilter.circuitbreaker import CircuitBreaker
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker('Dummy')
+
+    def _record(self, success, latency=0.1):
+        self.breaker.record(success, latency, window=4, error_rate=50,
+                            max_latency=2)
+
+    def test_closed(self):
+        self._record(True)
+        self._record(False)
+        self._record(True)
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+        self.assertEqual(True, self.breaker.allow(60))
+
+    def test_open_on_errors(self):
+        for success in (True, False, True, False):
+            self._record(success)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+        self.assertEqual(False, self.breaker.allow(60))
+
+    def test_open_on_latency(self):
+        for i in range(4):
+            self._record(True, latency=3)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+
+    def test_window(self):
+        for success in (False, True, True, True, True):
+            self._record(success)
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+        self.assertEqual(0, self.breaker.failures)
+
+    def test_half_open(self):
+        for i in range(4):
+            self._record(False)
+        self.breaker.changed = time.time() - 61
+        self.assertEqual(True, self.breaker.allow(60))
+        self.assertEqual(CircuitBreaker.HALF_OPEN, self.breaker.state)
+        # only a single trial call at a time
+        self.assertEqual(False, self.breaker.allow(60))
+        self._record(True)
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+        self.assertEqual(True, self.breaker.allow(60))
+
+    def test_half_open_failed(self):
+        for i in range(4):
+            self._record(False)
+        self.breaker.changed = time.time() - 61
+        self.assertEqual(True, self.breaker.allow(60))
+        self._record(False)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+        self.assertEqual(False, self.breaker.allow(60))
+
+    def test_half_open_release(self):
+        for i in range(4):
+            self._record(False)
+        self.breaker.changed = time.time() - 61
+        self.assertEqual(True, self.breaker.allow(60))
+        self.assertEqual(False, self.breaker.allow(60))
+        # the trial call was not made
+        self.breaker.release()
+        self.assertEqual(CircuitBreaker.HALF_OPEN, self.breaker.state)
+        self.assertEqual(True, self.breaker.allow(60))
+
+    def test_shared(self):
+        env = EnvironmentStub()
+        self.assertTrue(CircuitBreaker.get(env, 'Dummy') is
+                        CircuitBreaker.get(env, 'Dummy'))
+        self.assertFalse(CircuitBreaker.get(env, 'Dummy') is
+                         CircuitBreaker.get(env, 'Other'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(CircuitBreakerTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
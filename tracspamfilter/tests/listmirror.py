@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from tracspamfilter.listmirror import ListMirror
+
+
+class ListMirrorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'lists.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_missing_file(self):
+        mirror = ListMirror(self.path)
+        self.assertEqual(0, len(mirror))
+        self.assertFalse(mirror.contains('ip', '127.0.0.1'))
+
+    def test_contains(self):
+        entries = [('ip', '10.0.0.%d' % i) for i in xrange(1000)]
+        entries += [('email', 'Spammer@Example.com'), ('username', 'spammer'),
+                    ('ip', '10.0.0.1'), ('username', u'sp\xe4mmer')]
+        self.assertEqual(1003, ListMirror.write(self.path, entries))
+        self.assertEqual(16 + 1003 * 8, os.path.getsize(self.path))
+        mirror = ListMirror(self.path)
+        self.assertEqual(1003, len(mirror))
+        for i in xrange(1000):
+            self.assertTrue(mirror.contains('ip', '10.0.0.%d' % i))
+        self.assertTrue(mirror.contains('email', 'spammer@example.com '))
+        self.assertTrue(mirror.contains('username', 'spammer'))
+        self.assertTrue(mirror.contains('username', u'SP\xc4MMER'))
+        self.assertTrue(mirror.contains('username', 'sp\xc3\xa4mmer'))
+        self.assertFalse(mirror.contains('ip', 'spammer'))
+        self.assertFalse(mirror.contains('ip', '10.0.1.1'))
+        self.assertFalse(mirror.contains('email', 'user@example.com'))
+
+    def test_write_iterator(self):
+        def entries():
+            for i in xrange(3):
+                for j in xrange(100):
+                    yield 'ip', '10.0.%d.%d' % (j % 10, j)
+        self.assertEqual(100, ListMirror.write(self.path, entries()))
+        mirror = ListMirror(self.path)
+        keys = [mirror._get_keys()[idx] for idx in xrange(len(mirror))]
+        self.assertEqual(sorted(set(keys)), keys)
+        self.assertTrue(mirror.contains('ip', '10.0.9.99'))
+
+    def test_replace(self):
+        ListMirror.write(self.path, [('ip', '10.0.0.1')])
+        mirror = ListMirror(self.path)
+        self.assertTrue(mirror.contains('ip', '10.0.0.1'))
+        ListMirror.write(self.path, [('ip', '10.0.0.2'), ('ip', '10.0.0.3')])
+        self.assertEqual(2, len(mirror))
+        self.assertFalse(mirror.contains('ip', '10.0.0.1'))
+        self.assertTrue(mirror.contains('ip', '10.0.0.2'))
+        self.assertEqual([], [name for name in os.listdir(self.tempdir)
+                              if name != 'lists.db'])
+
+    def test_damaged_file(self):
+        ListMirror.write(self.path, [('ip', '10.0.0.1'), ('ip', '10.0.0.2')])
+        with open(self.path, 'r+b') as f:
+            f.truncate(20)
+        mirror = ListMirror(self.path)
+        self.assertEqual(0, len(mirror))
+        self.assertFalse(mirror.contains('ip', '10.0.0.1'))
+        with open(self.path, 'wb') as f:
+            f.write('TSF')
+        self.assertEqual(0, len(mirror))
+
+    def test_get(self):
+        self.assertTrue(ListMirror.get(self.path) is
+                        ListMirror.get(os.path.join(self.tempdir, '.',
+                                                    'lists.db')))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(ListMirrorTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
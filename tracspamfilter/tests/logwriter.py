@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import time
+import unittest
+
+from trac.db.sqlite_backend import _to_sql
+from trac.test import EnvironmentStub
+from tracspamfilter.logwriter import LogWriter
+from tracspamfilter.model import LogEntry, schema
+
+
+class LogWriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    db(stmt)
+        self.writer = LogWriter(self.env, 10)
+
+    def tearDown(self):
+        self.writer.stop()
+
+    def _entry(self, author):
+        return LogEntry(self.env, time.time(), '/foo', author, False,
+                        '127.0.0.1', '', 'Test', False, 5, [])
+
+    def test_write(self):
+        for i in range(5):
+            self.writer.put(self._entry('john%d' % i), batch_size=3)
+        self.writer.flush()
+        authors = sorted([entry.author for entry in LogEntry.select(self.env)])
+        self.assertEqual(['john0', 'john1', 'john2', 'john3', 'john4'],
+                         authors)
+
+    def test_stop_writes_pending(self):
+        self.writer.put(self._entry('john'), batch_size=10, interval=60)
+        self.writer.stop()
+        self.assertEqual(1, LogEntry.count(self.env))
+        self.assertEqual(None, self.writer.thread)
+
+    def test_queue_full(self):
+        writer = LogWriter(self.env, 1)
+        writer.thread = 'dummy' # don't start the writer thread
+        writer.put(self._entry('john'))
+        writer.put(self._entry('jane'))
+        self.assertEqual(1, writer.queue.qsize())
+
+    def test_get_new_environment(self):
+        writer = LogWriter.get(self.env)
+        try:
+            env = EnvironmentStub()
+            self.assertTrue(writer is LogWriter.get(env))
+            self.assertTrue(writer.env is env)
+            self.assertTrue(writer.log is env.log)
+        finally:
+            del LogWriter._writers[self.env.path]
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(LogWriterTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import re
+import socket
+import unittest
+
+from tracspamfilter import matcher as matcher_module
+from tracspamfilter.matcher import NetworkMatcher, PatternMatcher, \
+                                   has_nested_repeat, worst_search_time
+
+
+class PatternMatcherTestCase(unittest.TestCase):
+
+    def _search(self, patterns, text):
+        patterns = [re.compile(p) for p in patterns]
+        matcher = PatternMatcher(patterns)
+        expected = [p.pattern for p in patterns if p.search(text)]
+        found = [p.pattern for p in matcher.search(text)]
+        self.assertEqual(expected, found)
+        return matcher, found
+
+    def test_no_patterns(self):
+        matcher, found = self._search([], 'foobar')
+        self.assertEqual([], found)
+
+    def test_no_match(self):
+        matcher, found = self._search(['fo+', 'fa+'], 'eggs')
+        self.assertEqual([], found)
+        self.assertEqual(1, len(matcher.chunks))
+
+    def test_overlapping_matches(self):
+        matcher, found = self._search(['foo', 'foobar', 'o+b', 'bar$', 'x'],
+                                      'foobar')
+        self.assertEqual(['foo', 'foobar', 'o+b', 'bar$'], found)
+
+    def test_repeated_matches(self):
+        matcher, found = self._search(['foo', 'fob', 'bar'],
+                                      'foo ' * 50 + 'fob')
+        self.assertEqual(['foo', 'fob'], found)
+
+    def test_groups(self):
+        matcher, found = self._search(['(a)(b)', '(?:c|d)e', '((x))?y'],
+                                      'de ab')
+        self.assertEqual(['(a)(b)', '(?:c|d)e'], found)
+
+    def test_separate_patterns(self):
+        matcher, found = self._search([r'(a)\1', '(?i)FOO', '(?P<x>b)',
+                                       'foo'], 'aa foo b')
+        self.assertEqual([r'(a)\1', '(?i)FOO', '(?P<x>b)', 'foo'], found)
+        self.assertEqual([0, 1, 2], matcher.single)
+
+    def test_leading_literal(self):
+        matcher, found = self._search(['fo+', r'\bfar', '[fF]oo', 'ba+r',
+                                       '(?:f|b)ar', '^fa+'], 'far foo')
+        self.assertEqual(['fo+', r'\bfar', '[fF]oo', '(?:f|b)ar', '^fa+'],
+                         found)
+        self.assertEqual([2, 4], matcher.single)
+        self.assertEqual([[0], [1], [3], [5]],
+                         [indexes for indexes, regex in matcher.chunks])
+
+    def test_literals(self):
+        patterns = ['foo', 'foobar', 'oba', r'example\.com', 'example.org',
+                    'bar', 'eggs', 'foo']
+        matcher, found = self._search(patterns,
+                                      'foobar at example.org example.com')
+        self.assertEqual(['foo', 'foobar', 'oba', r'example\.com',
+                          'example.org', 'bar', 'foo'], found)
+        self.assertEqual([4], matcher.single + [idx for indexes, regex
+                                                in matcher.chunks
+                                                for idx in indexes])
+        matcher, found = self._search(patterns, 'spam')
+        self.assertEqual([], found)
+
+    def test_repeated_literals(self):
+        matcher, found = self._search(['a', 'ab', 'abc', 'x'], 'a' * 100 + 'bc')
+        self.assertEqual(['a', 'ab', 'abc'], found)
+
+    def test_anchored_literals(self):
+        patterns = ['^127.0', r'^127\.0\.', r'\.1$', r'\.1\Z', r'^10\.0\.0\.1$',
+                    r'\A10\.', r'\.2$']
+        self.assertEqual(6, len(PatternMatcher([re.compile(p) for p in
+                                                patterns]).anchored))
+        for text in ['127.0.0.1', '10.0.0.1', '10.0.0.1\n', '10.0.0.2\n\n',
+                     '127x0.1']:
+            self._search(patterns, text)
+
+    def test_unicode_literals(self):
+        matcher, found = self._search([u'caf\xe9', u'\u0444\u043e\u043e'],
+                                      u'un caf\xe9 \u0444\u043e\u043e')
+        self.assertEqual(2, len(found))
+
+    def test_chunks(self):
+        patterns = [r'word%d\b(x)?(y)?' % i for i in xrange(250)]
+        matcher, found = self._search(patterns, 'word7 word249 word12')
+        self.assertEqual([r'word7\b(x)?(y)?', r'word12\b(x)?(y)?',
+                          r'word249\b(x)?(y)?'], found)
+        self.assertEqual(6, len(matcher.chunks))
+        for indexes, regex in matcher.chunks:
+            self.assertTrue(regex.groups <= PatternMatcher.max_groups)
+
+
+class NetworkMatcherTestCase(unittest.TestCase):
+
+    def test_ipv4(self):
+        matcher = NetworkMatcher(['10.0.0.0/8', '192.168.1.0/24', '0.0.0.0/0',
+                                  '192.168.1.17', '192.168.1.17/32',
+                                  '10.1.2.3/8'])
+        self.assertEqual(['10.0.0.0/8', '0.0.0.0/0', '10.1.2.3/8'],
+                         matcher.search('10.20.30.40'))
+        self.assertEqual(['192.168.1.0/24', '0.0.0.0/0', '192.168.1.17',
+                          '192.168.1.17/32'], matcher.search('192.168.1.17'))
+        self.assertEqual(['192.168.1.0/24', '0.0.0.0/0'],
+                         matcher.search('192.168.1.18'))
+        self.assertEqual(['0.0.0.0/0'], matcher.search('192.168.2.1'))
+
+    def test_ipv6(self):
+        matcher = NetworkMatcher(['2001:db8::/32', '2001:db8:1::/48',
+                                  '::1', '10.0.0.0/8'])
+        self.assertEqual(['2001:db8::/32', '2001:db8:1::/48'],
+                         matcher.search('2001:db8:1::5'))
+        self.assertEqual(['2001:db8::/32'],
+                         matcher.search('2001:DB8:ffff::5'))
+        self.assertEqual(['::1'], matcher.search('::1'))
+        self.assertEqual([], matcher.search('2001:db9::1'))
+        self.assertEqual([], matcher.search('::a00:1'))
+
+    def test_mapped_ipv4(self):
+        matcher = NetworkMatcher(['10.0.0.0/8', '::ffff:192.168.0.0/112'])
+        self.assertEqual(['10.0.0.0/8'], matcher.search('::ffff:10.0.0.1'))
+        self.assertEqual(['::ffff:192.168.0.0/112'],
+                         matcher.search('192.168.3.4'))
+
+    def test_invalid(self):
+        matcher = NetworkMatcher()
+        for network in ['10.0.0.0/33', '10.0.0/8', '::1/129', '10.0.0.0/x',
+                        'example.com', u'10.0.0.\xe9/8']:
+            self.assertRaises(ValueError, matcher.add, network)
+        self.assertEqual(0, len(matcher))
+        matcher.add('10.0.0.0/8')
+        self.assertEqual([], matcher.search('unknown'))
+        self.assertEqual([], matcher.search(''))
+
+    def test_inet_pton_fallback(self):
+        inet_pton = matcher_module._inet_pton
+        for address in ['0.0.0.0', '10.1.2.3', '255.255.255.255']:
+            self.assertEqual(socket.inet_pton(socket.AF_INET, address),
+                             inet_pton(socket.AF_INET, address))
+        for address in ['::', '::1', '1::', '2001:db8::5', '2001:DB8:0:0:1::',
+                        '1:2:3:4:5:6:7:8', '1::8', '::ffff:10.0.0.1',
+                        '1:2:3:4:5:6:1.2.3.4']:
+            self.assertEqual(socket.inet_pton(socket.AF_INET6, address),
+                             inet_pton(socket.AF_INET6, address), address)
+        for address in ['10.1', '10.0.0.256', '10.0.0.1.', 'example.com',
+                        u'10.0.0.\xe9']:
+            self.assertRaises((socket.error, ValueError), inet_pton,
+                              socket.AF_INET, address)
+        for address in ['', ':', ':1', '1:', '1::2::3', '1:2:3:4:5:6:7',
+                        '1:2:3:4:5:6:7:8:9', '1:2:3:4::5:6:7:8', '12345::',
+                        'g::', '::1.2.3', '1.2.3.4::', '::1.2.3.4:1']:
+            self.assertRaises((socket.error, ValueError), inet_pton,
+                              socket.AF_INET6, address)
+
+    def test_without_inet_pton(self):
+        inet_pton = socket.inet_pton
+        del socket.inet_pton
+        try:
+            self.test_ipv4()
+            self.test_ipv6()
+            self.test_mapped_ipv4()
+            self.test_invalid()
+        finally:
+            socket.inet_pton = inet_pton
+
+
+class PatternAnalysisTestCase(unittest.TestCase):
+
+    def test_nested_repeat(self):
+        for pattern in ['(a+)+$', r'(?:\w+\s?)*x', r'((ab)*c)+', '(a|b+){2,}',
+                        '(?=(a*)*)']:
+            self.assertTrue(has_nested_repeat(re.compile(pattern)), pattern)
+        for pattern in ['foo', 'a+b+', r'(ab)+', '(a+){1}', '[a-z]+x',
+                        '(a|b)*']:
+            self.assertFalse(has_nested_repeat(re.compile(pattern)), pattern)
+
+    def test_worst_search_time(self):
+        for pattern in ['(a+)+$', '(x+x+)+y', r'(\d+)*x', '(?:a|aa)*b']:
+            self.assertTrue(worst_search_time(re.compile(pattern), 0.05)
+                            > 0.05, pattern)
+        for pattern in ['foo', r'\w+@\w+\.com', '(ab)+c', r'(.*a){3}',
+                        r'[a-z]+\d{2,}']:
+            self.assertTrue(worst_search_time(re.compile(pattern), 0.05)
+                            < 0.05, pattern)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(PatternMatcherTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(NetworkMatcherTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(PatternAnalysisTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -18,7 +18,7 @@ import unittest
 from trac.core import *
 from trac.db.sqlite_backend import _to_sql
 from trac.test import EnvironmentStub, Mock
-from tracspamfilter.model import LogEntry, schema
+from tracspamfilter.model import LogEntry, PatternStatistics, schema
 
 
 class LogEntryTestCase(unittest.TestCase):
@@ -26,11 +26,11 @@ class LogEntryTestCase(unittest.TestCase):
     def setUp(self):
         self.env = EnvironmentStub()
 
-        db = self.env.get_db_cnx()
-        cursor = db.cursor()
-        for table in schema:
-            for stmt in _to_sql(table):
-                cursor.execute(stmt)
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    db(stmt)
 
     def test_purge(self):
         now = datetime.now()
@@ -49,10 +49,74 @@ class LogEntryTestCase(unittest.TestCase):
         entry = log[0]
         self.assertEqual('anonymous', entry.author)
 
+    def test_purge_limit(self):
+        now = datetime.now()
+        oneweekago = time.mktime((now - timedelta(weeks=1)).timetuple())
+        for i in range(3):
+            LogEntry(self.env, oneweekago, '/foo', 'john', False, '127.0.0.1',
+                     '', 'Test', False, 5, []).insert()
+
+        self.assertEqual(2, LogEntry.purge(self.env, days=4, limit=2))
+        self.assertEqual(1, LogEntry.count(self.env))
+        self.assertEqual(1, LogEntry.purge(self.env, days=4, limit=2))
+        self.assertEqual(0, LogEntry.count(self.env))
+
+    def test_count(self):
+        now = datetime.now()
+        oneweekago = time.mktime((now - timedelta(weeks=1)).timetuple())
+        onedayago = time.mktime((now - timedelta(days=1)).timetuple())
+
+        LogEntry(self.env, oneweekago, '/foo', 'john', False, '127.0.0.1',
+                 '', 'Test', False, 5, []).insert()
+        LogEntry(self.env, onedayago, '/foo', 'john', False, '127.0.0.1',
+                 '', 'Test', False, 5, []).insert()
+        LogEntry(self.env, onedayago, '/foo', 'jane', False, '127.0.0.2',
+                 '', 'Test', False, 5, []).insert()
+
+        self.assertEqual(3, LogEntry.count(self.env))
+        self.assertEqual(2, LogEntry.count(self.env, ipnr='127.0.0.1'))
+        self.assertEqual(2, LogEntry.count(self.env, since=onedayago))
+        self.assertEqual(1, LogEntry.count(self.env, ipnr='127.0.0.1',
+                                           since=onedayago))
+
+
+class PatternStatisticsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+
+        with self.env.db_transaction as db:
+            for table in schema:
+                db("DROP TABLE IF EXISTS %s" % table.name)
+                for stmt in _to_sql(table):
+                    db(stmt)
+
+    def test_update(self):
+        PatternStatistics.update(self.env, 'BadContent',
+                                 {'foo': [1, 1000, 2, 0.5],
+                                  'bar': [0, None, 2, 0.25]})
+        PatternStatistics.update(self.env, 'BadContent',
+                                 {'foo': [0, None, 1, 0.25],
+                                  'bar': [2, 2000, 0, 0.0]})
+        PatternStatistics.update(self.env, 'BadIP', {'foo': [1, 10, 0, 0.0]})
+        self.assertEqual({'foo': (1, 1000, 3, 0.75),
+                          'bar': (2, 2000, 2, 0.25)},
+                         PatternStatistics.select(self.env, 'BadContent'))
+
+    def test_delete(self):
+        PatternStatistics.update(self.env, 'BadContent',
+                                 {'foo': [1, 1000, 0, 0.0]})
+        PatternStatistics.update(self.env, 'BadIP', {'foo': [1, 10, 0, 0.0]})
+        PatternStatistics.delete(self.env, 'BadContent')
+        self.assertEqual({}, PatternStatistics.select(self.env, 'BadContent'))
+        self.assertEqual({'foo': (1, 10, 0, 0.0)},
+                         PatternStatistics.select(self.env, 'BadIP'))
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(LogEntryTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(PatternStatisticsTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
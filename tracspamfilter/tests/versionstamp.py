@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+import unittest
+
+from trac.test import EnvironmentStub
+from tracspamfilter.versionstamp import get_system_value, \
+                                        new_version_stamp, set_system_value
+
+
+class VersionStampTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+
+    def tearDown(self):
+        self.env.reset_db()
+
+    def test_set_system_value(self):
+        self.assertEqual(None, get_system_value(self.env.db_query,
+                                                'spamfilter_test'))
+        with self.env.db_transaction as db:
+            set_system_value(db, 'spamfilter_test', 1)
+        self.assertEqual('1', get_system_value(self.env.db_query,
+                                               'spamfilter_test'))
+        with self.env.db_transaction as db:
+            set_system_value(db, 'spamfilter_test', 2)
+        self.assertEqual([('2',)], self.env.db_query(
+            "SELECT value FROM system WHERE name='spamfilter_test'"))
+
+    def test_new_version_stamp(self):
+        with self.env.db_transaction as db:
+            version = new_version_stamp(db, 'spamfilter_test_version')
+            self.assertEqual(version, get_system_value(
+                db, 'spamfilter_test_version'))
+        with self.env.db_transaction as db:
+            self.assertNotEqual(version, new_version_stamp(
+                db, 'spamfilter_test_version'))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(VersionStampTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from Queue import Queue
+from threading import Event
+import unittest
+
+from tracspamfilter.workerpool import WorkerPool
+
+
+class WorkerPoolTestCase(unittest.TestCase):
+
+    def test_run_tasks(self):
+        pool = WorkerPool(2, 10)
+        results = Queue()
+        for i in range(5):
+            self.assertTrue(pool.submit(lambda i=i: results.put(i)))
+        self.assertEqual(range(5), sorted([results.get(True, 5)
+                                           for i in range(5)]))
+        self.assertTrue(len(pool.threads) <= 2)
+
+    def test_refuse_when_full(self):
+        pool = WorkerPool(1, 1)
+        started = Event()
+        release = Event()
+        def block():
+            started.set()
+            release.wait(5)
+        self.assertTrue(pool.submit(block))
+        started.wait(5)
+        self.assertTrue(pool.submit(lambda: None))
+        self.assertFalse(pool.submit(lambda: None))
+        self.assertEqual(1, len(pool.threads))
+        release.set()
+
+    def test_failing_task(self):
+        pool = WorkerPool(1, 10)
+        results = Queue()
+        pool.submit(lambda: 1 / 0)
+        pool.submit(lambda: results.put('done'))
+        self.assertEqual('done', results.get(True, 5))
+
+    def test_get(self):
+        WorkerPool._pool = None
+        try:
+            pool = WorkerPool.get(2, 10)
+            self.assertTrue(pool is WorkerPool.get(4, 10))
+            self.assertEqual(4, pool.size)
+            WorkerPool.get(1, 10)
+            self.assertEqual(4, pool.size)
+        finally:
+            WorkerPool._pool = None
+
+    def test_get_queue_size(self):
+        WorkerPool._pool = None
+        try:
+            pool = WorkerPool.get(1, 10)
+            self.assertEqual(10, pool.queue.maxsize)
+            WorkerPool.get(1, 2)
+            self.assertEqual(2, pool.queue.maxsize)
+        finally:
+            WorkerPool._pool = None
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(WorkerPoolTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main(defaultTest='suite')
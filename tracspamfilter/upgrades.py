@@ -11,7 +11,9 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://projects.edgewall.com/trac/.
 
-from trac.db import Column, DatabaseManager, Table
+import time
+
+from trac.db import Column, DatabaseManager, Index, Table
 
 def _schema_to_sql(env, db, table):
     connector, _ = DatabaseManager(env)._get_connector()
@@ -73,8 +75,88 @@ def add_bayes_table(env, db):
     for stmt in _schema_to_sql(env, db, table):
         cursor.execute(stmt)
 
+def add_indexes_to_log_table(env, db):
+    """Add indexes on the time and IP address columns of the log table."""
+    table = Table('spamfilter_log', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int'),
+        Column('path'),
+        Column('author'),
+        Column('authenticated', type='int'),
+        Column('ipnr'),
+        Column('headers'),
+        Column('content'),
+        Column('rejected', type='int'),
+        Column('karma', type='int'),
+        Column('reasons'),
+        Index(['time']),
+        Index(['ipnr', 'time'])
+    ]
+    cursor = db.cursor()
+    for stmt in _schema_to_sql(env, db, table):
+        if stmt.startswith('CREATE') and ' INDEX ' in stmt:
+            cursor.execute(stmt)
+
+def add_lastseen_column_to_bayes_table(env, db):
+    """Add a column to the bayes table for storing when a word was last
+    trained."""
+    table = Table('spamfilter_bayes', key='word')[
+        Column('word'),
+        Column('nspam', type='int'),
+        Column('nham', type='int'),
+        Column('lastseen', type='int'),
+        Index(['word'])
+    ]
+    cursor = db.cursor()
+    cursor.execute("CREATE TEMPORARY TABLE spamfilter_bayes_old AS "
+                   "SELECT * FROM spamfilter_bayes")
+    cursor.execute("DROP TABLE spamfilter_bayes")
+    for stmt in _schema_to_sql(env, db, table):
+        cursor.execute(stmt)
+    cursor.execute("INSERT INTO spamfilter_bayes (word,nspam,nham,lastseen) "
+                   "SELECT word,nspam,nham,%s FROM spamfilter_bayes_old",
+                   (int(time.time()),))
+    cursor.execute("DROP TABLE spamfilter_bayes_old")
+
+def add_patterns_table(env, db):
+    """Add a table for the statistics of the BadContent patterns."""
+    table = Table('spamfilter_patterns', key=('source', 'pattern'))[
+        Column('source'),
+        Column('pattern'),
+        Column('hits', type='int'),
+        Column('lasthit', type='int'),
+        Column('searches', type='int'),
+        Column('time', type='int64')
+    ]
+    cursor = db.cursor()
+    for stmt in _schema_to_sql(env, db, table):
+        cursor.execute(stmt)
+
+def add_bayes_summary_tables(env, db):
+    """Add tables for the statistics of the Bayes training database, which
+    are computed when they are shown the first time."""
+    tables = [
+        Table('spamfilter_bayes_summary', key='name')[
+            Column('name'),
+            Column('value', type='int')
+        ],
+        Table('spamfilter_bayes_top', key='word')[
+            Column('word'),
+            Column('nspam', type='int'),
+            Column('nham', type='int')
+        ]
+    ]
+    cursor = db.cursor()
+    for table in tables:
+        for stmt in _schema_to_sql(env, db, table):
+            cursor.execute(stmt)
+
 version_map = {
     1: [add_log_table],
     2: [add_headers_column_to_log_table],
-    3: [add_bayes_table]
+    3: [add_bayes_table],
+    4: [add_indexes_to_log_table],
+    5: [add_lastseen_column_to_bayes_table],
+    6: [add_patterns_table],
+    7: [add_bayes_summary_tables]
 }
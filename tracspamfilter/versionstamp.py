@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from uuid import uuid4
+
+__all__ = ['get_system_value', 'set_system_value', 'new_version_stamp']
+
+
+def get_system_value(db, name):
+    """Return the value of `name` in the `system` table, or `None`.
+
+    `db` is a connection or the `db_query` of an environment or a
+    `SQLiteStore`.
+    """
+    for value, in db("SELECT value FROM system WHERE name=%s", (name,)):
+        return value
+
+
+def set_system_value(db, name, value):
+    """Set the value of `name` in the `system` table, adding the row if it
+    doesn't exist yet. `db` is the connection of a transaction."""
+    cursor = db.cursor()
+    cursor.execute("UPDATE system SET value=%s WHERE name=%s", (value, name))
+    if cursor.rowcount < 1:
+        cursor.execute("INSERT INTO system (name,value) VALUES (%s,%s)",
+                       (name, value))
+
+
+def new_version_stamp(db, name):
+    """Store a new random version stamp as `name` in the `system` table and
+    return it.
+
+    Data cached by several processes is marked by a version stamp, which is
+    changed in the transaction changing the data, so that the other
+    processes know they must read it again.
+    """
+    version = uuid4().hex
+    set_system_value(db, name, version)
+    return version
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2012 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.com/license.html.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://projects.edgewall.com/trac/.
+
+from Queue import Full, Queue
+from threading import Lock, Thread
+
+__all__ = ['WorkerPool']
+
+
+class WorkerPool(object):
+    """Run tasks in a fixed number of background threads.
+
+    Tasks are handed over through a bounded queue. When all threads are
+    busy and the queue is full, further tasks are refused instead of
+    starting more threads, so that a service which hangs can't make the
+    number of threads grow with the number of requests. Threads are started
+    when needed, up to the size of the pool.
+
+    There is one pool per process, shared by all environments.
+    """
+
+    _pool = None
+    _pool_lock = Lock()
+
+    def __init__(self, size, queue_size):
+        self.size = max(size, 1)
+        self.queue = Queue(max(queue_size, 1))
+        self.threads = []
+        # tasks waiting or running
+        self.pending = 0
+        self._lock = Lock()
+
+    def get(cls, size, queue_size):
+        """Return the pool of the process, which grows to `size` threads if
+        it is smaller. The queue takes `queue_size` tasks from now on; tasks
+        queued already stay queued."""
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = cls(size, queue_size)
+            pool = cls._pool
+            pool.size = max(pool.size, size)
+            with pool.queue.mutex:
+                pool.queue.maxsize = max(queue_size, 1)
+            return pool
+
+    get = classmethod(get)
+
+    def submit(self, task):
+        """Queue a callable to be run by one of the threads, and return
+        whether it was accepted."""
+        with self._lock:
+            try:
+                self.queue.put_nowait(task)
+            except Full:
+                return False
+            self.pending += 1
+            if len(self.threads) < min(self.pending, self.size):
+                thread = Thread(target=self._run,
+                                name='SpamFilterWorker-%d' % len(self.threads))
+                thread.setDaemon(True)
+                thread.start()
+                self.threads.append(thread)
+        return True
+
+    # Internal methods
+
+    def _run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                task()
+            except Exception:
+                # the tasks log their own errors, the thread must go on
+                pass
+            finally:
+                with self._lock:
+                    self.pending -= 1